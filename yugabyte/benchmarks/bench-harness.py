@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Measures the overhead of run-jepsen.py itself, without a cluster or Leiningen. Every sweep runs a
+copy of run-jepsen.py and its harness package in a scratch directory with fake-lein.py as its
+`lein`, and reports the time the harness spends between and around the tests, and the peak RSS,
+CPU time and disk I/O of the harness process alone. Arguments after `--` are passed to
+run-jepsen.py, e.g.
+
+    ./benchmarks/bench-harness.py --tests 10,100,1000,10000 -- --warm-runner
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RUN_JEPSEN_PATH = os.path.join(os.path.dirname(BENCHMARKS_DIR), "run-jepsen.py")
+HARNESS_PACKAGE_PATH = os.path.join(os.path.dirname(BENCHMARKS_DIR), "harness")
+FAKE_LEIN_PATH = os.path.join(BENCHMARKS_DIR, "fake-lein.py")
+# Only used by run-jepsen.py to parse the version from, nothing is downloaded.
+TARBALL_URL = "https://downloads.yugabyte.com/releases/2.20.1.0/" \
+              "yugabyte-2.20.1.0-b97-linux-x86_64.tar.gz"
+SAMPLE_INTERVAL_SEC = 0.1
+CLOCK_TICKS_PER_SEC = os.sysconf("SC_CLK_TCK")
+
+
+def parse_args():
+    argv = sys.argv[1:]
+    harness_args = []
+    if "--" in argv:
+        harness_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--tests',
+        default="10,100,1000",
+        help='Comma-separated numbers of tests per sweep. Default: 10,100,1000')
+    parser.add_argument('--stdout-lines', type=int, default=200,
+                        help='Lines of output per test. Default: 200')
+    parser.add_argument('--log-lines', type=int, default=1000,
+                        help='Lines of jepsen.log per test. Default: 1000')
+    parser.add_argument('--history-ops', type=int, default=1000,
+                        help='Ops in history.edn per test. Default: 1000')
+    parser.add_argument('--duration-sec', type=float, default=0,
+                        help='Time every test takes besides producing its files. Default: 0')
+    parser.add_argument('--invalid-rate', type=float, default=0.1,
+                        help='Fraction of tests that are invalid. Default: 0.1')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the scratch directories of the sweeps')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON lines')
+    args = parser.parse_args(argv)
+    args.harness_args = harness_args
+    return args
+
+
+def read_proc_stats(pid):
+    """Returns the peak RSS, CPU time and I/O counters of the process, or None once it is gone."""
+    try:
+        with open(f"/proc/{pid}/status") as status_file:
+            status = dict(line.split(":", 1) for line in status_file if ":" in line)
+        with open(f"/proc/{pid}/io") as io_file:
+            io = {key: int(value) for key, value in
+                  (line.split(": ") for line in io_file if ": " in line)}
+        with open(f"/proc/{pid}/stat") as stat_file:
+            # The command name in parentheses may contain spaces, the fields after it don't.
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+    except (OSError, ValueError):
+        return None
+    return {"peak_rss_kb": int(status["VmHWM"].split()[0]),
+            # utime and stime, fields 14 and 15 of /proc/<pid>/stat.
+            "cpu_sec": (int(fields[11]) + int(fields[12])) / CLOCK_TICKS_PER_SEC,
+            "read_bytes": io["read_bytes"],
+            "write_bytes": io["write_bytes"],
+            "rchar": io["rchar"],
+            "wchar": io["wchar"]}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100.0 * len(sorted_values)))]
+
+
+def run_sweep(num_tests, args):
+    work_dir = tempfile.mkdtemp(prefix=f"bench-harness-{num_tests}-")
+    shutil.copy(RUN_JEPSEN_PATH, work_dir)
+    shutil.copytree(HARNESS_PACKAGE_PATH, os.path.join(work_dir, "harness"),
+                    ignore=shutil.ignore_patterns("__pycache__", "tests"))
+    bin_dir = os.path.join(work_dir, "bin")
+    os.mkdir(bin_dir)
+    os.symlink(FAKE_LEIN_PATH, os.path.join(bin_dir, "lein"))
+    timings_path = os.path.join(work_dir, "timings.txt")
+    env = dict(os.environ,
+               PATH=bin_dir + os.pathsep + os.environ["PATH"],
+               FAKE_LEIN_STDOUT_LINES=str(args.stdout_lines),
+               FAKE_LEIN_LOG_LINES=str(args.log_lines),
+               FAKE_LEIN_HISTORY_OPS=str(args.history_ops),
+               FAKE_LEIN_DURATION_SEC=str(args.duration_sec),
+               FAKE_LEIN_INVALID_RATE=str(args.invalid_rate),
+               FAKE_LEIN_TIMINGS=timings_path)
+    cmd = [sys.executable, os.path.join(work_dir, "run-jepsen.py"),
+           "--workloads", "ysql/sz.counter",
+           "--nemeses", "none",
+           "--iterations", str(num_tests),
+           "--url", TARBALL_URL,
+           *args.harness_args]
+
+    start_time = time.monotonic()
+    with open(os.path.join(work_dir, "harness.log"), "wb") as harness_log:
+        child = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=harness_log,
+                                 stderr=subprocess.STDOUT)
+        stats = None
+        while child.poll() is None:
+            stats = read_proc_stats(child.pid) or stats
+            time.sleep(SAMPLE_INTERVAL_SEC)
+    wall_sec = time.monotonic() - start_time
+
+    timings = []
+    if os.path.exists(timings_path):
+        with open(timings_path) as timings_file:
+            timings = sorted(tuple(map(float, line.split())) for line in timings_file)
+    lein_sec = sum(end - start for start, end in timings)
+    # The time between one test ending and the next one starting is spent in the harness.
+    gaps_ms = sorted((next_start - end) * 1000
+                     for (_, end), (next_start, _) in zip(timings, timings[1:]))
+    result = {
+        "tests": num_tests,
+        "tests_run": len(timings),
+        "returncode": child.returncode,
+        "wall_sec": round(wall_sec, 2),
+        "lein_sec": round(lein_sec, 2),
+        "overhead_per_test_ms": round((wall_sec - lein_sec) / max(1, len(timings)) * 1000, 1),
+        "gap_p50_ms": percentile(gaps_ms, 50),
+        "gap_p99_ms": percentile(gaps_ms, 99),
+    }
+    if stats is not None:
+        result.update({
+            "harness_cpu_sec": round(stats["cpu_sec"], 2),
+            "peak_rss_mb": round(stats["peak_rss_kb"] / 1024, 1),
+            "disk_read_mb": round(stats["read_bytes"] / (1 << 20), 1),
+            "disk_write_mb": round(stats["write_bytes"] / (1 << 20), 1),
+            "written_mb": round(stats["wchar"] / (1 << 20), 1),
+        })
+    if args.keep or len(timings) != num_tests:
+        result["work_dir"] = work_dir
+    else:
+        shutil.rmtree(work_dir)
+    return result
+
+
+def main():
+    args = parse_args()
+    columns = ["tests", "wall_sec", "lein_sec", "overhead_per_test_ms", "gap_p50_ms",
+               "gap_p99_ms", "harness_cpu_sec", "peak_rss_mb", "disk_read_mb", "disk_write_mb",
+               "written_mb"]
+    if not args.json:
+        print(" ".join("%14s" % column[:14] for column in columns))
+    failed = False
+    for num_tests in map(int, args.tests.split(",")):
+        result = run_sweep(num_tests, args)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(" ".join("%14s" % ("-" if result.get(column) is None else
+                                     "%.1f" % result[column] if isinstance(result[column], float)
+                                     else result[column])
+                           for column in columns))
+        sys.stdout.flush()
+        # run-jepsen.py fails when any test is invalid, so only check that all tests ran.
+        if result["tests_run"] != num_tests:
+            sys.stderr.write(f"Sweep of {num_tests} tests failed, see "
+                             f"{result.get('work_dir')}/harness.log\n")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
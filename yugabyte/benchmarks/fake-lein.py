@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+A synthetic stand-in for `lein` that bench-harness.py puts on the PATH of run-jepsen.py. It
+understands `lein run test`, `lein run worker` and `lein run analyze` well enough for the harness:
+it creates a run directory in store/ with a jepsen.log and a history.edn, logs the lines the
+harness looks for (phase markers, ops, the verdict) and exits with the code Jepsen would have.
+
+Volumes, durations and verdicts are set with environment variables:
+
+    FAKE_LEIN_STDOUT_LINES   lines of output per test (default 200)
+    FAKE_LEIN_LOG_LINES      lines of jepsen.log per test (default 1000)
+    FAKE_LEIN_HISTORY_OPS    ops in history.edn per test (default 1000)
+    FAKE_LEIN_DURATION_SEC   time a test takes besides writing its files (default 0)
+    FAKE_LEIN_INVALID_RATE   fraction of tests that are invalid (default 0)
+    FAKE_LEIN_TIMINGS        file to append "<start> <end>" wall clock times of every test to
+
+A test started by `lein run test` counts from the start of the process, so that the start-up of
+the interpreter is not taken for harness overhead.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+
+WORKER_RESULT_PREFIX = "@@yugabyte.runner/result "
+# Lines run-jepsen.py detects phases and progress by, see PHASE_MARKERS and WATCHDOG_OP_REGEX.
+LOG_PREFIX = "INFO [2026-01-01 00:00:00,000] jepsen test runner - "
+OP_LINE = "INFO [2026-01-01 00:00:00,000] jepsen worker 0 - jepsen.util {process}\t:{type}\t" \
+          ":read\t{value}"
+
+
+def get_process_start_time():
+    """Wall clock time this process was started at, with the resolution of clock ticks."""
+    with open("/proc/self/stat") as stat_file:
+        # starttime, field 22 of /proc/<pid>/stat, counts clock ticks since boot.
+        start_ticks = int(stat_file.read().rsplit(")", 1)[1].split()[19])
+    return time.time() - (time.clock_gettime(time.CLOCK_BOOTTIME) -
+                          start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+def get_int_env(name, default):
+    return int(os.environ.get(name, default))
+
+
+def get_option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+def write_history(path, num_ops):
+    with open(path, "w") as history:
+        for index in range(num_ops):
+            op_type = "invoke" if index % 2 == 0 else "ok"
+            history.write("{:index %d, :time %d, :type :%s, :process %d, :f :read, :value %s}\n"
+                          % (index, index * 1000000, op_type, index // 2 % 10,
+                             "nil" if op_type == "invoke" else index))
+
+
+def run_test(args, out, start_time):
+    """Runs one `lein run test` with the given arguments, returns the exit code."""
+    workload = get_option(args, "--workload", "none")
+    nemesis = get_option(args, "--nemesis", "none")
+    skip_analysis = "--skip-analysis" in args
+    num_stdout_lines = get_int_env("FAKE_LEIN_STDOUT_LINES", 200)
+    duration_sec = float(os.environ.get("FAKE_LEIN_DURATION_SEC", 0))
+    invalid = random.random() < float(os.environ.get("FAKE_LEIN_INVALID_RATE", 0))
+
+    test_name = f"yb {workload} nemesis {nemesis}".replace("/", " ").replace(" ", "-")
+    timestamp = time.strftime("%Y%m%dT%H%M%S.", time.localtime(start_time)) + \
+        "%06d" % (start_time % 1 * 1e6)
+    run_dir = os.path.join("store", test_name, timestamp)
+    os.makedirs(run_dir)
+    for link_name in ("current", "latest"):
+        link_path = os.path.join("store", link_name)
+        tmp_link_path = f"{link_path}.{os.getpid()}"
+        os.symlink(os.path.join(test_name, timestamp), tmp_link_path)
+        os.replace(tmp_link_path, link_path)
+
+    with open(os.path.join(run_dir, "jepsen.log"), "w") as log:
+        def emit(line):
+            log.write(line + "\n")
+            out.write(line + "\n")
+
+        emit(LOG_PREFIX + "jepsen.core Running test " + test_name)
+        emit(LOG_PREFIX + "jepsen.core Relative time begins now")
+        for index in range(num_stdout_lines):
+            emit(OP_LINE.format(process=index % 10, type="invoke" if index % 2 == 0 else "ok",
+                                value=index))
+        time.sleep(duration_sec)
+        emit(LOG_PREFIX + "jepsen.generator Healing cluster")
+        emit(LOG_PREFIX + "jepsen.core Run complete, writing")
+        # The rest of jepsen.log only goes to the file, as most of a real one would.
+        for index in range(max(0, get_int_env("FAKE_LEIN_LOG_LINES", 1000) - num_stdout_lines)):
+            log.write(LOG_PREFIX + f"jepsen.db Tearing down node n{index % 5 + 1}\n")
+        write_history(os.path.join(run_dir, "history.edn"),
+                      get_int_env("FAKE_LEIN_HISTORY_OPS", 1000))
+        emit(LOG_PREFIX + "jepsen.core Analyzing...")
+        emit(LOG_PREFIX + "jepsen.core Analysis complete")
+        if invalid and not skip_analysis:
+            emit(LOG_PREFIX + "jepsen.core {:valid? false}")
+            emit("Analysis invalid! (ﾉಥ益ಥ）ﾉ ┻━┻")
+            returncode = 1
+        else:
+            emit("Everything looks good! ヽ(‘ー`)ノ")
+            returncode = 0
+    out.flush()
+
+    timings_path = os.environ.get("FAKE_LEIN_TIMINGS")
+    if timings_path:
+        with open(timings_path, "a") as timings:
+            timings.write(f"{start_time} {time.time()}\n")
+    return returncode
+
+
+def run_worker():
+    """`lein run worker`: runs tests sent as JSON arrays of arguments, one per line."""
+    valid_values = {0: "true", 1: "false"}
+    for line in sys.stdin:
+        returncode = run_test(json.loads(line), sys.stdout, time.time())
+        sys.stdout.write(WORKER_RESULT_PREFIX + json.dumps(
+            {"valid": valid_values.get(returncode, "unknown"), "store": None}) + "\n")
+        sys.stdout.flush()
+    return 0
+
+
+def run_analyze(args):
+    """`lein run analyze`: gives the verdict of a test run with --skip-analysis."""
+    if random.random() < float(os.environ.get("FAKE_LEIN_INVALID_RATE", 0)):
+        print(LOG_PREFIX + "jepsen.core {:valid? false}")
+        return 1
+    print("Everything looks good! ヽ(‘ー`)ノ")
+    return 0
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:2] == ["run", "test"]:
+        return run_test(args[2:], sys.stdout, get_process_start_time())
+    if args[:2] == ["run", "worker"]:
+        return run_worker()
+    if args[:2] == ["run", "analyze"]:
+        return run_analyze(args[2:])
+    sys.stderr.write(f"fake-lein.py does not support: {' '.join(args)}\n")
+    return 255
+
+
+if __name__ == "__main__":
+    sys.exit(main())
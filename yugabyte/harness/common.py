@@ -0,0 +1,88 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Records and time limits shared by all parts of run-jepsen.py.
+"""
+
+from collections import namedtuple
+
+CmdResult = namedtuple('CmdResult',
+                       ['output',
+                        'returncode',
+                        'timed_out',
+                        'everything_looks_good'])
+
+# A set of nodes tests can be run against. Every cluster gets its own working directory (and hence
+# its own Jepsen store and logs directory) so that several clusters can be tested concurrently.
+Cluster = namedtuple('Cluster',
+                     ['name',
+                      'nodes',
+                      'work_dir',
+                      'store_dir',
+                      'logs_dir',
+                      'sorted_dir'])
+
+# One entry of the test matrix. test_id is stable across runs and machines, see get_test_id.
+TestSpec = namedtuple('TestSpec',
+                      ['test_id',
+                       'workload',
+                       'nemesis',
+                       'iteration',
+                       'time_limit_sec'])
+
+# A test whose run step has finished, but which has not been classified and reported yet.
+TestRun = namedtuple('TestRun',
+                     ['spec',
+                      'cluster',
+                      'test_index',
+                      'description',
+                      'cmd',
+                      'log_name_prefix',
+                      'result',
+                      'elapsed_time_sec',
+                      'run_dir',
+                      'watchdog',
+                      'phases'])
+
+TestOutcome = namedtuple('TestOutcome',
+                         ['test_id',
+                          'iteration',
+                          'workload',
+                          'nemesis',
+                          'cluster',
+                          'test_name',
+                          'description',
+                          'test_case',
+                          'result',
+                          'elapsed_time_sec',
+                          'time_limit_sec',
+                          'category',
+                          'run_dir',
+                          'phases'])
+
+# Only for workload, doesn't include test results analysis. Customized for the "set" test.
+SINGLE_TEST_RUN_TIME = 600
+
+# The set test might time out if you let it run for 10 minutes and leave 10 more
+# minutes for analysis, so cut its running time in half.
+SINGLE_TEST_RUN_TIME_FOR_SET_TEST = 300
+
+TEST_AND_ANALYSIS_TIMEOUT_SEC = 1200  # Includes test results analysis.
+
+
+def get_default_time_limit(workload):
+    if '/set' in workload:
+        return SINGLE_TEST_RUN_TIME_FOR_SET_TEST
+    return SINGLE_TEST_RUN_TIME
@@ -0,0 +1,73 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Reading and writing result files that the retention policy may have compressed.
+"""
+
+import gzip
+import io
+import os
+import shutil
+
+try:
+    import zstandard
+except ImportError:
+    # Only needed for --retention-compression zstd and for reading files compressed that way.
+    zstandard = None
+
+# File name suffixes of the compression methods --retention-compression can use.
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+COMPRESSION_CHUNK_SIZE = 1024 * 1024
+
+
+def find_maybe_compressed(path):
+    """Returns the path of the file or of its compressed version, whichever exists, or None."""
+    for candidate in [path] + [path + suffix for suffix in COMPRESSION_SUFFIXES.values()]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def is_compressed(path):
+    return path.endswith(tuple(COMPRESSION_SUFFIXES.values()))
+
+
+def open_maybe_compressed(path):
+    """Opens a file for reading bytes, decompressing it if its name says it is compressed."""
+    if path.endswith(COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.open(path, 'rb')
+    if path.endswith(COMPRESSION_SUFFIXES["zstd"]):
+        if zstandard is None:
+            raise IOError(f"Reading {path} needs the zstandard package")
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    return open(path, 'rb')
+
+
+def compress_file(path, method):
+    """Replaces a file with its compressed version, keeping its modification time."""
+    dest_path = path + COMPRESSION_SUFFIXES[method]
+    tmp_path = dest_path + ".tmp"
+    with open(path, 'rb') as src:
+        if method == "zstd":
+            dest = zstandard.ZstdCompressor().stream_writer(open(tmp_path, 'wb'))
+        else:
+            dest = gzip.open(tmp_path, 'wb')
+        with dest:
+            shutil.copyfileobj(src, dest, COMPRESSION_CHUNK_SIZE)
+    shutil.copystat(path, tmp_path)
+    os.replace(tmp_path, dest_path)
+    os.remove(path)
+    return dest_path
@@ -0,0 +1,235 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+A small reader for the EDN Jepsen writes its histories and results in.
+"""
+
+import json
+import re
+
+
+class Keyword(str):
+    """An EDN keyword. Compares equal to its name without the leading colon."""
+
+    def __repr__(self):
+        return ":" + self
+
+
+class Symbol(str):
+    """An EDN symbol."""
+
+
+class EdnParseError(ValueError):
+    pass
+
+
+class EdnParser:
+    """
+    A minimal EDN reader, enough for Jepsen histories: maps, vectors, lists, sets, strings,
+    characters, keywords, symbols, numbers and tagged literals (the tag is dropped, e.g.
+    `#jepsen.history.Op{...}` reads as a plain dict). Values that aren't needed can be skipped
+    without building them, which is what makes reading ops with huge :value fields cheap.
+    """
+
+    WHITESPACE_RE = re.compile(r'(?:[\s,]|;[^\n]*)*')
+    TOKEN_RE = re.compile(r'[^\s,()\[\]{}"\;]+')
+    STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"', re.DOTALL)
+    STRUCTURE_RE = re.compile(r'[()\[\]{}"\\;]')
+    SCALAR_PAIR_RE = re.compile(r'[\s,]*:([^\s,()\[\]{}"\\;]+)[\s,]+([^\s,()\[\]{}"\\;#]+)')
+    INT_RE = re.compile(r'[+-]?\d+N?$')
+    FLOAT_RE = re.compile(r'[+-]?\d+(\.\d*)?([eE][+-]?\d+)?M?$')
+    RATIO_RE = re.compile(r'[+-]?\d+/\d+$')
+    STRING_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '"': '"', '\\': '\\', 'b': '\b',
+                      'f': '\f'}
+    CLOSING = {'{': '}', '[': ']', '(': ')'}
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def at_end(self):
+        self._skip_whitespace()
+        return self.pos >= len(self.text)
+
+    def read(self, skip=False):
+        """Reads the next value. With skip=True the value is only skipped over and None returned."""
+        self._skip_whitespace()
+        if self.pos >= len(self.text):
+            raise EdnParseError("Unexpected end of input")
+        c = self.text[self.pos]
+        if c in self.CLOSING:
+            self.pos += 1
+            if skip:
+                self._skip_collection()
+                return None
+            items = self._read_until(self.CLOSING[c], skip)
+            if c == '{':
+                return self._to_dict(items)
+            return items
+        if c == '"':
+            match = self.STRING_RE.match(self.text, self.pos)
+            if match is None:
+                raise EdnParseError(f"Unterminated string at {self.pos}")
+            self.pos = match.end()
+            return None if skip else self._unescape(match.group(1))
+        if c == '#':
+            return self._read_dispatch(skip)
+        if c == '\\':
+            match = self.TOKEN_RE.match(self.text, self.pos + 2)
+            end = match.end() if match else self.pos + 2
+            name = self.text[self.pos + 1:end]
+            self.pos = end
+            return {'newline': '\n', 'space': ' ', 'tab': '\t', 'return': '\r'}.get(name, name)
+        if c in ')]}':
+            raise EdnParseError(f"Unexpected {c} at {self.pos}")
+        match = self.TOKEN_RE.match(self.text, self.pos)
+        self.pos = match.end()
+        return None if skip else self._parse_token(match.group())
+
+    def read_map(self, keys):
+        """
+        Reads a map (possibly tagged), building only the values of the given keys and skipping
+        all others.
+        """
+        self._skip_whitespace()
+        if self.text.startswith('#', self.pos):
+            self.pos += 1
+            self.read(skip=True)  # The tag
+            self._skip_whitespace()
+        if not self.text.startswith('{', self.pos):
+            raise EdnParseError(f"Expected a map at {self.pos}")
+        self.pos += 1
+        result = {}
+        while True:
+            # Fast path for the common case of a keyword key with a scalar value.
+            match = self.SCALAR_PAIR_RE.match(self.text, self.pos)
+            if match is not None:
+                self.pos = match.end()
+                if match.group(1) in keys:
+                    result[Keyword(match.group(1))] = self._parse_token(match.group(2))
+                continue
+            self._skip_whitespace()
+            if self.text.startswith('}', self.pos):
+                self.pos += 1
+                return result
+            key = self.read()
+            if key in keys:
+                result[key] = self.read()
+            else:
+                self.read(skip=True)
+
+    def _skip_whitespace(self):
+        self.pos = self.WHITESPACE_RE.match(self.text, self.pos).end()
+
+    def _skip_collection(self):
+        """Skips to the end of the collection just opened, jumping from bracket to bracket."""
+        depth = 1
+        while depth:
+            match = self.STRUCTURE_RE.search(self.text, self.pos)
+            if match is None:
+                raise EdnParseError("Unterminated collection")
+            c = match.group()
+            if c == '"':
+                string_match = self.STRING_RE.match(self.text, match.start())
+                if string_match is None:
+                    raise EdnParseError(f"Unterminated string at {match.start()}")
+                self.pos = string_match.end()
+                continue
+            if c == '\\':
+                # A character literal, which may be a bracket itself.
+                self.pos = match.end() + 1
+                continue
+            if c == ';':
+                newline = self.text.find('\n', match.end())
+                self.pos = len(self.text) if newline < 0 else newline
+                continue
+            depth += 1 if c in '([{' else -1
+            self.pos = match.end()
+
+    def _read_until(self, closing, skip):
+        items = None if skip else []
+        while True:
+            self._skip_whitespace()
+            if self.pos >= len(self.text):
+                raise EdnParseError(f"Expected {closing} before the end of input")
+            if self.text[self.pos] == closing:
+                self.pos += 1
+                return items
+            value = self.read(skip)
+            if not skip:
+                items.append(value)
+
+    def _read_dispatch(self, skip):
+        self.pos += 1
+        c = self.text[self.pos:self.pos + 1]
+        if c == '{':
+            self.pos += 1
+            items = self._read_until('}', skip)
+            if skip:
+                return None
+            try:
+                return set(items)
+            except TypeError:
+                return items
+        if c == '_':
+            self.pos += 1
+            self.read(skip=True)
+            return self.read(skip)
+        if c == '#':
+            match = self.TOKEN_RE.match(self.text, self.pos + 1)
+            self.pos = match.end()
+            return {'Inf': float('inf'), '-Inf': float('-inf')}.get(match.group(), float('nan'))
+        # A tagged literal: ignore the tag and read the value.
+        self.read(skip=True)
+        return self.read(skip)
+
+    def _to_dict(self, items):
+        if len(items) % 2:
+            raise EdnParseError("Map with an odd number of forms")
+        result = {}
+        for key, value in zip(items[::2], items[1::2]):
+            if isinstance(key, (list, dict, set)):
+                key = json.dumps(key, default=list, sort_keys=True)
+            result[key] = value
+        return result
+
+    def _unescape(self, s):
+        if '\\' not in s:
+            return s
+        return re.sub(r'\\(u[0-9a-fA-F]{4}|.)',
+                      lambda m: (chr(int(m.group(1)[1:], 16)) if len(m.group(1)) == 5
+                                 else self.STRING_ESCAPES.get(m.group(1), m.group(1))), s)
+
+    def _parse_token(self, token):
+        if token == 'nil':
+            return None
+        if token == 'true':
+            return True
+        if token == 'false':
+            return False
+        if token.startswith(':'):
+            return Keyword(token[1:])
+        if self.INT_RE.match(token):
+            return int(token.rstrip('N'))
+        if self.FLOAT_RE.match(token):
+            return float(token.rstrip('M'))
+        if self.RATIO_RE.match(token):
+            numerator, denominator = token.split('/')
+            return int(numerator) / int(denominator)
+        return Symbol(token)
+
+
+def parse_edn(text):
+    return EdnParser(text).read()
@@ -0,0 +1,323 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Streaming, indexing and summarizing Jepsen histories.
+"""
+
+import bisect
+import gzip
+import json
+import logging
+import math
+import os
+import time
+from array import array
+
+from harness.compression import open_maybe_compressed
+from harness.edn import EdnParseError, EdnParser
+
+# Op fields kept in memory while indexing or analyzing a history.edn.
+HISTORY_INDEX_KEYS = {"type", "f", "process", "time"}
+# Granularity of the time index of a history.edn.
+HISTORY_INDEX_BUCKET_SEC = 1
+# Resolution of op latency histograms.
+HISTOGRAM_BUCKETS_PER_DOUBLING = 8
+
+
+def iter_history_ops(history_path, keys=HISTORY_INDEX_KEYS, start_offset=0):
+    """
+    Streams the ops of a Jepsen history.edn, which has one op map per line. Yields the byte offset
+    of every op together with a dict holding only the requested keys of the op. Offsets in a
+    compressed history are offsets into the decompressed stream. Ops that can't be parsed are
+    skipped with a warning.
+    """
+    with open_maybe_compressed(history_path) as f:
+        f.seek(start_offset)
+        offset = start_offset
+        pending = b''
+        pending_offset = offset
+        for raw_line in f:
+            if pending and raw_line.startswith(b'{'):
+                # Every op starts on a line of its own, so the pending one is corrupt rather than
+                # incomplete.
+                logging.warning("Skipping the unparseable op at offset %d of %s", pending_offset,
+                                history_path)
+                pending = b''
+            if not pending:
+                pending_offset = offset
+            offset += len(raw_line)
+            pending += raw_line
+            text = pending.decode(errors='replace').strip()
+            if not text:
+                pending = b''
+                continue
+            try:
+                op = EdnParser(text).read_map(keys)
+            except EdnParseError:
+                # Strings with raw newlines make an op span several lines.
+                continue
+            pending = b''
+            yield pending_offset, op
+        if pending:
+            logging.warning("Skipping the unparseable op at offset %d of %s", pending_offset,
+                            history_path)
+
+
+class HistoryIndex:
+    """
+    A compact index of a history.edn: the byte offset of every op, op ordinals grouped by
+    process, type and :f, and the first op of every time bucket. It allows jumping straight to the
+    ops of a time window or of a particular process without reading the whole history.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, history_path, bucket_sec=HISTORY_INDEX_BUCKET_SEC):
+        self.history_path = history_path
+        self.bucket_sec = bucket_sec
+        self.history_size = None
+        self.history_mtime_ns = None
+        self.offsets = array('q')
+        self.by_process = {}
+        self.by_type = {}
+        self.by_f = {}
+        self.time_buckets = array('q')
+        self.max_time_ns = 0
+
+    @staticmethod
+    def get_index_path(history_path):
+        return history_path + ".idx.json.gz"
+
+    @classmethod
+    def load_or_build(cls, history_path, rebuild=False):
+        index_path = cls.get_index_path(history_path)
+        if not rebuild and os.path.exists(index_path):
+            index = cls.load(history_path)
+            if index is not None:
+                return index
+        index = cls.build(history_path)
+        index.save()
+        return index
+
+    @classmethod
+    def build(cls, history_path):
+        start_time = time.time()
+        index = cls(history_path)
+        stat = os.stat(history_path)
+        index.history_size = stat.st_size
+        index.history_mtime_ns = stat.st_mtime_ns
+        bucket_ns = int(index.bucket_sec * 1e9)
+        for ordinal, (offset, op) in enumerate(iter_history_ops(history_path)):
+            index.offsets.append(offset)
+            for groups, key in ((index.by_process, "process"), (index.by_type, "type"),
+                                (index.by_f, "f")):
+                groups.setdefault(str(op.get(key)), array('q')).append(ordinal)
+            op_time = op.get("time")
+            if isinstance(op_time, int):
+                index.max_time_ns = max(index.max_time_ns, op_time)
+                while len(index.time_buckets) * bucket_ns <= op_time:
+                    index.time_buckets.append(ordinal)
+        logging.info("Indexed %d ops of %s in %.1f sec", len(index.offsets), history_path,
+                     time.time() - start_time)
+        return index
+
+    @classmethod
+    def load(cls, history_path):
+        """Loads a saved index, or returns None if it is missing or stale."""
+        with gzip.open(cls.get_index_path(history_path), 'rt') as f:
+            data = json.load(f)
+        stat = os.stat(history_path)
+        if (data.get("format") != cls.FORMAT_VERSION or
+                data["history_size"] != stat.st_size or
+                data["history_mtime_ns"] != stat.st_mtime_ns):
+            return None
+        index = cls(history_path, data["bucket_sec"])
+        index.history_size = data["history_size"]
+        index.history_mtime_ns = data["history_mtime_ns"]
+        index.max_time_ns = data["max_time_ns"]
+        index.offsets = delta_decode(data["offsets"])
+        index.time_buckets = delta_decode(data["time_buckets"])
+        for name in ("by_process", "by_type", "by_f"):
+            setattr(index, name, {k: delta_decode(v) for k, v in data[name].items()})
+        return index
+
+    def save(self):
+        data = {
+            "format": self.FORMAT_VERSION,
+            "history_size": self.history_size,
+            "history_mtime_ns": self.history_mtime_ns,
+            "bucket_sec": self.bucket_sec,
+            "max_time_ns": self.max_time_ns,
+            "offsets": delta_encode(self.offsets),
+            "time_buckets": delta_encode(self.time_buckets),
+        }
+        for name in ("by_process", "by_type", "by_f"):
+            data[name] = {k: delta_encode(v) for k, v in getattr(self, name).items()}
+        index_path = self.get_index_path(self.history_path)
+        with gzip.open(index_path + ".tmp", 'wt') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(index_path + ".tmp", index_path)
+
+    def get_ordinal_range(self, start_sec, end_sec):
+        """Returns the range of op ordinals that may have times within [start_sec, end_sec]."""
+        first_bucket = max(0, int(start_sec / self.bucket_sec))
+        if first_bucket >= len(self.time_buckets):
+            return range(0)
+        first = self.time_buckets[first_bucket]
+        # Op times are only roughly monotonic, so read until one bucket past the window end.
+        last_bucket = int(min(end_sec / self.bucket_sec + 2, len(self.time_buckets)))
+        last = (self.time_buckets[last_bucket] if last_bucket < len(self.time_buckets)
+                else len(self.offsets))
+        return range(first, last)
+
+    def select(self, start_sec=None, end_sec=None, process=None, op_type=None, f=None):
+        """Returns the ordinals of the ops within the time window matching all given filters."""
+        if start_sec is None and end_sec is None:
+            window = range(len(self.offsets))
+        else:
+            window = self.get_ordinal_range(start_sec or 0,
+                                            end_sec if end_sec is not None else float('inf'))
+        selected = None
+        for groups, value in ((self.by_process, process), (self.by_type, op_type),
+                              (self.by_f, f)):
+            if value is None:
+                continue
+            ordinals = groups.get(value, array('q'))
+            ordinals = ordinals[bisect.bisect_left(ordinals, window.start):
+                                bisect.bisect_left(ordinals, window.stop)]
+            if selected is None:
+                selected = ordinals
+            else:
+                ordinals = set(ordinals)
+                selected = array('q', [o for o in selected if o in ordinals])
+        return window if selected is None else selected
+
+    def read_ops(self, ordinals, start_sec=None, end_sec=None):
+        """Yields (op time in seconds, raw op line) for the given ordinals within the window."""
+        start_ns = None if start_sec is None else start_sec * 1e9
+        end_ns = None if end_sec is None else end_sec * 1e9
+        # Ordinals are ascending, so a compressed history is only ever read forwards.
+        with open_maybe_compressed(self.history_path) as f:
+            for ordinal in ordinals:
+                f.seek(self.offsets[ordinal])
+                size = (self.offsets[ordinal + 1] - self.offsets[ordinal]
+                        if ordinal + 1 < len(self.offsets) else -1)
+                text = f.read(size).decode(errors='replace').strip()
+                op_time = EdnParser(text).read_map({"time"}).get("time")
+                if start_ns is not None and (op_time is None or op_time < start_ns):
+                    continue
+                if end_ns is not None and (op_time is None or op_time > end_ns):
+                    continue
+                yield (None if op_time is None else op_time / 1e9), text
+
+
+def delta_encode(values):
+    result = []
+    previous = 0
+    for value in values:
+        result.append(value - previous)
+        previous = value
+    return result
+
+
+def delta_decode(deltas):
+    result = array('q')
+    value = 0
+    for delta in deltas:
+        value += delta
+        result.append(value)
+    return result
+
+
+class LatencyHistogram:
+    """
+    A log-scale histogram of latencies, with HISTOGRAM_BUCKETS_PER_DOUBLING buckets per power of 2.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.max_ns = 0
+
+    def add(self, latency_ns):
+        bucket = int(math.log2(max(1, latency_ns)) * HISTOGRAM_BUCKETS_PER_DOUBLING)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.max_ns = max(self.max_ns, latency_ns)
+
+    def percentile_ms(self, p):
+        """Upper bound of the bucket holding the p-th percentile, in milliseconds."""
+        if not self.total:
+            return None
+        rank = max(1, int(math.ceil(p / 100.0 * self.total)))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                upper_ns = 2 ** ((bucket + 1) / HISTOGRAM_BUCKETS_PER_DOUBLING)
+                return min(upper_ns, self.max_ns) / 1e6
+        return self.max_ns / 1e6
+
+
+def compute_history_stats(history_path, start_sec=None, end_sec=None):
+    """
+    Computes per :f latency histograms (invocation to completion, by completion type) and
+    throughput (completions per second) in one streaming pass over a history.
+    """
+    start_ns = None if start_sec is None else start_sec * 1e9
+    end_ns = None if end_sec is None else end_sec * 1e9
+    invocations = {}
+    stats = {}
+    first_ns = None
+    last_ns = None
+    for _, op in iter_history_ops(history_path):
+        op_time = op.get("time")
+        process = op.get("process")
+        if not isinstance(op_time, int) or process == "nemesis":
+            continue
+        if op.get("type") == "invoke":
+            invocations[process] = op_time
+            continue
+        invoke_ns = invocations.pop(process, None)
+        if ((start_ns is not None and op_time < start_ns) or
+                (end_ns is not None and op_time > end_ns)):
+            continue
+        first_ns = op_time if first_ns is None else min(first_ns, op_time)
+        last_ns = op_time if last_ns is None else max(last_ns, op_time)
+        f_stats = stats.setdefault(str(op.get("f")), {})
+        type_stats = f_stats.setdefault(str(op.get("type")),
+                                        {"count": 0, "latency": LatencyHistogram(),
+                                         "per_second": {}})
+        type_stats["count"] += 1
+        second = op_time // 1000000000
+        type_stats["per_second"][second] = type_stats["per_second"].get(second, 0) + 1
+        if invoke_ns is not None:
+            type_stats["latency"].add(op_time - invoke_ns)
+
+    duration_sec = max(1e-9, (last_ns - first_ns) / 1e9) if first_ns is not None else None
+    result = {}
+    for f, f_stats in stats.items():
+        for op_type, type_stats in f_stats.items():
+            histogram = type_stats["latency"]
+            result[(f, op_type)] = {
+                "count": type_stats["count"],
+                "throughput_per_sec": type_stats["count"] / duration_sec,
+                "max_throughput_per_sec": max(type_stats["per_second"].values()),
+                "p50_ms": histogram.percentile_ms(50),
+                "p95_ms": histogram.percentile_ms(95),
+                "p99_ms": histogram.percentile_ms(99),
+                "max_ms": histogram.max_ns / 1e6 if histogram.total else None,
+            }
+    return result
@@ -0,0 +1,101 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+The journal a sweep can be resumed from.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from junit_xml import TestCase
+
+from harness.common import CmdResult, TestOutcome
+
+
+class SweepJournal:
+    """
+    An append-only file with one JSON line per finished test, synced to disk before the next test
+    is reported, so that a sweep which was interrupted can be resumed with everything it had
+    reported so far. A torn last line from a crash is ignored when the journal is loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.journal_file = None
+
+    def load(self):
+        """Returns the outcomes recorded in the journal, oldest first."""
+        outcomes = []
+        if not os.path.exists(self.path):
+            return outcomes
+        with open(self.path) as journal_file:
+            for line_number, line in enumerate(journal_file, 1):
+                try:
+                    outcomes.append(self.outcome_from_json(json.loads(line)))
+                except (ValueError, KeyError, TypeError) as e:
+                    logging.warning("Ignoring line %d of the journal %s: %s", line_number,
+                                    self.path, e)
+        return outcomes
+
+    def open(self, append):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.journal_file = open(self.path, "a" if append else "w")
+        if self.journal_file.tell() > 0:
+            with open(self.path, "rb") as journal_file:
+                journal_file.seek(-1, os.SEEK_END)
+                if journal_file.read() != b"\n":
+                    # Don't let the first new line continue a torn one.
+                    self.journal_file.write("\n")
+        logging.info("Journaling finished tests to %s", self.path)
+
+    def append(self, outcome):
+        line = json.dumps(self.outcome_to_json(outcome)) + "\n"
+        with self.lock:
+            self.journal_file.write(line)
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+
+    def close(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+
+    @staticmethod
+    def outcome_to_json(outcome):
+        tc = outcome.test_case
+        entry = outcome._asdict()
+        entry["result"] = outcome.result._asdict()
+        entry["test_case"] = {"name": tc.name,
+                              "classname": tc.classname,
+                              "elapsed_sec": tc.elapsed_sec,
+                              "url": tc.url,
+                              "stderr": tc.stderr,
+                              "errors": tc.errors,
+                              "failures": tc.failures}
+        return entry
+
+    @staticmethod
+    def outcome_from_json(entry):
+        tc_entry = entry["test_case"]
+        tc = TestCase(name=tc_entry["name"],
+                      classname=tc_entry["classname"],
+                      elapsed_sec=tc_entry["elapsed_sec"],
+                      url=tc_entry["url"],
+                      stderr=tc_entry["stderr"])
+        tc.errors = tc_entry["errors"]
+        tc.failures = tc_entry["failures"]
+        return TestOutcome(**dict(entry, result=CmdResult(**entry["result"]), test_case=tc))
@@ -0,0 +1,248 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Live metrics of a sweep in the OpenMetrics text format.
+"""
+
+import bisect
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Buckets of the duration histograms of --metrics-listen and --metrics-textfile, and how often the
+# text file is rewritten.
+METRICS_TEST_DURATION_BUCKETS_SEC = [60, 120, 300, 600, 900, 1200, 1800, 2700, 3600]
+METRICS_PHASE_DURATION_BUCKETS_SEC = [1, 5, 15, 30, 60, 120, 300, 600, 1200]
+METRICS_HARNESS_GAP_BUCKETS_SEC = [0.1, 0.5, 1, 2, 5, 10, 30, 60, 300]
+METRICS_TEXTFILE_INTERVAL_SEC = 15
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class MetricsHistogram:
+    """A cumulative histogram with fixed bucket bounds, as exposed by MetricsExporter."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds + [math.inf], self.counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else str(float(bound))
+            yield f"{name}_bucket", dict(labels, le=le), cumulative
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, self.total
+
+
+def format_metric_sample(name, labels, value):
+    label_strs = []
+    for key, label_value in labels.items():
+        escaped = str(label_value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        label_strs.append(f'{key}="{escaped}"')
+    labels_str = "{" + ",".join(label_strs) + "}" if label_strs else ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{name}{labels_str} {value}"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.exporter.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("%s: " + format, self.address_string(), *args)
+
+
+class MetricsExporter:
+    """
+    Live metrics of the sweep: finished tests by workload, nemesis and category, test and phase
+    durations, the tests running right now and their age, and the time every cluster spends in the
+    harness between one test stopping and the next one starting on it (reporting, sorting logs,
+    preflights and scheduling). Fed by SweepReport listeners and served in the OpenMetrics text
+    format at /metrics, and/or rewritten periodically to a file for the Prometheus node exporter's
+    textfile collector.
+    """
+
+    def __init__(self, start_time, num_tests):
+        self.start_time = start_time
+        self.num_tests = num_tests
+        self.lock = threading.Lock()
+        self.num_tests_started = 0
+        # Finished tests by (workload, nemesis, category).
+        self.test_counts = {}
+        self.test_durations = {}
+        self.phase_durations = {}
+        self.harness_gaps = {}
+        # (TestSpec, test index, start time) of the test running on each cluster.
+        self.running_tests = {}
+        self.last_stop_times = {}
+        self.server = None
+        self.textfile_path = None
+        self.textfile_thread = None
+        self.stop_event = threading.Event()
+
+    def register(self, report):
+        report.add_start_listener(self.on_start)
+        report.add_stop_listener(self.on_stop)
+        report.add_listener(self.on_outcome)
+
+    def serve(self, listen_address):
+        """Serves /metrics at the given host:port from a background thread."""
+        host, _, port = listen_address.rpartition(":")
+        self.server = ThreadingHTTPServer((host, int(port)), MetricsRequestHandler)
+        self.server.exporter = self
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        logging.info("Serving metrics at http://%s:%s/metrics", host or socket.getfqdn(), port)
+
+    def write_textfile(self, path):
+        """Rewrites the given file with the metrics every METRICS_TEXTFILE_INTERVAL_SEC."""
+        self.textfile_path = path
+        self._write_textfile()
+        self.textfile_thread = threading.Thread(target=self._textfile_loop, name="metrics-textfile",
+                                                daemon=True)
+        self.textfile_thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.textfile_thread is not None:
+            self.textfile_thread.join()
+            self._write_textfile()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def on_start(self, spec, cluster, test_index):
+        now = time.time()
+        with self.lock:
+            self.num_tests_started += 1
+            self.running_tests[cluster.name] = (spec, test_index, now)
+            last_stop_time = self.last_stop_times.pop(cluster.name, None)
+            if last_stop_time is not None:
+                self.harness_gaps.setdefault(
+                    cluster.name, MetricsHistogram(METRICS_HARNESS_GAP_BUCKETS_SEC)).observe(
+                        now - last_stop_time)
+
+    def on_stop(self, test_run):
+        with self.lock:
+            self.running_tests.pop(test_run.cluster.name, None)
+            self.last_stop_times[test_run.cluster.name] = time.time()
+
+    def on_outcome(self, outcome):
+        with self.lock:
+            key = (outcome.workload, outcome.nemesis, outcome.category)
+            self.test_counts[key] = self.test_counts.get(key, 0) + 1
+            if outcome.category == "preflight-failed":
+                return
+            self.test_durations.setdefault(
+                (outcome.workload, outcome.nemesis),
+                MetricsHistogram(METRICS_TEST_DURATION_BUCKETS_SEC)).observe(
+                    outcome.elapsed_time_sec)
+            for phase, sec in (outcome.phases or {}).items():
+                self.phase_durations.setdefault(
+                    (outcome.workload, phase),
+                    MetricsHistogram(METRICS_PHASE_DURATION_BUCKETS_SEC)).observe(sec)
+
+    def render(self, openmetrics=True):
+        """
+        Returns the metrics in the OpenMetrics text format, or in the Prometheus one, which names
+        counter families with their _total suffix and has no # EOF.
+        """
+        now = time.time()
+        lines = []
+
+        def add_family(name, metric_type, help_text, samples):
+            family_name = name
+            if metric_type == "counter" and not openmetrics:
+                family_name += "_total"
+            lines.append(f"# TYPE {family_name} {metric_type}")
+            lines.append(f"# HELP {family_name} {help_text}")
+            lines.extend(format_metric_sample(*sample) for sample in samples)
+
+        with self.lock:
+            add_family("jepsen_sweep_tests", "gauge", "Tests scheduled in the sweep.",
+                       [("jepsen_sweep_tests", {}, self.num_tests)])
+            add_family("jepsen_sweep_elapsed_seconds", "gauge", "Time since the sweep started.",
+                       [("jepsen_sweep_elapsed_seconds", {}, round(now - self.start_time, 3))])
+            add_family("jepsen_tests_started", "counter", "Tests started.",
+                       [("jepsen_tests_started_total", {}, self.num_tests_started)])
+            add_family("jepsen_tests", "counter", "Tests finished, by result category.",
+                       [("jepsen_tests_total",
+                         {"workload": workload, "nemesis": nemesis, "category": category}, count)
+                        for (workload, nemesis, category), count in sorted(
+                            self.test_counts.items())])
+            add_family("jepsen_test_duration_seconds", "histogram",
+                       "Time from starting a test until Jepsen exited.",
+                       [sample for (workload, nemesis), histogram in sorted(
+                           self.test_durations.items())
+                        for sample in histogram.samples(
+                            "jepsen_test_duration_seconds",
+                            {"workload": workload, "nemesis": nemesis})])
+            add_family("jepsen_test_phase_duration_seconds", "histogram",
+                       "Time tests spent in each phase.",
+                       [sample for (workload, phase), histogram in sorted(
+                           self.phase_durations.items())
+                        for sample in histogram.samples(
+                            "jepsen_test_phase_duration_seconds",
+                            {"workload": workload, "phase": phase})])
+            add_family("jepsen_running_test_age_seconds", "gauge",
+                       "Time since the test running on a cluster started.",
+                       [("jepsen_running_test_age_seconds",
+                         {"cluster": cluster_name, "workload": spec.workload,
+                          "nemesis": spec.nemesis, "test_index": test_index},
+                         round(now - test_start_time, 3))
+                        for cluster_name, (spec, test_index, test_start_time) in sorted(
+                            self.running_tests.items())])
+            add_family("jepsen_harness_gap_seconds", "histogram",
+                       "Time a cluster spent in the harness between two tests.",
+                       [sample for cluster_name, histogram in sorted(self.harness_gaps.items())
+                        for sample in histogram.samples("jepsen_harness_gap_seconds",
+                                                        {"cluster": cluster_name})])
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def _textfile_loop(self):
+        while not self.stop_event.wait(METRICS_TEXTFILE_INTERVAL_SEC):
+            self._write_textfile()
+
+    def _write_textfile(self):
+        # The collector must never see a partially written file.
+        tmp_path = f"{self.textfile_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as textfile:
+                textfile.write(self.render(openmetrics=False))
+            os.replace(tmp_path, self.textfile_path)
+        except OSError as e:
+            logging.warning("Failed to write metrics to %s: %s", self.textfile_path, e)
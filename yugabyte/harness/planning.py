@@ -0,0 +1,258 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Building the test matrix, sharding it, and scheduling the tests into the time budget.
+"""
+
+import hashlib
+import heapq
+import json
+import logging
+import threading
+import time
+from collections import deque
+from itertools import combinations
+
+from harness.common import TEST_AND_ANALYSIS_TIMEOUT_SEC, get_default_time_limit
+
+# Used by the adaptive scheduler for workloads without history in the results database.
+DEFAULT_ANALYSIS_TIME_SEC = 120
+# The adaptive scheduler doesn't start tests with a shorter time limit than this.
+MIN_ADAPTIVE_TIME_LIMIT_SEC = 60
+# Analysis time grows with the history, i.e. with the time limit, so leave some extra room for it.
+ADAPTIVE_ANALYSIS_TIME_SAFETY_FACTOR = 1.5
+# Workloads that haven't run for this long get the highest priority from the adaptive scheduler.
+ADAPTIVE_STALENESS_HORIZON_HOURS = 7 * 24
+# With --nemesis-coverage, a fault that failed at least this fraction of the recent runs of a
+# workload is also run alone with it, so that its failures can be told apart from those of the
+# faults it is combined with.
+NEMESIS_PLAN_ISOLATE_FAILURE_RATE = 0.2
+
+
+def get_test_id(workload, nemesis, iteration):
+    """A short ID of a test that is the same on every machine and in every run of the sweep."""
+    return hashlib.sha1(f"{workload}|{nemesis}|{iteration}".encode()).hexdigest()[:12]
+
+
+def plan_nemesis_coverage(workloads, faults, strength, max_faults, failure_rates):
+    """
+    Returns the nemesis sets to run each workload with, so that every combination of `strength`
+    faults is injected together in at least one test of every workload, using sets of up to
+    max_faults faults. "none" is always run alone. The sets are picked greedily by the failure
+    rates of their faults with each workload (see ResultsDb.fault_failure_rates), breaking ties
+    differently per workload so that the workloads see different combinations. Faults failing at
+    least NEMESIS_PLAN_ISOLATE_FAILURE_RATE of the time are run alone as well.
+    The plan only depends on the arguments, so it is the same everywhere given the same failure
+    rates.
+    """
+    real_faults = [fault for fault in faults if fault != "none"]
+    strength = min(strength, len(real_faults))
+    max_faults = max(strength, min(max_faults, len(real_faults)))
+    candidates = [subset for size in range(strength, max_faults + 1)
+                  for subset in combinations(real_faults, size)]
+    plan = {}
+    for workload in workloads:
+        def get_failure_rate(fault):
+            return failure_rates.get((workload, fault), 0)
+
+        nemesis_sets = ["none"] if "none" in faults else []
+        isolated = [fault for fault in real_faults
+                    if get_failure_rate(fault) >= NEMESIS_PLAN_ISOLATE_FAILURE_RATE]
+        nemesis_sets.extend(isolated)
+        uncovered = {} if strength == 0 else {
+            combination: 1 + sum(map(get_failure_rate, combination))
+            for combination in combinations(real_faults, strength)}
+        if strength == 1:
+            for fault in isolated:
+                uncovered.pop((fault,), None)
+        while uncovered:
+            def get_score(subset):
+                covered_weight = sum(uncovered.get(combination, 0)
+                                     for combination in combinations(subset, strength))
+                tie_breaker = hashlib.sha256(f"{workload} {subset}".encode()).hexdigest()
+                return covered_weight, -len(subset), tie_breaker
+
+            best = max(candidates, key=get_score)
+            for combination in combinations(best, strength):
+                uncovered.pop(combination, None)
+            nemesis_sets.append(",".join(best))
+        plan[workload] = nemesis_sets
+    return plan
+
+
+def load_expected_durations(path):
+    """
+    Reads expected test durations from the output of `query --json`, keyed by (workload, nemesis).
+    """
+    durations = {}
+    with open(path) as durations_file:
+        for line in durations_file:
+            if line.strip():
+                row = json.loads(line)
+                durations[(row["workload"], row["nemesis"])] = row["p50_ms"] / 1000.0
+    return durations
+
+
+def get_shard(specs, shard_index, num_shards, expected_durations=None):
+    """
+    Returns the specs of one of num_shards disjoint shards (shard_index is 1-based). Tests are
+    assigned longest first to the shard with the least expected total duration, so shards finish at
+    about the same time. The assignment only depends on the specs and the expected durations, so
+    agents computing their shards independently agree on it as long as they get the same inputs;
+    tests without a known duration are expected to take their time limit plus
+    DEFAULT_ANALYSIS_TIME_SEC.
+    """
+    expected_durations = expected_durations or {}
+
+    def get_expected_duration(spec):
+        return expected_durations.get((spec.workload, spec.nemesis),
+                                      spec.time_limit_sec + DEFAULT_ANALYSIS_TIME_SEC)
+
+    loads = [(0.0, i) for i in range(num_shards)]
+    shard_test_ids = set()
+    for spec in sorted(specs, key=lambda spec: (-get_expected_duration(spec), spec.test_id)):
+        load, i = heapq.heappop(loads)
+        if i == shard_index - 1:
+            shard_test_ids.add(spec.test_id)
+        heapq.heappush(loads, (load + get_expected_duration(spec), i))
+    shard = [spec for spec in specs if spec.test_id in shard_test_ids]
+    logging.info("Shard %d/%d has %d of %d tests, expected duration %.0f sec", shard_index,
+                 num_shards, len(shard), len(specs), sum(map(get_expected_duration, shard)))
+    return shard
+
+
+class FifoScheduler:
+    """
+    Hands out tests to workers in the given order with the default time limits, until the time
+    budget (if any) is exceeded.
+    """
+
+    def __init__(self, specs, max_time_sec, start_time):
+        self.pending = deque(specs)
+        self.max_time_sec = max_time_sec
+        self.start_time = start_time
+        self.lock = threading.Lock()
+        self.budget_exceeded = False
+
+    def get_remaining_time_sec(self):
+        if self.max_time_sec is None:
+            return float('inf')
+        return self.max_time_sec - (time.time() - self.start_time)
+
+    def next_test(self):
+        """Returns the next TestSpec to run, or None if there is nothing more to run."""
+        with self.lock:
+            if self.budget_exceeded or not self.pending:
+                return None
+            if self.get_remaining_time_sec() < 0:
+                logging.info(
+                    "Elapsed time is %.1f seconds, it has exceeded the max allowed time %.1f, "
+                    "stopping", time.time() - self.start_time, self.max_time_sec)
+                self.budget_exceeded = True
+                return None
+            return self._pop_next()
+
+    def stop(self):
+        with self.lock:
+            self.budget_exceeded = True
+
+    def requeue(self, spec):
+        """Puts a test that could not be run back to be handed out next."""
+        with self.lock:
+            self.pending.appendleft(spec)
+
+    def _pop_next(self):
+        return self.pending.popleft()
+
+
+class AdaptiveScheduler(FifoScheduler):
+    """
+    Orders and packs tests into the time budget using the duration history of each workload and
+    nemesis set from the results database. Workloads that failed recently or haven't been run for a
+    while go first. Every test gets a time limit that leaves room for its usual analysis time within
+    both TEST_AND_ANALYSIS_TIMEOUT_SEC and the remaining budget; tests that would not get at least
+    MIN_ADAPTIVE_TIME_LIMIT_SEC are not started.
+    """
+
+    def __init__(self, specs, max_time_sec, start_time, history, num_workers):
+        super().__init__([], max_time_sec, start_time)
+        self.history = history
+        self.num_workers = num_workers
+        self.pending = deque(self._plan(specs))
+
+    def get_analysis_time_sec(self, spec):
+        stats = self.history.get((spec.workload, spec.nemesis))
+        if stats is None or stats["avg_analysis_ms"] is None:
+            return DEFAULT_ANALYSIS_TIME_SEC
+        return max(0, stats["avg_analysis_ms"] / 1000.0)
+
+    def get_max_time_limit(self, spec):
+        """
+        The longest time limit that still leaves the usual analysis time, with a safety margin,
+        before the timeout, but no longer than the workload's default time limit.
+        """
+        default_time_limit = get_default_time_limit(spec.workload)
+        stats = self.history.get((spec.workload, spec.nemesis))
+        if stats is None or stats["avg_analysis_ms"] is None:
+            return default_time_limit
+        analysis_time_sec = self.get_analysis_time_sec(spec)
+        fitting_time_limit = int(TEST_AND_ANALYSIS_TIMEOUT_SEC -
+                                 ADAPTIVE_ANALYSIS_TIME_SAFETY_FACTOR * analysis_time_sec)
+        return max(MIN_ADAPTIVE_TIME_LIMIT_SEC, min(default_time_limit, fitting_time_limit))
+
+    def get_priority(self, spec):
+        stats = self.history.get((spec.workload, spec.nemesis))
+        if stats is None:
+            return 2.0
+        hours_since_last_run = (time.time() - stats["last_started_at"]) / 3600.0
+        staleness = min(1.0, hours_since_last_run / ADAPTIVE_STALENESS_HORIZON_HOURS)
+        return staleness + 2 * stats["failure_rate"]
+
+    def _plan(self, specs):
+        specs = sorted(specs, key=lambda spec: (-self.get_priority(spec), spec.iteration))
+        capacity_sec = self.get_remaining_time_sec() * self.num_workers
+        planned = []
+        skipped = []
+        for spec in specs:
+            analysis_time_sec = self.get_analysis_time_sec(spec)
+            time_limit_sec = int(min(self.get_max_time_limit(spec),
+                                     capacity_sec - analysis_time_sec))
+            if time_limit_sec < MIN_ADAPTIVE_TIME_LIMIT_SEC:
+                skipped.append(spec)
+                continue
+            capacity_sec -= time_limit_sec + analysis_time_sec
+            planned.append(spec._replace(time_limit_sec=time_limit_sec))
+
+        logging.info("Adaptive schedule (%d tests):\n    %s", len(planned), "\n    ".join(
+            f"{spec.workload} ({spec.nemesis}) #{spec.iteration + 1}: time limit "
+            f"{spec.time_limit_sec}s, priority {self.get_priority(spec):.2f}" for spec in planned))
+        if skipped:
+            logging.warning("Tests not fitting into the time budget: %s", ", ".join(
+                f"{spec.workload} ({spec.nemesis}) #{spec.iteration + 1}" for spec in skipped))
+        return planned
+
+    def _pop_next(self):
+        # Durations never match the plan exactly, so shrink the time limit if earlier tests took
+        # longer than expected.
+        while self.pending:
+            spec = self.pending.popleft()
+            analysis_time_sec = self.get_analysis_time_sec(spec)
+            time_limit_sec = int(min(spec.time_limit_sec,
+                                     self.get_remaining_time_sec() - analysis_time_sec))
+            if time_limit_sec >= MIN_ADAPTIVE_TIME_LIMIT_SEC:
+                return spec._replace(time_limit_sec=time_limit_sec)
+            logging.info("Not enough time left for %s (%s) #%d, skipping it", spec.workload,
+                         spec.nemesis, spec.iteration + 1)
+        return None
@@ -0,0 +1,180 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Following a test through its output: the watchdog and the phase timer.
+"""
+
+import logging
+import re
+import threading
+import time
+
+from harness.results import WATCHDOG_FATAL_SIGNATURES
+
+# How long the watchdog lets a test go without new ops while its generator runs.
+WATCHDOG_NO_PROGRESS_SEC = 300
+# How long the watchdog lets a test set up the cluster before its generator starts.
+WATCHDOG_SETUP_TIMEOUT_SEC = 600
+WATCHDOG_CHECK_INTERVAL_SEC = 5
+# Lines Jepsen logs for every op (jepsen.util/log-op) and at the start and end of the generator.
+WATCHDOG_OP_REGEX = re.compile(r" - jepsen\.util \S+\t:(invoke|ok|fail|info)\t")
+WATCHDOG_RUN_START_LINE = "Relative time begins now"
+WATCHDOG_RUN_END_LINE = "Run complete, writing"
+# Lines Jepsen and the test generator (see yugabyte.core/test-2) log when a test enters the phase
+# they start, in the order the phases run. A test is in the "setup" phase until the first of them.
+# "teardown" includes writing the history and downloading the logs of the nodes.
+PHASE_MARKERS = [
+    ("workload", WATCHDOG_RUN_START_LINE),
+    ("recovery", "Healing cluster"),
+    ("teardown", WATCHDOG_RUN_END_LINE),
+    ("analysis", "Analyzing..."),
+    ("finish", "Analysis complete"),
+]
+
+
+class Watchdog:
+    """
+    Aborts a test run as soon as it is clear it cannot produce a useful result, instead of letting
+    it run into TEST_AND_ANALYSIS_TIMEOUT_SEC. It watches the output of the test, which includes
+    everything Jepsen writes to jepsen.log, for WATCHDOG_FATAL_SIGNATURES, and gives up on runs that
+    don't start their generator within the setup timeout or don't log any ops for the no-progress
+    time while the generator runs. The analysis is never interrupted. After an abort, category and
+    reason say why.
+    """
+
+    def __init__(self, no_progress_sec=WATCHDOG_NO_PROGRESS_SEC,
+                 setup_timeout_sec=WATCHDOG_SETUP_TIMEOUT_SEC):
+        self.no_progress_sec = no_progress_sec
+        self.setup_timeout_sec = setup_timeout_sec
+        self.lock = threading.Lock()
+        self.phase = "setup"
+        self.last_progress_time = time.monotonic()
+        self.category = None
+        self.reason = None
+        self.kill = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def watch(self, tails, kill):
+        """Starts watching the output going to the given LogTails. kill aborts the run."""
+        self.kill = kill
+        for tail in tails:
+            tail.add_listener(self.on_line)
+        self.thread = threading.Thread(target=self._run, name="watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def on_line(self, line):
+        if self.category is not None:
+            return
+        for category, pattern in WATCHDOG_FATAL_SIGNATURES:
+            if pattern in line:
+                self._abort(category, f"found {pattern!r} in the output")
+                return
+        with self.lock:
+            if self.phase == "setup":
+                if WATCHDOG_RUN_START_LINE in line:
+                    self.phase = "run"
+                    self.last_progress_time = time.monotonic()
+            elif self.phase == "run":
+                if WATCHDOG_RUN_END_LINE in line:
+                    self.phase = "analysis"
+                elif WATCHDOG_OP_REGEX.search(line):
+                    self.last_progress_time = time.monotonic()
+
+    def _run(self):
+        while not self.stopped.wait(WATCHDOG_CHECK_INTERVAL_SEC):
+            with self.lock:
+                phase = self.phase
+                idle_sec = time.monotonic() - self.last_progress_time
+            if phase == "setup" and idle_sec > self.setup_timeout_sec:
+                self._abort("setup-stuck", f"the generator did not start in {idle_sec:.0f} sec")
+            elif phase == "run" and idle_sec > self.no_progress_sec:
+                self._abort("no-progress", f"no new ops for {idle_sec:.0f} sec")
+
+    def _abort(self, category, reason):
+        with self.lock:
+            if self.category is not None:
+                return
+            self.category = category
+            self.reason = reason
+        logging.error("Watchdog is aborting the test (%s): %s", category, reason)
+        self.kill()
+
+
+class PhaseTimer:
+    """
+    Times the phases of a test (see PHASE_MARKERS) by the time their first line arrives in the
+    output. Phases whose marker never shows up, e.g. the recovery of a workload without a final
+    generator, are left out. If no marker shows up at all, there is no telling where the time went,
+    so all of it is reported as "unknown" rather than as setup.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.marks = [("setup", time.monotonic())]
+        self.next_marker_index = 0
+        self.end_time = None
+
+    def on_line(self, line):
+        with self.lock:
+            for index in range(self.next_marker_index, len(PHASE_MARKERS)):
+                phase, marker = PHASE_MARKERS[index]
+                if marker in line:
+                    self.marks.append((phase, time.monotonic()))
+                    self.next_marker_index = index + 1
+                    return
+
+    def stop(self):
+        with self.lock:
+            self.end_time = time.monotonic()
+
+    def durations(self):
+        """Returns the seconds spent in every phase so far, in order."""
+        with self.lock:
+            end_time = self.end_time if self.end_time is not None else time.monotonic()
+            if len(self.marks) == 1:
+                return {"unknown": round(end_time - self.marks[0][1], 1)}
+            ends = [mark_time for _, mark_time in self.marks[1:]] + [end_time]
+            return {phase: round(phase_end - start, 1)
+                    for (phase, start), phase_end in zip(self.marks, ends)}
+
+
+def get_phase_report(phases_by_workload):
+    """
+    Formats the mean seconds per phase of every workload, given lists of phase durations per
+    workload, marking the phase that takes the longest.
+    """
+    phase_names = ["setup"] + [phase for phase, _ in PHASE_MARKERS] + ["deferred-analysis"]
+    if any("unknown" in phases for runs in phases_by_workload.values() for phases in runs):
+        phase_names.append("unknown")
+    widths = [max(len(name), 8) for name in phase_names]
+    lines = ["%-28s %5s " % ("workload", "runs") +
+             " ".join(name.rjust(width) for name, width in zip(phase_names, widths)) +
+             "  dominant"]
+    for workload, runs in sorted(phases_by_workload.items()):
+        means = {name: sum(phases.get(name, 0) for phases in runs) / len(runs)
+                 for name in phase_names}
+        dominant = max(means, key=means.get)
+        lines.append("%-28s %5d " % (workload, len(runs)) +
+                     " ".join(f"{means[name]:{width}.1f}"
+                              for name, width in zip(phase_names, widths)) +
+                     (f"  {dominant} ({means[dominant] / sum(means.values()):.0%})"
+                      if means[dominant] > 0 else "  -"))
+    return "\n".join(lines)
@@ -0,0 +1,220 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Sending JUnit reports to ReportPortal, with a spool for reports that could not be sent.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+
+# Timeout of a single ReportPortal request.
+REPORTPORTAL_TIMEOUT_SEC = 60
+# ReportPortal requests are retried this many times, backing off exponentially between attempts.
+REPORTPORTAL_MAX_RETRIES = 5
+REPORTPORTAL_BACKOFF_SEC = 2
+REPORTPORTAL_MAX_BACKOFF_SEC = 60
+# How long the end of a sweep waits for the report to be sent before leaving it in the spool.
+REPORTPORTAL_FINISH_TIMEOUT_SEC = 600
+REGEX_MAJOR_VERSION = r"^(\d+)\.(\d+)"
+
+
+class ReportPortalClient:
+    """
+    Imports JUnit reports into ReportPortal over a pooled session. Every request has a timeout and
+    is retried with exponential backoff on connection errors, 429 and 5xx responses. The launch
+    import itself is not retried after a read timeout, since the server may have created the launch
+    already.
+    """
+
+    def __init__(self, base_url, project_name, api_token,
+                 timeout_sec=REPORTPORTAL_TIMEOUT_SEC, max_retries=REPORTPORTAL_MAX_RETRIES):
+        self.api_url = f"{base_url}/api/v1/{project_name}"
+        self.base_url = base_url
+        self.timeout_sec = timeout_sec
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.headers.update({"accept": "*/*", "Authorization": f"bearer {api_token}"})
+
+    def _request(self, method, path, retry_on_timeout=True, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.request(method, self.api_url + path,
+                                                timeout=self.timeout_sec, **kwargs)
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+                error = f"code {response.status_code}: {response.text}"
+            except requests.exceptions.ReadTimeout as e:
+                if not retry_on_timeout:
+                    raise
+                error = e
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            if attempt == self.max_retries:
+                break
+            backoff_sec = min(REPORTPORTAL_MAX_BACKOFF_SEC, REPORTPORTAL_BACKOFF_SEC * 2 ** attempt)
+            logging.warning("%s %s failed (%s), retrying in %.1f sec", method, path, error,
+                            backoff_sec)
+            time.sleep(backoff_sec)
+        raise IOError(f"{method} {path} failed after {self.max_retries + 1} attempts: {error}")
+
+    def send_report(self, xml_report_name, xml_report_content, version, jenkins_url):
+        """Imports the report as a new launch and tags it with the version. Returns success."""
+        try:
+            # Versions of release tarballs have no build number.
+            full_version, _, build_version = version.partition("-b")
+            major_version = ".".join(re.findall(REGEX_MAJOR_VERSION, version)[0])
+            response = self._request(
+                "POST", "/launch/import", retry_on_timeout=False,
+                files={
+                    'file': (f"{major_version}-{xml_report_name}", xml_report_content),
+                    'type': 'text/xml'})
+            if response.status_code == 200:
+                launch_uuid = re.search('(?<=id = )[^ ]+', json.loads(response.text)["message"])[0]
+                logging.info(f"Successfully posted launch {launch_uuid}")
+            else:
+                logging.error(
+                    f"Can't send data to the ReportPortal {self.base_url} due to {response.text} "
+                    f"(code {response.status_code})")
+                return False
+
+            # Need to translate UUID to launch-specific ID
+            response = self._request("GET", f"/launch/uuid/{launch_uuid}")
+            if response.status_code == 200:
+                launch_id = json.loads(response.text)["id"]
+                logging.info(f"Successfully found launch ID {launch_id}")
+            else:
+                logging.error(f"Can't find launch ID for uuid {launch_uuid}")
+                logging.error(f"Code: {response.status_code} Text: {response.text}")
+                return False
+
+            response = self._request(
+                "PUT", f"/launch/{launch_id}/update",
+                json={"attributes": [{"key": "version", "value": full_version},
+                                     {"key": "build", "value": build_version},
+                                     {"key": "jenkins", "value": jenkins_url}]})
+            if response.status_code != 200:
+                logging.error(f"Could not update attributes for launch {launch_id}")
+                logging.error(f"Code: {response.status_code} Text: {response.text}")
+                return False
+        except (IOError, ValueError, KeyError, TypeError, IndexError) as e:
+            logging.error(f"Can't send data to the ReportPortal {self.base_url}: {e}")
+            return False
+
+        logging.info(f"Successfully updated attributes for launch {launch_id}")
+        return True
+
+    def close(self):
+        self.session.close()
+
+
+def spool_report(spool_path, xml_report_name, xml_report_content, version, jenkins_url):
+    tmp_path = spool_path + ".tmp"
+    with open(tmp_path, "w") as spool_file:
+        json.dump({"xml_report_name": xml_report_name,
+                   "xml_report_content": xml_report_content,
+                   "version": version,
+                   "jenkins_url": jenkins_url}, spool_file)
+    os.replace(tmp_path, spool_path)
+
+
+def send_spooled_report(client, spool_path):
+    """Sends a report written by spool_report and removes it once it has been imported."""
+    with open(spool_path) as spool_file:
+        spooled = json.load(spool_file)
+    logging.info("Sending spooled report %s", spool_path)
+    if not client.send_report(**spooled):
+        return False
+    os.remove(spool_path)
+    return True
+
+
+class ReportPortalUploader:
+    """
+    Keeps the JUnit report of the running sweep spooled on disk and sends it to ReportPortal from a
+    background thread. The spool is rewritten after every test (notify() only wakes the thread up,
+    so bursts of finished tests are written once), which means that a crash or a kill loses at most
+    the test in flight. Reports left in the spool by earlier sweeps are sent by a second thread
+    once the report of this sweep has been spooled, so a slow or unreachable server never delays
+    that. finish() sends the final report but waits for at most REPORTPORTAL_FINISH_TIMEOUT_SEC;
+    whatever could not be sent stays in the spool for the `reportportal-replay` subcommand.
+    """
+
+    def __init__(self, client, spool_dir, spool_name, make_report, version, jenkins_url):
+        self.client = client
+        self.spool_dir = spool_dir
+        self.spool_path = os.path.join(spool_dir, spool_name + ".json")
+        self.make_report = make_report
+        self.version = version
+        self.jenkins_url = jenkins_url
+        self.changed = threading.Event()
+        self.finishing = False
+        self.sent = False
+        self.thread = threading.Thread(target=self._run, name="reportportal", daemon=True)
+        self.replay_thread = threading.Thread(target=self._replay, name="reportportal-replay",
+                                              daemon=True)
+
+    def start(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.thread.start()
+
+    def notify(self, outcome=None):
+        self.changed.set()
+
+    def finish(self, timeout_sec=REPORTPORTAL_FINISH_TIMEOUT_SEC):
+        """Sends the final report. Returns whether it was sent within the timeout."""
+        self.finishing = True
+        self.changed.set()
+        deadline = time.time() + timeout_sec
+        self.thread.join(timeout_sec)
+        if self.thread.is_alive():
+            logging.error("Could not send the report to ReportPortal in %d seconds, it is kept in "
+                          "%s", timeout_sec, self.spool_path)
+            return self.sent
+        self.replay_thread.join(max(0, deadline - time.time()))
+        if self.replay_thread.is_alive():
+            logging.warning("Still sending reports of earlier sweeps to ReportPortal, the rest is "
+                            "kept in %s", self.spool_dir)
+        else:
+            self.client.close()
+        return self.sent
+
+    def _run(self):
+        # Spool the report before anything else, so that it survives even if the first test never
+        # finishes, and only then start on the backlog of earlier sweeps.
+        self.changed.set()
+        while True:
+            self.changed.wait()
+            self.changed.clear()
+            finishing = self.finishing
+            xml_report_name, xml_report_content = self.make_report()
+            spool_report(self.spool_path, xml_report_name, xml_report_content, self.version,
+                         self.jenkins_url)
+            if self.replay_thread.ident is None:
+                self.replay_thread.start()
+            if finishing:
+                break
+        self.sent = send_spooled_report(self.client, self.spool_path)
+
+    def _replay(self):
+        for spool_file in sorted(os.listdir(self.spool_dir)):
+            spool_path = os.path.join(self.spool_dir, spool_file)
+            if spool_file.endswith(".json") and spool_path != self.spool_path:
+                send_spooled_report(self.client, spool_path)
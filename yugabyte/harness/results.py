@@ -0,0 +1,198 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Classification of finished test runs into result categories, and sorting of their
+directories by category.
+"""
+
+import errno
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import threading
+import time
+
+from harness.compression import find_maybe_compressed, is_compressed, open_maybe_compressed
+
+# How much of a compressed jepsen.log the classifier decompresses at a time.
+CLASSIFY_CHUNK_SIZE = 16 * 1024 * 1024
+# Written into jepsen.log of a run analyzed with `lein run analyze`, followed by its verdict.
+DEFERRED_ANALYSIS_MARKER = "Deferred analysis result: "
+# Result categories in the order of precedence, each with the jepsen.log line that identifies it.
+# Runs matching none of these are categorized as "no-history" or "unknown".
+RESULT_CATEGORY_PATTERNS = [
+    # The run step of a pipelined test always looks good, so its deferred verdict comes first.
+    ("invalid", DEFERRED_ANALYSIS_MARKER + ":valid? false"),
+    ("valid-unknown", DEFERRED_ANALYSIS_MARKER + ":valid? :unknown"),
+    ("analysis-failed", DEFERRED_ANALYSIS_MARKER + "failed"),
+    ("ok", DEFERRED_ANALYSIS_MARKER + ":valid? true"),
+    ("invalid", ":valid? false"),
+    ("valid-unknown", ":valid? :unknown"),
+    ("timed-out", "Test run timed out!"),
+    ("ok", "Everything looks good!"),
+    ("no-such-method", "jepsen.os.OS.install_build_essential_BANG_"),
+    ("assert-failed-invocation-value",
+     "Caused by: java.lang.AssertionError: Assert failed: invocation value"),
+    ("cant-set-current-length", "set!: *current-length* from non-binding thread"),
+]
+# Written into jepsen.log of a run the watchdog aborted, followed by the category it found.
+WATCHDOG_MARKER = "Watchdog aborted the test: "
+# Output that dooms a test run, as (result category, substring) pairs. More can be given with
+# --watchdog-signatures.
+WATCHDOG_FATAL_SIGNATURES = [
+    (category, pattern) for category, pattern in RESULT_CATEGORY_PATTERNS
+    if category in ("no-such-method", "assert-failed-invocation-value", "cant-set-current-length")]
+# Categories of runs the watchdog aborted because they stopped making progress.
+WATCHDOG_NO_PROGRESS_CATEGORIES = ["setup-stuck", "no-progress"]
+RESULT_CATEGORY_PATTERNS += [
+    (category, WATCHDOG_MARKER + category)
+    for category in [category for category, _ in WATCHDOG_FATAL_SIGNATURES] +
+    WATCHDOG_NO_PROGRESS_CATEGORIES]
+RESULT_CATEGORY_REGEX = None
+
+
+def compile_result_category_regex():
+    global RESULT_CATEGORY_REGEX
+    RESULT_CATEGORY_REGEX = re.compile(b"|".join(b"(" + re.escape(pattern.encode()) + b")"
+                                                 for _, pattern in RESULT_CATEGORY_PATTERNS))
+
+
+compile_result_category_regex()
+
+
+def add_watchdog_signature(category, pattern):
+    """Adds a fatal signature, and makes the classifier recognize runs it aborted."""
+    WATCHDOG_FATAL_SIGNATURES.append((category, pattern))
+    RESULT_CATEGORY_PATTERNS.append((category, WATCHDOG_MARKER + category))
+    compile_result_category_regex()
+
+
+def find_result_category_index(data, best_index=None):
+    for match in RESULT_CATEGORY_REGEX.finditer(data):
+        index = match.lastindex - 1
+        if best_index is None or index < best_index:
+            best_index = index
+            if best_index == 0:
+                break
+    return best_index
+
+
+def classify_jepsen_log(log_path):
+    """
+    Finds the result category of a test from its jepsen.log in a single pass over the
+    memory-mapped file, or over the decompressed stream of a compressed log. Returns None if none
+    of RESULT_CATEGORY_PATTERNS occur in the log.
+    """
+    if is_compressed(log_path):
+        best_index = None
+        with open_maybe_compressed(log_path) as f:
+            pending = b''
+            while best_index != 0:
+                chunk = f.read(CLASSIFY_CHUNK_SIZE)
+                if not chunk:
+                    best_index = find_result_category_index(pending, best_index)
+                    break
+                # Patterns don't span lines, so only complete lines are searched.
+                data = pending + chunk
+                end = data.rfind(b'\n') + 1
+                best_index = find_result_category_index(data[:end], best_index)
+                pending = data[end:]
+    else:
+        with open(log_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                best_index = find_result_category_index(data)
+    return None if best_index is None else RESULT_CATEGORY_PATTERNS[best_index][0]
+
+
+def classify_run_dir(run_dir):
+    log_path = find_maybe_compressed(os.path.join(run_dir, "jepsen.log"))
+    category = None if log_path is None else classify_jepsen_log(log_path)
+    if category is not None:
+        return category
+    if find_maybe_compressed(os.path.join(run_dir, "history.edn")) is None:
+        return "no-history"
+    return "unknown"
+
+
+def get_file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def get_current_run_dir(store_dir):
+    """Returns the run directory the store's `current` link points to, if it still exists."""
+    current_link = os.path.join(store_dir, "current")
+    if not os.path.islink(current_link):
+        return None
+    run_dir = os.path.realpath(current_link)
+    return run_dir if os.path.isfile(os.path.join(run_dir, "jepsen.log")) else None
+
+
+def sort_run_dir(run_dir, store_dir, sorted_dir, summary_name, extra_summary_fields=None):
+    """
+    Classifies a finished test run, moves its directory from the store into
+    <sorted_dir>/<category>/ and appends a JSON line describing it to the summary file.
+    Returns the category and the new location of the run directory.
+    """
+    classify_start_time = time.time()
+    category = classify_run_dir(run_dir)
+    classify_time_sec = time.time() - classify_start_time
+
+    rel_dir_path = os.path.relpath(run_dir, store_dir)
+    dest_dir = os.path.join(sorted_dir, category, rel_dir_path)
+    os.makedirs(os.path.dirname(dest_dir), exist_ok=True)
+    try:
+        os.rename(run_dir, dest_dir)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise e
+        shutil.move(run_dir, dest_dir)
+
+    latest_link = os.path.join(sorted_dir, "latest")
+    tmp_link = f"{latest_link}.{os.getpid()}.{threading.get_ident()}"
+    os.symlink(os.path.join(category, rel_dir_path), tmp_link)
+    os.replace(tmp_link, latest_link)
+
+    summary = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "category": category,
+        "run_dir": rel_dir_path,
+        "classify_time_sec": round(classify_time_sec, 3),
+        "jepsen_log_bytes": get_file_size(os.path.join(dest_dir, "jepsen.log")),
+        "history_bytes": get_file_size(os.path.join(dest_dir, "history.edn")),
+    }
+    summary.update(extra_summary_fields or {})
+    with open(os.path.join(sorted_dir, f"summary_{summary_name}.jsonl"), "a") as summary_file:
+        summary_file.write(json.dumps(summary) + "\n")
+    logging.info("Moved %s results to %s", category, dest_dir)
+    return category, dest_dir
+
+
+def sort_results(store_dir, sorted_dir, summary_name="jepsen"):
+    """Sorts all finished runs found in the store, oldest first."""
+    log_paths = []
+    for dir_path, _, file_names in os.walk(store_dir):
+        if "jepsen.log" in file_names:
+            log_path = os.path.join(dir_path, "jepsen.log")
+            log_paths.append((os.path.getmtime(log_path), dir_path))
+    for _, run_dir in sorted(log_paths):
+        sort_run_dir(run_dir, store_dir, sorted_dir, summary_name)
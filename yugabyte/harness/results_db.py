@@ -0,0 +1,291 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+The local database of past test runs.
+"""
+
+import json
+import math
+import sqlite3
+import threading
+import time
+from itertools import groupby
+
+# Only runs this recent are taken into account when planning based on history.
+HISTORY_MAX_AGE_DAYS = 30
+# Performance of a run is compared with the ok runs of this many most recent other versions, if
+# there are at least PERF_BASELINE_MIN_RUNS of them.
+PERF_BASELINE_VERSIONS = 5
+PERF_BASELINE_MIN_RUNS = 3
+
+
+class ResultsDb:
+    """
+    A local SQLite database with one row per finished test run, indexed for the questions we
+    usually ask about past runs: flake rates and durations per workload and nemesis over the
+    most recent builds.
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            started_at REAL NOT NULL,
+            version TEXT NOT NULL,
+            workload TEXT NOT NULL,
+            nemesis TEXT NOT NULL,
+            category TEXT,
+            duration_ms INTEGER NOT NULL,
+            returncode INTEGER,
+            timed_out INTEGER NOT NULL,
+            everything_looks_good INTEGER NOT NULL,
+            cluster TEXT,
+            run_dir TEXT,
+            build_url TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS runs_by_version ON runs (version, started_at)",
+        "CREATE INDEX IF NOT EXISTS runs_by_test ON runs (workload, nemesis, started_at)",
+        "CREATE INDEX IF NOT EXISTS runs_by_category ON runs (category, started_at)",
+        "CREATE INDEX IF NOT EXISTS runs_by_duration ON runs (workload, nemesis, duration_ms)",
+        """
+        CREATE TABLE IF NOT EXISTS perf_stats (
+            id INTEGER PRIMARY KEY,
+            started_at REAL NOT NULL,
+            version TEXT NOT NULL,
+            workload TEXT NOT NULL,
+            nemesis TEXT NOT NULL,
+            category TEXT,
+            f TEXT NOT NULL,
+            type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            throughput_per_sec REAL,
+            p50_ms REAL,
+            p95_ms REAL,
+            p99_ms REAL,
+            max_ms REAL,
+            run_dir TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS perf_stats_by_test ON perf_stats "
+        "(workload, nemesis, version, started_at)",
+    ]
+    # Columns added after the table was first created, with their types.
+    ADDED_COLUMNS = [
+        ("time_limit_sec", "INTEGER"),
+        # JSON object of seconds per test phase, see PhaseTimer.
+        ("phases", "TEXT"),
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+            existing_columns = {row["name"] for row in
+                                self.conn.execute("PRAGMA table_info(runs)").fetchall()}
+            for column, column_type in self.ADDED_COLUMNS:
+                if column not in existing_columns:
+                    self.conn.execute(f"ALTER TABLE runs ADD COLUMN {column} {column_type}")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def record_run(self, outcome, version, build_url):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO runs (started_at, version, workload, nemesis, category, duration_ms, "
+                "returncode, timed_out, everything_looks_good, cluster, run_dir, build_url, "
+                "time_limit_sec, phases) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time() - outcome.elapsed_time_sec,
+                 version,
+                 outcome.workload,
+                 outcome.nemesis,
+                 outcome.category,
+                 int(outcome.elapsed_time_sec * 1000),
+                 outcome.result.returncode,
+                 int(outcome.result.timed_out),
+                 int(outcome.result.everything_looks_good),
+                 outcome.cluster,
+                 outcome.run_dir,
+                 build_url,
+                 outcome.time_limit_sec,
+                 json.dumps(outcome.phases)))
+
+    def workload_history(self, nemeses, max_age_days=HISTORY_MAX_AGE_DAYS):
+        """
+        Returns recent duration and failure statistics of every workload run with any of the given
+        nemesis sets, keyed by (workload, nemesis). The analysis time comes from the phases of a
+        run (see PhaseTimer); runs recorded before phases were timed count the part of their
+        duration past the time limit instead, which includes setup and teardown.
+        """
+        condition = f"nemesis IN ({', '.join('?' * len(nemeses))}) AND started_at >= ?"
+        params = (*nemeses, time.time() - max_age_days * 24 * 3600)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT workload, nemesis, COUNT(*) AS runs, AVG(duration_ms) AS avg_duration_ms, "
+                "AVG(category IS NOT 'ok') AS failure_rate, MAX(started_at) AS last_started_at "
+                f"FROM runs WHERE {condition} GROUP BY workload, nemesis", params).fetchall()
+            run_rows = self.conn.execute(
+                "SELECT workload, nemesis, duration_ms, time_limit_sec, phases "
+                f"FROM runs WHERE {condition}", params).fetchall()
+        analysis_ms = {}
+        for row in run_rows:
+            phases = json.loads(row["phases"]) if row["phases"] else {}
+            if "analysis" in phases or "deferred-analysis" in phases:
+                run_analysis_ms = 1000 * (phases.get("analysis", 0)
+                                          + phases.get("deferred-analysis", 0))
+            elif row["time_limit_sec"] is not None:
+                run_analysis_ms = row["duration_ms"] - row["time_limit_sec"] * 1000
+            else:
+                continue
+            analysis_ms.setdefault((row["workload"], row["nemesis"]), []).append(run_analysis_ms)
+        history = {}
+        for row in rows:
+            key = (row["workload"], row["nemesis"])
+            history[key] = dict(row)
+            history[key]["avg_analysis_ms"] = (sum(analysis_ms[key]) / len(analysis_ms[key])
+                                               if key in analysis_ms else None)
+        return history
+
+    def fault_failure_rates(self, exclude_version, max_age_days=HISTORY_MAX_AGE_DAYS):
+        """
+        Returns the fraction of recent runs of every workload with a nemesis set including a fault
+        that did not pass, keyed by (workload, fault). Runs of the excluded version, usually the
+        one being tested, are left out.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT workload, nemesis, COUNT(*) AS runs, "
+                "SUM(category IS NOT 'ok') AS failures FROM runs "
+                "WHERE version != ? AND started_at >= ? GROUP BY workload, nemesis",
+                (exclude_version, time.time() - max_age_days * 24 * 3600)).fetchall()
+        totals = {}
+        for row in rows:
+            for fault in row["nemesis"].split(","):
+                runs, failures = totals.get((row["workload"], fault), (0, 0))
+                totals[(row["workload"], fault)] = (runs + row["runs"], failures + row["failures"])
+        return {key: failures / runs for key, (runs, failures) in totals.items()}
+
+    def record_perf_stats(self, outcome, version, stats):
+        """Stores the output of compute_history_stats() for the run of an outcome."""
+        started_at = time.time() - outcome.elapsed_time_sec
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO perf_stats (started_at, version, workload, nemesis, category, f, "
+                "type, count, throughput_per_sec, p50_ms, p95_ms, p99_ms, max_ms, run_dir) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(started_at, version, outcome.workload, outcome.nemesis, outcome.category, f,
+                  op_type, row["count"], row["throughput_per_sec"], row["p50_ms"],
+                  row["p95_ms"], row["p99_ms"], row["max_ms"], outcome.run_dir)
+                 for (f, op_type), row in stats.items()])
+
+    def perf_baseline(self, workload, nemesis, version, num_versions=PERF_BASELINE_VERSIONS):
+        """
+        Returns the performance of the ok runs of a test with the most recent versions other than
+        the given one, as lists of perf_stats rows keyed by (f, type).
+        """
+        with self.lock:
+            versions = [row["version"] for row in self.conn.execute(
+                "SELECT version FROM perf_stats WHERE workload = ? AND nemesis = ? "
+                "AND version != ? AND category = 'ok' GROUP BY version "
+                "ORDER BY MAX(started_at) DESC LIMIT ?",
+                (workload, nemesis, version, num_versions)).fetchall()]
+            rows = self.conn.execute(
+                "SELECT * FROM perf_stats WHERE workload = ? AND nemesis = ? AND category = 'ok' "
+                f"AND version IN ({', '.join('?' * len(versions))})",
+                (workload, nemesis, *versions)).fetchall()
+        baseline = {}
+        for row in rows:
+            baseline.setdefault((row["f"], row["type"]), []).append(dict(row))
+        return baseline
+
+    def recent_versions(self, num_builds):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT version FROM runs GROUP BY version ORDER BY MAX(started_at) DESC LIMIT ?",
+                (num_builds,)).fetchall()
+        return [row["version"] for row in rows]
+
+    def query_runs(self, workload=None, nemesis=None, category=None, versions=None,
+                   since=None, columns="*"):
+        conditions = []
+        params = []
+        for column, value in (("workload", workload), ("nemesis", nemesis),
+                              ("category", category)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if versions is not None:
+            conditions.append(f"version IN ({', '.join('?' * len(versions))})")
+            params.extend(versions)
+        if since is not None:
+            conditions.append("started_at >= ?")
+            params.append(since)
+        sql = f"SELECT {columns} FROM runs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self.lock:
+            return self.conn.execute(sql + " ORDER BY workload, nemesis, duration_ms",
+                                     params).fetchall()
+
+    def phases_by_workload(self, **filters):
+        """Returns the phase durations of the runs matching the filters of query_runs()."""
+        phases_by_workload = {}
+        for row in self.query_runs(columns="workload, phases", **filters):
+            if row["phases"]:
+                phases_by_workload.setdefault(row["workload"], []).append(
+                    json.loads(row["phases"]))
+        return phases_by_workload
+
+    def test_stats(self, **filters):
+        """
+        Returns per (workload, nemesis) run counts, failure counts, flake rates and duration
+        percentiles in milliseconds for the runs matching the filters of query_runs().
+        """
+        stats = []
+        rows = self.query_runs(columns="workload, nemesis, category, duration_ms", **filters)
+        for (workload, nemesis), group in groupby(rows, key=lambda r: (r["workload"],
+                                                                       r["nemesis"])):
+            group = list(group)
+            # Rows are sorted by duration, which is what percentile() expects.
+            durations_ms = [row["duration_ms"] for row in group]
+            num_failed = sum(1 for row in group if row["category"] != "ok")
+            stats.append({
+                "workload": workload,
+                "nemesis": nemesis,
+                "runs": len(group),
+                "failed": num_failed,
+                "flake_rate": num_failed / len(group),
+                "p50_ms": percentile(durations_ms, 50),
+                "p90_ms": percentile(durations_ms, 90),
+                "p99_ms": percentile(durations_ms, 99),
+                "max_ms": durations_ms[-1],
+            })
+        return stats
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
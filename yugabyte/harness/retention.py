@@ -0,0 +1,226 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Keeping the results of past test runs within a disk budget.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import threading
+import time
+from itertools import groupby
+
+from harness.common import TEST_AND_ANALYSIS_TIMEOUT_SEC
+from harness.compression import (COMPRESSION_SUFFIXES, compress_file, find_maybe_compressed,
+                                 is_compressed)
+from harness.history import HistoryIndex
+from harness.results import get_file_size
+
+# Files of finished runs the retention engine compresses, if they are at least this large.
+RETENTION_COMPRESSED_EXTENSIONS = (".edn", ".log", ".txt")
+RETENTION_COMPRESS_MIN_BYTES = 64 * 1024
+# Files modified more recently than this may belong to a test that is still running, and are neither
+# compressed nor deleted.
+RETENTION_MIN_AGE_SEC = TEST_AND_ANALYSIS_TIMEOUT_SEC
+# Output logs of tests in the logs directory, see get_output_log_paths.
+RETENTION_OUTPUT_LOG_SUFFIXES = ("_stdout.log", "_stderr.log")
+# Policy used when --retention-budget-gb is given without --retention-keep.
+DEFAULT_RETENTION_KEEP = "invalid=all"
+
+
+def parse_retention_keep(text):
+    """
+    Parses a retention policy like "ok=20,invalid=all" into a dict of the number of most recent
+    runs to keep per result category, with None for all of them.
+    """
+    policy = {}
+    for item in text.split(","):
+        category, _, keep = item.strip().partition("=")
+        if not category or not keep:
+            raise argparse.ArgumentTypeError(
+                f"Invalid retention policy {item!r}, expected <category>=<count>|all")
+        policy[category] = None if keep == "all" else int(keep)
+    return policy
+
+
+def get_dir_size(path):
+    size = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            size += get_file_size(os.path.join(dir_path, file_name)) or 0
+    return size
+
+
+class RetentionEngine:
+    """
+    Keeps sorted results and output logs of past tests within a disk budget. After every test, a
+    background thread deletes the runs of each result category beyond the number its policy keeps,
+    compresses the histories and logs of the remaining runs and the output logs, and then deletes
+    the oldest output logs and runs until everything fits into the budget. Runs of categories whose
+    policy keeps all of them are never deleted. Runs still in the store are left alone, as they are
+    being run or analyzed, and so are runs that get_protected_run_dirs returns, e.g. those of
+    failures FailureConfirmer has yet to rerun. The budget never deletes anything younger than
+    RETENTION_MIN_AGE_SEC, so the perf regression check still finds the histories it reads.
+    """
+
+    def __init__(self, clusters, budget_bytes, policy, compression, get_protected_run_dirs=None):
+        self.sorted_dirs = sorted({cluster.sorted_dir for cluster in clusters})
+        self.logs_dirs = sorted({cluster.logs_dir for cluster in clusters})
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+        self.compression = compression
+        self.get_protected_run_dirs = get_protected_run_dirs or set
+        self.requested = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self.thread.start()
+        self.request()
+
+    def request(self, outcome=None):
+        """Asks for a pass over the results. Can be registered as a SweepReport listener."""
+        self.requested.set()
+
+    def close(self):
+        """Makes a last pass and waits for it."""
+        self.stopping = True
+        self.requested.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            self.requested.wait()
+            self.requested.clear()
+            stopping = self.stopping
+            try:
+                self.enforce()
+            except Exception:
+                logging.exception("Failed to apply the retention policy")
+            if stopping:
+                return
+
+    def find_runs(self):
+        """Returns (modification time, category, run dir) of all sorted runs."""
+        runs = []
+        for sorted_dir in self.sorted_dirs:
+            if not os.path.isdir(sorted_dir):
+                continue
+            for category in os.listdir(sorted_dir):
+                category_dir = os.path.join(sorted_dir, category)
+                if os.path.islink(category_dir) or not os.path.isdir(category_dir):
+                    continue
+                for dir_path, dir_names, _ in os.walk(category_dir):
+                    log_path = find_maybe_compressed(os.path.join(dir_path, "jepsen.log"))
+                    if log_path is not None:
+                        dir_names.clear()
+                        runs.append((os.path.getmtime(log_path), category, dir_path))
+        return runs
+
+    def find_output_logs(self):
+        """Returns (modification time, path) of all output logs of tests."""
+        logs = []
+        suffixes = tuple(suffix + compression_suffix for suffix in RETENTION_OUTPUT_LOG_SUFFIXES
+                         for compression_suffix in [""] + list(COMPRESSION_SUFFIXES.values()))
+        for logs_dir in self.logs_dirs:
+            if not os.path.isdir(logs_dir):
+                continue
+            for file_name in os.listdir(logs_dir):
+                if file_name.endswith(suffixes):
+                    path = os.path.join(logs_dir, file_name)
+                    logs.append((os.path.getmtime(path), path))
+        return logs
+
+    def enforce(self):
+        protected_run_dirs = {os.path.abspath(run_dir) for run_dir in self.get_protected_run_dirs()}
+        runs = []
+        for category, group in groupby(sorted(self.find_runs(), key=lambda run: run[1]),
+                                       key=lambda run: run[1]):
+            group = sorted(group, reverse=True)
+            keep = self.policy.get(category)
+            if keep is not None:
+                for run in group[keep:]:
+                    if os.path.abspath(run[2]) in protected_run_dirs:
+                        runs.append(run)
+                    else:
+                        self.delete(run[2], f"more than {keep} {category} runs")
+                group = group[:keep]
+            runs.extend(group)
+
+        if self.compression is not None:
+            for _, _, run_dir in runs:
+                for dir_path, _, file_names in os.walk(run_dir):
+                    for file_name in file_names:
+                        if file_name.endswith(RETENTION_COMPRESSED_EXTENSIONS):
+                            self.compress(os.path.join(dir_path, file_name))
+            for _, path in self.find_output_logs():
+                if not is_compressed(path):
+                    self.compress(path)
+
+        if self.budget_bytes is None:
+            return
+        candidates = []
+        total_size = 0
+        for mtime, path in self.find_output_logs():
+            size = get_file_size(path) or 0
+            total_size += size
+            if time.time() - mtime >= RETENTION_MIN_AGE_SEC:
+                candidates.append((mtime, size, path))
+        for mtime, category, run_dir in runs:
+            size = get_dir_size(run_dir)
+            total_size += size
+            if ((category not in self.policy or self.policy[category] is not None) and
+                    time.time() - mtime >= RETENTION_MIN_AGE_SEC and
+                    os.path.abspath(run_dir) not in protected_run_dirs):
+                candidates.append((mtime, size, run_dir))
+        for _, size, path in sorted(candidates):
+            if total_size <= self.budget_bytes:
+                break
+            self.delete(path, "over the disk budget")
+            total_size -= size
+        if total_size > self.budget_bytes:
+            logging.warning("Results take %.2f GB, more than the budget of %.2f GB, even after "
+                            "deleting all runs the retention policy allows to delete",
+                            total_size / (1 << 30), self.budget_bytes / (1 << 30))
+
+    def compress(self, path):
+        try:
+            stat = os.stat(path)
+            if (stat.st_size < RETENTION_COMPRESS_MIN_BYTES or
+                    time.time() - stat.st_mtime < RETENTION_MIN_AGE_SEC):
+                return
+            compress_file(path, self.compression)
+            if os.path.basename(path) == "history.edn":
+                # The index of the uncompressed history is stale now.
+                index_path = HistoryIndex.get_index_path(path)
+                if os.path.exists(index_path):
+                    os.remove(index_path)
+        except OSError as e:
+            logging.warning("Failed to compress %s: %s", path, e)
+
+    @staticmethod
+    def delete(path, reason):
+        logging.info("Deleting %s (%s)", path, reason)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            logging.warning("Failed to delete %s: %s", path, e)
@@ -0,0 +1,183 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+A local cache of YugabyteDB tarballs, served to the nodes over HTTP.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# Default port the tarball cache is served on. It is fixed so that the URLs passed to Jepsen stay
+# the same between sweeps, and nodes don't reinstall a version they already have.
+TARBALL_CACHE_PORT = 8765
+TARBALL_CACHE_MAX_GB = 20
+TARBALL_DOWNLOAD_TIMEOUT_SEC = 60
+TARBALL_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(TARBALL_DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug("%s: " + format, self.address_string(), *args)
+
+
+class TarballCache:
+    """
+    A local cache of YugabyteDB tarballs, served to the nodes over HTTP. Every tarball is stored
+    once as <sha256>/<original file name>, and urls.json maps the URLs it was downloaded from to
+    their checksums, so a version already in the cache needs no network at all. Downloads are
+    checked against the .sha file published next to the tarball when there is one, and cached
+    files are checked against their name before they are served. The least recently used tarballs
+    are evicted when the cache grows over its size limit.
+    """
+
+    def __init__(self, cache_dir, max_size_bytes):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.index_path = os.path.join(cache_dir, "urls.json")
+        self.server = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as index_file:
+            return json.load(index_file)
+
+    def save_index(self, index):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as index_file:
+            json.dump(index, index_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def get_path(self, sha256, url):
+        return os.path.join(self.cache_dir, sha256, os.path.basename(url))
+
+    def fetch(self, url):
+        """Returns the path of the cached tarball for the URL, downloading it if needed."""
+        index = self.load_index()
+        sha256 = index.get(url)
+        if sha256 is not None:
+            path = self.get_path(sha256, url)
+            if os.path.exists(path) and sha256_file(path) == sha256:
+                logging.info("Using cached %s", path)
+                # The modification time orders tarballs for eviction.
+                os.utime(path)
+                return path
+            logging.warning("Cached tarball for %s is missing or corrupt, downloading it again",
+                            url)
+            shutil.rmtree(os.path.join(self.cache_dir, sha256), ignore_errors=True)
+
+        path = self.download(url)
+        index[url] = os.path.basename(os.path.dirname(path))
+        self.save_index(index)
+        self.evict(keep=path)
+        return path
+
+    def download(self, url):
+        expected_sha256 = self.get_published_sha256(url)
+        tmp_path = os.path.join(self.cache_dir, f".download-{os.getpid()}")
+        digest = hashlib.sha256()
+        logging.info("Downloading %s into the tarball cache", url)
+        with requests.get(url, stream=True, timeout=TARBALL_DOWNLOAD_TIMEOUT_SEC) as response:
+            response.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(TARBALL_DOWNLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+        sha256 = digest.hexdigest()
+        if expected_sha256 is not None and sha256 != expected_sha256:
+            os.remove(tmp_path)
+            raise IOError(f"Checksum of {url} is {sha256}, expected {expected_sha256}")
+        path = self.get_path(sha256, url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        logging.info("Cached %s (%d MB, sha256 %s) as %s", url, os.path.getsize(path) >> 20,
+                     sha256, path)
+        return path
+
+    def get_published_sha256(self, url):
+        try:
+            response = requests.get(url + ".sha", timeout=TARBALL_DOWNLOAD_TIMEOUT_SEC)
+        except requests.exceptions.RequestException as e:
+            logging.warning("Could not fetch the checksum of %s: %s", url, e)
+            return None
+        match = re.search(r"\b[0-9a-f]{64}\b", response.text) if response.ok else None
+        if match is None:
+            logging.warning("No published checksum for %s, not verifying it", url)
+            return None
+        return match.group()
+
+    def evict(self, keep):
+        entries = []
+        for sha256 in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, sha256)
+            if not os.path.isdir(entry_dir):
+                continue
+            for file_name in os.listdir(entry_dir):
+                stat = os.stat(os.path.join(entry_dir, file_name))
+                entries.append((stat.st_mtime, stat.st_size, entry_dir))
+        total_size = sum(size for _, size, _ in entries)
+        evicted = set()
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            if entry_dir == os.path.dirname(keep):
+                continue
+            logging.info("Evicting %s from the tarball cache", entry_dir)
+            shutil.rmtree(entry_dir)
+            evicted.add(os.path.basename(entry_dir))
+            total_size -= size
+        if evicted:
+            self.save_index({url: sha256 for url, sha256 in self.load_index().items()
+                             if sha256 not in evicted})
+
+    def serve(self, host, port=TARBALL_CACHE_PORT):
+        """
+        Serves the cache over HTTP from a background thread, on the address the nodes reach this
+        machine at. Port 0 picks any free port.
+        """
+        self.server = ThreadingHTTPServer(
+            (host, port), partial(QuietHTTPRequestHandler, directory=self.cache_dir))
+        threading.Thread(target=self.server.serve_forever, name="tarball-cache",
+                         daemon=True).start()
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+        logging.info("Serving the tarball cache %s at %s/", self.cache_dir, self.base_url)
+
+    def get_local_url(self, url):
+        """Caches the tarball and returns the URL the nodes should install it from."""
+        path = self.fetch(url)
+        return f"{self.base_url}/{os.path.relpath(path, self.cache_dir)}"
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+
+import math
+
+import pytest
+
+from harness.edn import EdnParseError, EdnParser, Keyword, Symbol, parse_edn
+
+
+def test_scalars():
+    assert parse_edn("nil") is None
+    assert parse_edn("true") is True
+    assert parse_edn("42N") == 42
+    assert parse_edn("-1.5e3") == -1500.0
+    assert parse_edn("1/4") == 0.25
+    assert parse_edn(r'"a\"b\né"') == 'a"b\né'
+    assert parse_edn(r"\newline") == "\n"
+    assert math.isinf(parse_edn("##Inf"))
+    assert parse_edn(":valid?") == Keyword("valid?")
+    assert repr(parse_edn(":valid?")) == ":valid?"
+    assert isinstance(parse_edn("jepsen.history/op"), Symbol)
+
+
+def test_collections():
+    value = parse_edn('{:a [1 (2 3)], "b" #{:x}, [1 2] nil} ; comment')
+    assert value == {"a": [1, [2, 3]], "b": {"x"}, "[1, 2]": None}
+
+
+def test_tagged_literals_and_discard():
+    assert parse_edn("#jepsen.history.Op{:type :ok}") == {"type": "ok"}
+    assert parse_edn("[1 #_ 2 3]") == [1, 3]
+
+
+def test_read_map_builds_only_requested_keys():
+    text = ('{:type :ok, :f :txn, :value [[:append 1 "}]"] [:r 2 [1 \\] 2]]], '
+            ':process 3, :time 12, :index 7}')
+    assert EdnParser(text).read_map({"type", "process", "time"}) == {
+        "type": "ok", "process": 3, "time": 12}
+
+
+def test_skip_keeps_position():
+    parser = EdnParser('{:a "x)" :b [\\( {:c 1}]} :next')
+    assert parser.read(skip=True) is None
+    assert parser.read() == "next"
+    assert parser.at_end()
+
+
+@pytest.mark.parametrize("text", ["{:a", "[1 2", '"abc', "{:a}", ")"])
+def test_malformed_input(text):
+    with pytest.raises(EdnParseError):
+        parse_edn(text)
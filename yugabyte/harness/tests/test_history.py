@@ -0,0 +1,148 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import gzip
+import os
+
+import pytest
+
+from harness.edn import Keyword
+from harness.history import (HistoryIndex, compute_history_stats, delta_decode, delta_encode,
+                             iter_history_ops)
+
+
+def make_history(path, num_processes=2, num_seconds=5, compress=False):
+    """
+    Writes a history where every process invokes a read or write every 100 ms that completes
+    10 ms later, plus a nemesis op every second.
+    """
+    lines = []
+    for tick in range(num_seconds * 10):
+        time_ns = tick * 100000000
+        for process in range(num_processes):
+            f = ":read" if tick % 2 else ":write"
+            lines.append(f"{{:type :invoke, :f {f}, :value nil, :process {process}, "
+                         f":time {time_ns + process}}}")
+            lines.append(f"{{:type :ok, :f {f}, :value 1, :process {process}, "
+                         f":time {time_ns + process + 10000000}}}")
+        if tick % 10 == 0:
+            lines.append(f"{{:type :info, :f :start, :value \"partition\", "
+                         f":process :nemesis, :time {time_ns + 50000000}}}")
+    text = "".join(line + "\n" for line in lines)
+    if compress:
+        path += ".gz"
+        with gzip.open(path, "wt") as f:
+            f.write(text)
+    else:
+        with open(path, "w") as f:
+            f.write(text)
+    return path, lines
+
+
+def test_iter_history_ops_offsets(tmp_path):
+    path, lines = make_history(str(tmp_path / "history.edn"))
+    ops = list(iter_history_ops(path))
+    assert len(ops) == len(lines)
+    with open(path, "rb") as f:
+        data = f.read()
+    for (offset, op), line in zip(ops, lines):
+        assert data[offset:].startswith(line.encode())
+        assert set(op) <= {"type", "f", "process", "time"}
+    assert ops[0][1] == {"type": Keyword("invoke"), "f": Keyword("write"), "process": 0,
+                         "time": 0}
+
+
+def test_iter_history_ops_multiline_and_corrupt(tmp_path, caplog):
+    path = str(tmp_path / "history.edn")
+    multiline = '{:type :ok, :f :read, :value "a\nb", :process 0, :time 1}\n'
+    truncated = '{:type :ok, :f :read, :value [1 2\n'
+    with open(path, "w") as f:
+        f.write(multiline + truncated +
+                '{:type :ok, :f :read, :value nil, :process 1, :time 3}\n'
+                '\n'
+                '{:type :ok, :f :read, :value [\n')
+    ops = list(iter_history_ops(path, keys={"process", "time"}))
+    assert ops == [(0, {"process": 0, "time": 1}),
+                   (len(multiline) + len(truncated), {"process": 1, "time": 3})]
+    assert caplog.text.count("Skipping the unparseable op") == 2
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_index_select_and_read_ops(tmp_path, compress):
+    path, lines = make_history(str(tmp_path / "history.edn"), compress=compress)
+    index = HistoryIndex.build(path)
+    assert len(index.offsets) == len(lines)
+    assert index.max_time_ns == 4910000001
+    assert len(index.select()) == len(lines)
+
+    # Nemesis ops aren't numbered processes, but they are indexed all the same.
+    nemesis = list(index.read_ops(index.select(process="nemesis")))
+    assert [time_sec for time_sec, _ in nemesis] == [0.05, 1.05, 2.05, 3.05, 4.05]
+
+    window = list(index.read_ops(index.select(start_sec=2, end_sec=3, process="1", op_type="ok"),
+                                 start_sec=2, end_sec=3))
+    assert len(window) == 10
+    assert all(2 <= time_sec <= 3 for time_sec, _ in window)
+    assert all(":process 1" in text and ":type :ok" in text for _, text in window)
+
+    reads = list(index.read_ops(index.select(f="read")))
+    assert len(reads) == 100
+    assert all(":f :read" in text for _, text in reads)
+
+
+def test_index_open_ended_window(tmp_path):
+    path, lines = make_history(str(tmp_path / "history.edn"))
+    index = HistoryIndex.build(path)
+    ordinals = index.select(start_sec=4)
+    assert ordinals.stop == len(lines)
+    assert [t for t, _ in index.read_ops(ordinals, start_sec=4)][0] == 4.0
+    assert list(index.select(start_sec=10)) == []
+    # The window is widened past its end since op times are only roughly monotonic.
+    nemesis = index.read_ops(index.select(end_sec=0.5, f="start"), end_sec=0.5)
+    assert [t for t, _ in nemesis] == [0.05]
+
+
+def test_index_save_load_and_staleness(tmp_path):
+    path, _ = make_history(str(tmp_path / "history.edn"))
+    index = HistoryIndex.load_or_build(path)
+    assert os.path.exists(HistoryIndex.get_index_path(path))
+    loaded = HistoryIndex.load(path)
+    assert loaded is not None
+    assert loaded.offsets == index.offsets
+    assert loaded.time_buckets == index.time_buckets
+    assert loaded.by_process == index.by_process
+    assert loaded.by_f == index.by_f
+
+    with open(path, "a") as f:
+        f.write("{:type :invoke, :f :read, :process 0, :time 5000000000}\n")
+    assert HistoryIndex.load(path) is None
+    assert len(HistoryIndex.load_or_build(path).offsets) == len(index.offsets) + 1
+
+
+def test_delta_encoding_round_trip():
+    values = [0, 5, 5, 100, 99, 1 << 40]
+    assert list(delta_decode(delta_encode(values))) == values
+
+
+def test_compute_history_stats(tmp_path):
+    path, _ = make_history(str(tmp_path / "history.edn"), num_seconds=2)
+    stats = compute_history_stats(path)
+    assert set(stats) == {("read", "ok"), ("write", "ok")}
+    read = stats[("read", "ok")]
+    assert read["count"] == 20
+    assert read["p50_ms"] == pytest.approx(10, rel=0.1)
+    assert read["max_ms"] == pytest.approx(10)
+
+    window = compute_history_stats(path, start_sec=1, end_sec=2)
+    assert window[("read", "ok")]["count"] == 10
@@ -0,0 +1,83 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import junit_xml
+
+from harness import common
+from harness.journal import SweepJournal
+
+
+def make_outcome(iteration, category="ok"):
+    # Neither TestCase nor TestOutcome are imported by name, or pytest would try to collect them
+    # as test classes.
+    tc = junit_xml.TestCase(name=f"ycql/set-none-{iteration}", classname="jepsen",
+                            elapsed_sec=12.5, url="http://example.com/run", stderr="some output")
+    if category != "ok":
+        tc.add_failure_info(message=category, output="details")
+    return common.TestOutcome(
+        test_id=f"id{iteration}", iteration=iteration, workload="ycql/set", nemesis="none",
+        cluster="cluster-1", test_name=tc.name, description="ycql/set (none)", test_case=tc,
+        result=common.CmdResult(output="out", returncode=0, timed_out=False,
+                                everything_looks_good=category == "ok"),
+        elapsed_time_sec=12.5, time_limit_sec=300, category=category,
+        run_dir="/tmp/store/run", phases={"setup": 1.5, "analysis": 2.0})
+
+
+def assert_same_outcome(loaded, outcome):
+    assert loaded._replace(test_case=None) == outcome._replace(test_case=None)
+    for field in ("name", "classname", "elapsed_sec", "url", "stderr", "errors", "failures"):
+        assert getattr(loaded.test_case, field) == getattr(outcome.test_case, field)
+
+
+def test_round_trip(tmp_path):
+    journal = SweepJournal(str(tmp_path / "sweep" / "journal.jsonl"))
+    assert journal.load() == []
+    outcomes = [make_outcome(0), make_outcome(1, "invalid")]
+    journal.open(append=False)
+    for outcome in outcomes:
+        journal.append(outcome)
+    journal.close()
+
+    loaded = journal.load()
+    assert len(loaded) == len(outcomes)
+    for loaded_outcome, outcome in zip(loaded, outcomes):
+        assert_same_outcome(loaded_outcome, outcome)
+    assert loaded[1].test_case.is_failure()
+
+
+def test_torn_line_is_ignored_and_not_continued(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = SweepJournal(path)
+    journal.open(append=False)
+    journal.append(make_outcome(0))
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"test_id": "id1", "iter')
+
+    assert [outcome.test_id for outcome in journal.load()] == ["id0"]
+    journal.open(append=True)
+    journal.append(make_outcome(2))
+    journal.close()
+    assert [outcome.test_id for outcome in journal.load()] == ["id0", "id2"]
+
+
+def test_open_without_append_starts_over(tmp_path):
+    journal = SweepJournal(str(tmp_path / "journal.jsonl"))
+    journal.open(append=False)
+    journal.append(make_outcome(0))
+    journal.close()
+    journal.open(append=False)
+    journal.append(make_outcome(1))
+    journal.close()
+    assert [outcome.test_id for outcome in journal.load()] == ["id1"]
@@ -0,0 +1,130 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import time
+import urllib.request
+from types import SimpleNamespace
+
+from harness import common
+from harness.metrics import (OPENMETRICS_CONTENT_TYPE, MetricsExporter, MetricsHistogram,
+                             format_metric_sample)
+
+CLUSTER = common.Cluster("cluster-1", ["n1"], "/work", "/work/store", "/work/logs",
+                         "/work/sorted")
+
+
+def make_outcome(category, elapsed_time_sec, phases=None):
+    return SimpleNamespace(workload="ycql/set", nemesis="partition", category=category,
+                           elapsed_time_sec=elapsed_time_sec, phases=phases)
+
+
+def make_exporter():
+    exporter = MetricsExporter(time.time(), 3)
+    spec = SimpleNamespace(workload="ycql/set", nemesis="partition")
+    exporter.on_start(spec, CLUSTER, 1)
+    exporter.on_stop(SimpleNamespace(cluster=CLUSTER))
+    exporter.on_outcome(make_outcome("ok", 250, {"setup": 3, "analysis": 40.5}))
+    exporter.on_start(spec, CLUSTER, 2)
+    exporter.on_stop(SimpleNamespace(cluster=CLUSTER))
+    exporter.on_outcome(make_outcome("invalid", 700))
+    exporter.on_outcome(make_outcome("preflight-failed", 0))
+    exporter.on_start(spec, CLUSTER, 3)
+    return exporter
+
+
+def parse_families(text):
+    """Returns {family name: (type, [sample lines])} of a text exposition."""
+    families = {}
+    family = None
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, metric_type = line.split(" ")
+            family = families[name] = (metric_type, [])
+        elif not line.startswith("#"):
+            family[1].append(line)
+    return families
+
+
+def test_format_metric_sample():
+    assert format_metric_sample("m", {}, 2.0) == "m 2"
+    assert format_metric_sample("m", {}, 2.5) == "m 2.5"
+    assert format_metric_sample("m", {"a": 'x"y\\z\nw', "b": 1}, 3) == \
+        'm{a="x\\"y\\\\z\\nw",b="1"} 3'
+
+
+def test_histogram_samples_are_cumulative():
+    histogram = MetricsHistogram([1, 5])
+    for value in [0.5, 1, 3, 10]:
+        histogram.observe(value)
+    assert list(histogram.samples("h", {"k": "v"})) == [
+        ("h_bucket", {"k": "v", "le": "1.0"}, 2),
+        ("h_bucket", {"k": "v", "le": "5.0"}, 3),
+        ("h_bucket", {"k": "v", "le": "+Inf"}, 4),
+        ("h_sum", {"k": "v"}, 14.5),
+        ("h_count", {"k": "v"}, 4),
+    ]
+
+
+def test_render_openmetrics():
+    text = make_exporter().render()
+    assert text.endswith("\n# EOF\n")
+    families = parse_families(text)
+    # OpenMetrics names counter families without the _total suffix of their samples.
+    assert families["jepsen_tests_started"] == ("counter", ["jepsen_tests_started_total 3"])
+    assert families["jepsen_tests"][0] == "counter"
+    assert ('jepsen_tests_total{workload="ycql/set",nemesis="partition",category="invalid"} 1'
+            in families["jepsen_tests"][1])
+    assert len(families["jepsen_tests"][1]) == 3
+    assert families["jepsen_sweep_tests"] == ("gauge", ["jepsen_sweep_tests 3"])
+
+    # Preflight failures don't count towards test durations.
+    durations = families["jepsen_test_duration_seconds"][1]
+    assert ('jepsen_test_duration_seconds_bucket{workload="ycql/set",nemesis="partition",'
+            'le="300.0"} 1' in durations)
+    assert ('jepsen_test_duration_seconds_bucket{workload="ycql/set",nemesis="partition",'
+            'le="+Inf"} 2' in durations)
+    assert ('jepsen_test_duration_seconds_count{workload="ycql/set",nemesis="partition"} 2'
+            in durations)
+    assert ('jepsen_test_phase_duration_seconds_sum{workload="ycql/set",phase="analysis"} 40.5'
+            in families["jepsen_test_phase_duration_seconds"][1])
+    assert ('jepsen_harness_gap_seconds_count{cluster="cluster-1"} 2'
+            in families["jepsen_harness_gap_seconds"][1])
+    running, = families["jepsen_running_test_age_seconds"][1]
+    assert running.startswith('jepsen_running_test_age_seconds{cluster="cluster-1",'
+                              'workload="ycql/set",nemesis="partition",test_index="3"} ')
+
+
+def test_render_prometheus():
+    text = make_exporter().render(openmetrics=False)
+    assert "# EOF" not in text
+    families = parse_families(text)
+    assert families["jepsen_tests_started_total"] == ("counter",
+                                                      ["jepsen_tests_started_total 3"])
+    assert "jepsen_tests_started" not in families
+
+
+def test_serve_and_textfile(tmp_path):
+    exporter = make_exporter()
+    exporter.serve("127.0.0.1:0")
+    textfile_path = str(tmp_path / "jepsen.prom")
+    exporter.write_textfile(textfile_path)
+    try:
+        port = exporter.server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"] == OPENMETRICS_CONTENT_TYPE
+            assert response.read().decode().endswith("# EOF\n")
+    finally:
+        exporter.close()
+    with open(textfile_path) as textfile:
+        assert "jepsen_tests_started_total 3" in textfile.read()
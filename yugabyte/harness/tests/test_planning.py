@@ -0,0 +1,123 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import time
+from itertools import combinations
+
+import pytest
+
+from harness import common
+from harness.common import TEST_AND_ANALYSIS_TIMEOUT_SEC, get_default_time_limit
+from harness.planning import (MIN_ADAPTIVE_TIME_LIMIT_SEC, AdaptiveScheduler, get_shard,
+                              get_test_id, plan_nemesis_coverage)
+
+WORKLOADS = ["ycql/counter", "ycql/set", "ysql/bank"]
+FAULTS = ["none", "partition", "kill", "pause", "clock-skew", "stop"]
+
+
+def make_specs(workloads, nemeses, iterations):
+    # Not imported by name, or pytest would try to collect it as a test class.
+    return [common.TestSpec(get_test_id(workload, nemesis, iteration), workload, nemesis,
+                            iteration, get_default_time_limit(workload))
+            for workload in workloads for nemesis in nemeses for iteration in range(iterations)]
+
+
+@pytest.mark.parametrize("strength,max_faults", [(1, 1), (2, 2), (2, 3), (3, 4)])
+def test_nemesis_plan_covers_every_combination(strength, max_faults):
+    plan = plan_nemesis_coverage(WORKLOADS, FAULTS, strength, max_faults, {})
+    real_faults = FAULTS[1:]
+    assert set(plan) == set(WORKLOADS)
+    for workload, nemesis_sets in plan.items():
+        assert nemesis_sets[0] == "none"
+        assert "none" not in ",".join(nemesis_sets[1:])
+        sets = [set(nemesis_set.split(",")) for nemesis_set in nemesis_sets[1:]]
+        assert all(strength <= len(s) <= max_faults for s in sets)
+        for combination in combinations(real_faults, strength):
+            assert any(set(combination) <= s for s in sets), (workload, combination)
+        # Far fewer tests than running every combination on its own.
+        if max_faults > strength:
+            assert len(sets) < len(list(combinations(real_faults, strength)))
+
+
+def test_nemesis_plan_is_deterministic_and_varies_per_workload():
+    failure_rates = {("ycql/set", "kill"): 0.1}
+    plan = plan_nemesis_coverage(WORKLOADS, FAULTS, 2, 3, failure_rates)
+    assert plan == plan_nemesis_coverage(list(reversed(WORKLOADS)), FAULTS, 2, 3,
+                                         dict(failure_rates))
+    assert len({tuple(nemesis_sets) for nemesis_sets in plan.values()}) > 1
+
+
+def test_nemesis_plan_isolates_failing_faults():
+    plan = plan_nemesis_coverage(WORKLOADS, FAULTS, 2, 3, {("ycql/set", "pause"): 0.5})
+    assert "pause" in plan["ycql/set"]
+    assert "pause" not in plan["ycql/counter"]
+    # Faults run alone are still combined with the others.
+    assert any("pause" in nemesis_set.split(",") and "," in nemesis_set
+               for nemesis_set in plan["ycql/set"])
+
+
+def test_nemesis_plan_without_none():
+    plan = plan_nemesis_coverage(["ycql/set"], ["partition", "kill"], 2, 2, {})
+    assert plan == {"ycql/set": ["partition,kill"]}
+
+
+def test_shards_are_disjoint_and_complete():
+    specs = make_specs(WORKLOADS, FAULTS, 3)
+    shards = [get_shard(specs, i, 4) for i in range(1, 5)]
+    test_ids = [spec.test_id for shard in shards for spec in shard]
+    assert sorted(test_ids) == sorted(spec.test_id for spec in specs)
+    # Shards keep the matrix order.
+    for shard in shards:
+        assert shard == [spec for spec in specs if spec in shard]
+
+
+def test_shards_are_balanced_and_stable():
+    specs = make_specs(WORKLOADS, FAULTS, 3)
+    durations = {(workload, nemesis): 100.0 * (i + 1)
+                 for i, workload in enumerate(WORKLOADS) for nemesis in FAULTS}
+    loads = [sum(durations[(spec.workload, spec.nemesis)]
+                 for spec in get_shard(specs, i, 4, durations)) for i in range(1, 5)]
+    assert max(loads) - min(loads) <= 300.0
+    assert get_shard(specs, 2, 4, durations) == get_shard(list(reversed(specs)), 2, 4,
+                                                          durations)[::-1]
+
+
+def test_adaptive_scheduler_time_limits():
+    now = time.time()
+    history = {
+        ("ycql/counter", "none"): {"avg_analysis_ms": 600000, "failure_rate": 0.0,
+                                   "last_started_at": now},
+        ("ycql/counter", "kill"): {"avg_analysis_ms": 10000, "failure_rate": 0.5,
+                                   "last_started_at": now},
+        ("ycql/set", "none"): {"avg_analysis_ms": None, "failure_rate": 0.0,
+                               "last_started_at": now},
+    }
+    scheduler = AdaptiveScheduler([], None, now, history, 1)
+    slow, fast, unknown = make_specs(["ycql/counter"], ["none", "kill"], 1) + \
+        make_specs(["ycql/set"], ["none"], 1)
+    assert scheduler.get_max_time_limit(slow) == TEST_AND_ANALYSIS_TIMEOUT_SEC - 900
+    assert scheduler.get_max_time_limit(fast) == get_default_time_limit("ycql/counter")
+    assert scheduler.get_max_time_limit(unknown) == get_default_time_limit("ycql/set")
+    # Recent failures go first.
+    assert scheduler.get_priority(fast) > scheduler.get_priority(slow)
+
+
+def test_adaptive_scheduler_packs_the_budget():
+    now = time.time()
+    specs = make_specs(["ycql/counter"], ["none"], 5)
+    scheduler = AdaptiveScheduler(specs, 1000, now, {}, 1)
+    planned = list(scheduler.pending)
+    assert 0 < len(planned) < len(specs)
+    assert all(spec.time_limit_sec >= MIN_ADAPTIVE_TIME_LIMIT_SEC for spec in planned)
+    assert sum(spec.time_limit_sec for spec in planned) <= 1000
@@ -0,0 +1,93 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from harness import progress
+from harness.progress import PhaseTimer, get_phase_report
+
+# A jepsen.log of a ycql/counter run with a partition nemesis, trimmed to a few lines per phase.
+RECORDED_JEPSEN_LOG_PATH = os.path.join(os.path.dirname(__file__), "data", "jepsen.log")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock of the phase timer with one that only moves when told to."""
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(progress, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def replay(clock, lines):
+    """Feeds log lines to a PhaseTimer as if they arrived at the times they were logged."""
+    timer = None
+    for line in lines:
+        # Lines without a timestamp continue the line before them.
+        if line[:4].isdigit():
+            clock.now = datetime.strptime(line[:23], "%Y-%m-%d %H:%M:%S,%f").timestamp()
+        if timer is None:
+            timer = PhaseTimer()
+        timer.on_line(line)
+    timer.stop()
+    return timer
+
+
+def read_recorded_log():
+    with open(RECORDED_JEPSEN_LOG_PATH, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_recorded_log(clock):
+    durations = replay(clock, read_recorded_log()).durations()
+    assert list(durations) == ["setup", "workload", "recovery", "teardown", "analysis", "finish"]
+    assert durations == {"setup": 69.9, "workload": 300.0, "recovery": 30.9, "teardown": 24.9,
+                         "analysis": 10.3, "finish": 0.4}
+
+
+def test_missing_phase_is_left_out(clock):
+    lines = [line for line in read_recorded_log() if "Healing cluster" not in line]
+    durations = replay(clock, lines).durations()
+    assert list(durations) == ["setup", "workload", "teardown", "analysis", "finish"]
+    assert durations["workload"] == 330.9
+
+
+def test_markers_only_count_in_order(clock):
+    lines = read_recorded_log()
+    # A marker logged again later, e.g. by a nemesis, doesn't move a phase.
+    lines.insert(-3, lines[[i for i, line in enumerate(lines) if "Healing cluster" in line][0]])
+    assert replay(clock, lines).durations()["recovery"] == 30.9
+
+
+def test_no_markers_is_unknown(clock):
+    lines = [line for line in read_recorded_log()
+             if not any(marker in line for _, marker in progress.PHASE_MARKERS)]
+    assert replay(clock, lines).durations() == {"unknown": 436.4}
+
+
+def test_phase_report(clock):
+    phases = replay(clock, read_recorded_log()).durations()
+    report = get_phase_report({"ycql/counter": [phases, phases]}).splitlines()
+    assert report[0].split() == ["workload", "runs", "setup", "workload", "recovery", "teardown",
+                                 "analysis", "finish", "deferred-analysis", "dominant"]
+    assert report[1].split()[:3] == ["ycql/counter", "2", "69.9"]
+    assert report[1].endswith("  workload (69%)")
+
+    report = get_phase_report({"ycql/set": [{"unknown": 12.0}]}).splitlines()
+    assert report[0].split()[-2:] == ["unknown", "dominant"]
+    assert report[1].endswith("  unknown (100%)")
+    assert get_phase_report({"ycql/set": [{"unknown": 0}]}).endswith("  -")
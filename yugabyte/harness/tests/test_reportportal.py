@@ -0,0 +1,143 @@
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import json
+import os
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from harness import reportportal
+from harness.reportportal import (ReportPortalClient, ReportPortalUploader, send_spooled_report,
+                                  spool_report)
+
+RUN_JEPSEN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), "run-jepsen.py")
+
+
+class StubReportPortalHandler(BaseHTTPRequestHandler):
+    """Answers like ReportPortal, failing the first server.num_failures launch imports."""
+
+    def handle_request(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path))
+            fail = self.path.endswith("/launch/import") and self.server.num_failures > 0
+            if fail:
+                self.server.num_failures -= 1
+        if fail:
+            self.send_response(503)
+            self.send_header("Content-Length", "4")
+            self.end_headers()
+            self.wfile.write(b"busy")
+            return
+        if self.path.endswith("/launch/import"):
+            body = {"message": "Launch with id = 0f1e2d3c is successfully imported."}
+        elif "/launch/uuid/" in self.path:
+            body = {"id": 42}
+        else:
+            body = {"message": "Launch with ID = '42' successfully updated."}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(reportportal, "REPORTPORTAL_BACKOFF_SEC", 0.01)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubReportPortalHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.num_failures = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_imports(server):
+    return [path for method, path in server.requests if path.endswith("/launch/import")]
+
+
+def test_retries_server_errors_with_backoff(server):
+    server.num_failures = 2
+    client = ReportPortalClient(server.url, "jepsen", "token", max_retries=3)
+    assert client.send_report("report.xml", "<testsuites/>", "2.20.1.0-b97", "http://jenkins")
+    client.close()
+    assert len(get_imports(server)) == 3
+    assert server.requests[-2:] == [("GET", "/api/v1/jepsen/launch/uuid/0f1e2d3c"),
+                                    ("PUT", "/api/v1/jepsen/launch/42/update")]
+
+
+def test_spooled_report_survives_server_errors(server, tmp_path):
+    server.num_failures = 10
+    spool_path = str(tmp_path / "sweep.json")
+    spool_report(spool_path, "report.xml", "<testsuites/>", "2.20.1.0", "http://jenkins")
+    client = ReportPortalClient(server.url, "jepsen", "token", max_retries=2)
+    assert not send_spooled_report(client, spool_path)
+    assert len(get_imports(server)) == 3
+    assert os.path.exists(spool_path)
+
+    server.num_failures = 0
+    assert send_spooled_report(client, spool_path)
+    assert not os.path.exists(spool_path)
+    client.close()
+
+
+def test_uploader_sends_its_report_and_the_backlog(server, tmp_path):
+    spool_dir = str(tmp_path / "spool")
+    os.makedirs(spool_dir)
+    spool_report(os.path.join(spool_dir, "0-earlier.json"), "earlier.xml", "<testsuites/>",
+                 "2.18.0.0-b1", "http://jenkins")
+    client = ReportPortalClient(server.url, "jepsen", "token")
+    uploader = ReportPortalUploader(client, spool_dir, "1-sweep",
+                                    lambda: ("sweep.xml", "<testsuites/>"), "2.20.1.0-b97",
+                                    "http://jenkins")
+    uploader.start()
+    uploader.notify()
+    assert uploader.finish(30)
+    assert os.listdir(spool_dir) == []
+    assert len(get_imports(server)) == 2
+
+
+def test_replay_subcommand(server, tmp_path):
+    spool_dir = str(tmp_path / "spool")
+    os.makedirs(spool_dir)
+    spool_report(os.path.join(spool_dir, "sweep.json"), "report.xml", "<testsuites/>",
+                 "2.20.1.0-b97", "http://jenkins")
+    with open(os.path.join(spool_dir, "sweep.json.tmp"), "w") as f:
+        f.write("{")
+    server.num_failures = 1
+
+    result = subprocess.run(
+        [sys.executable, RUN_JEPSEN_PATH, "reportportal-replay", "--spool-dir", spool_dir,
+         "--reportportal_base_url", server.url, "--reportportal_project_name", "jepsen",
+         "--reportportal_api_token", "token"],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=60)
+    assert result.returncode == 0, result.stdout
+    # Half-written spool files are left alone.
+    assert os.listdir(spool_dir) == ["sweep.json.tmp"]
+    assert len(get_imports(server)) == 2
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import json
+import os
+from itertools import combinations
+
+import pytest
+
+from harness.results import classify_run_dir, sort_run_dir
+
+# The lines sort-results.sh grepped for, in the order it checked them.
+SORT_RESULTS_SH_ORDER = [
+    ("invalid", ":valid? false"),
+    ("valid-unknown", ":valid? :unknown"),
+    ("timed-out", "Test run timed out!"),
+    ("ok", "Everything looks good!"),
+    ("no-such-method", "jepsen.os.OS.install_build_essential_BANG_"),
+    ("assert-failed-invocation-value",
+     "Caused by: java.lang.AssertionError: Assert failed: invocation value"),
+    ("cant-set-current-length", "set!: *current-length* from non-binding thread"),
+]
+
+
+def make_run_dir(path, lines, history=True, compress=False):
+    os.makedirs(path)
+    text = "".join(f"2024-01-01 00:00:00,000{{GMT}}\tINFO\t[main] jepsen.core - {line}\n"
+                   for line in ["Running test"] + lines)
+    if compress:
+        with gzip.open(os.path.join(path, "jepsen.log.gz"), "wt") as f:
+            f.write(text)
+    else:
+        with open(os.path.join(path, "jepsen.log"), "w") as f:
+            f.write(text)
+    if history:
+        with open(os.path.join(path, "history.edn"), "w") as f:
+            f.write("{:type :invoke, :f :read, :process 0, :time 1}\n")
+    return path
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_precedence_matches_sort_results_sh(tmp_path, compress):
+    pairs = combinations(SORT_RESULTS_SH_ORDER, 2)
+    for i, ((first, first_line), (_, second_line)) in enumerate(pairs):
+        for order, lines in enumerate([[first_line, second_line], [second_line, first_line]]):
+            run_dir = make_run_dir(str(tmp_path / f"{i}-{order}"), lines, compress=compress)
+            assert classify_run_dir(run_dir) == first, lines
+
+
+def test_falls_back_to_no_history_and_unknown(tmp_path):
+    assert classify_run_dir(make_run_dir(str(tmp_path / "a"), [], history=False)) == "no-history"
+    assert classify_run_dir(make_run_dir(str(tmp_path / "b"), [])) == "unknown"
+
+
+def test_deferred_verdict_overrides_run_step(tmp_path):
+    run_dir = make_run_dir(str(tmp_path / "a"), ["Everything looks good!",
+                                                 "Deferred analysis result: :valid? false"])
+    assert classify_run_dir(run_dir) == "invalid"
+
+
+def test_sort_run_dir(tmp_path):
+    store_dir = str(tmp_path / "store")
+    sorted_dir = str(tmp_path / "results-sorted")
+    run_dir = make_run_dir(os.path.join(store_dir, "yb-ycql-set", "20240101T000000"),
+                           [":valid? :unknown"])
+
+    category, dest_dir = sort_run_dir(run_dir, store_dir, sorted_dir, "none", {"workload": "set"})
+
+    assert category == "valid-unknown"
+    assert dest_dir == os.path.join(sorted_dir, "valid-unknown", "yb-ycql-set", "20240101T000000")
+    assert not os.path.exists(run_dir)
+    assert os.path.realpath(os.path.join(sorted_dir, "latest")) == dest_dir
+    with open(os.path.join(sorted_dir, "summary_none.jsonl")) as f:
+        summary = json.loads(f.read())
+    assert summary["category"] == "valid-unknown"
+    assert summary["run_dir"] == os.path.join("yb-ycql-set", "20240101T000000")
+    assert summary["workload"] == "set"
@@ -22,36 +22,125 @@ A script to run multiple YugaByte DB Jepsen tests in a loop and organize the res
 """
 
 import argparse
+import gzip
+import hashlib
 import json
 import logging
+import math
 import os
 import re
 import subprocess
-from collections import namedtuple
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import atexit
 import errno
+import queue
+import selectors
+import shlex
+import shutil
+import signal
+import socket
 import sys
+import tempfile
 import time
 from itertools import zip_longest, chain
 
-import requests
 from junit_xml import TestCase, TestSuite, to_xml_report_string
 
-CmdResult = namedtuple('CmdResult',
-                       ['output',
-                        'returncode',
-                        'timed_out',
-                        'everything_looks_good'])
-
-# Only for workload, doesn't include test results analysis. Customized for the "set" test.
-SINGLE_TEST_RUN_TIME = 600
-
-# The set test might time out if you let it run for 10 minutes and leave 10 more
-# minutes for analysis, so cut its running time in half.
-SINGLE_TEST_RUN_TIME_FOR_SET_TEST = 300
-
-TEST_AND_ANALYSIS_TIMEOUT_SEC = 1200  # Includes test results analysis.
+from harness.common import (Cluster, CmdResult, TEST_AND_ANALYSIS_TIMEOUT_SEC, TestOutcome, TestRun,
+                            TestSpec, get_default_time_limit)
+from harness.compression import COMPRESSION_SUFFIXES, find_maybe_compressed, zstandard
+from harness.history import HistoryIndex, compute_history_stats, iter_history_ops
+from harness.journal import SweepJournal
+from harness.metrics import METRICS_TEXTFILE_INTERVAL_SEC, MetricsExporter
+from harness.planning import (AdaptiveScheduler, FifoScheduler, get_shard, get_test_id,
+                              load_expected_durations, plan_nemesis_coverage)
+from harness.progress import (PhaseTimer, WATCHDOG_NO_PROGRESS_SEC, WATCHDOG_SETUP_TIMEOUT_SEC,
+                              Watchdog, get_phase_report)
+from harness.reportportal import ReportPortalClient, ReportPortalUploader, send_spooled_report
+from harness.results import (DEFERRED_ANALYSIS_MARKER, WATCHDOG_MARKER, add_watchdog_signature,
+                             get_current_run_dir, sort_results, sort_run_dir)
+from harness.results_db import PERF_BASELINE_MIN_RUNS, PERF_BASELINE_VERSIONS, ResultsDb
+from harness.retention import DEFAULT_RETENTION_KEEP, RetentionEngine, parse_retention_keep
+from harness.tarball_cache import TARBALL_CACHE_MAX_GB, TARBALL_CACHE_PORT, TarballCache
+
+# Confirmation reruns of failed tests (see --confirm-failures) run for this fraction of the time
+# limit of the failed run by default, but not shorter than the minimum.
+CONFIRM_TIME_LIMIT_FRACTION = 0.5
+CONFIRM_MIN_TIME_LIMIT_SEC = 60
+# A metric regressed if it is this many standard deviations of the baseline worse than the baseline
+# mean, and worse by at least this ratio. The standard deviation is taken to be at least the given
+# fraction of the mean, so that a few very similar baseline runs don't flag noise.
+PERF_REGRESSION_MIN_Z_SCORE = 3
+PERF_REGRESSION_MIN_RATIO = 1.25
+PERF_MIN_RELATIVE_STDEV = 0.05
+# Metrics of successful ops that are compared, with whether higher values are worse.
+PERF_METRICS = [("p50_ms", True), ("p99_ms", True), ("throughput_per_sec", False)]
+# Command starting a worker that runs tests sent to it in a single JVM (see yugabyte.runner).
+WARM_RUNNER_CMD = "lein run worker"
+WARM_RUNNER_RESULT_PREFIX = b"@@yugabyte.runner/result "
+# Exit codes `lein run test` would have had for each :valid? value reported by the worker.
+WARM_RUNNER_RETURN_CODES = {"true": 0, "false": 1, "unknown": 2, "error": 254}
+# How long the warm runner has to exit after its input is closed.
+WARM_RUNNER_EXIT_TIMEOUT_SEC = 30
+# Nodes Jepsen runs on when no --nodes are given.
+JEPSEN_DEFAULT_NODES = ["n1", "n2", "n3", "n4", "n5"]
+# What the telemetry sampler collects from every node, as (name, shell command) pairs. Port 9000 is
+# the tserver web UI and 9100 the tserver RPC port.
+TELEMETRY_PROBES = [
+    ("free", "free -m"),
+    ("conns", "sudo -n netstat -ant | grep 9100"),
+    ("rpcz", "curl -s http://localhost:9000/rpcz"),
+    ("metrics", "curl -s http://localhost:9000/metrics"),
+    ("mem-trackers", "curl -s http://localhost:9000/mem-trackers"),
+    ("threadz", "curl -s 'http://localhost:9000/threadz?group=all'"),
+    ("contention", "curl -s http://localhost:9000/pprof/contention"),
+]
+TELEMETRY_FILE_NAME = "telemetry.jsonl.gz"
+# Jepsen logs into the nodes as root with the key passed in get_lein_cmd.
+SSH_OPTIONS = ["-l", "root", "-i", os.path.expanduser("~/.ssh/id_rsa"),
+               "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=no",
+               "-o", "ConnectTimeout=10"]
+# How long a multiplexed SSH connection outlives the harness if it is not closed explicitly.
+SSH_CONTROL_PERSIST_SEC = 600
+# How long the sampler waits for all probes of one node.
+TELEMETRY_SAMPLE_TIMEOUT_SEC = 60
+# What --preflight requires of every node before a test is started on its cluster. Leftover
+# yb-master/yb-tserver processes are only reported, as Jepsen tears the database down before
+# setting it up anyway.
+PREFLIGHT_MIN_FREE_DISK_GB = 5
+PREFLIGHT_MIN_AVAILABLE_MEMORY_MB = 1024
+PREFLIGHT_MAX_CLOCK_OFFSET_SEC = 1.0
+# Directory whose file system the database is installed on, see yugabyte.auto/dir.
+PREFLIGHT_DISK_PATH = "/home"
+PREFLIGHT_TIMEOUT_SEC = 20
+# How often a cluster that failed its preflight is checked again, and for how long by default
+# before the tests waiting for it are given up.
+PREFLIGHT_RETRY_INTERVAL_SEC = 30
+PREFLIGHT_MAX_WAIT_SEC = 600
+# Containers of --docker-pool clusters are created from the node image that docker/bin/up builds, on
+# the network of its docker-compose project, like the nodes defined in docker/template/.
+DOCKER_POOL_BASE_IMAGE = "jepsen_n1"
+DOCKER_POOL_NETWORK = "jepsen_jepsen"
+DOCKER_POOL_NODES_PER_CLUSTER = 5
+# Repository of the snapshot images of nodes with a tarball installed, tagged by the tarball URL.
+DOCKER_POOL_SNAPSHOT_REPOSITORY = "jepsen-yb-pool"
+# Where Jepsen records the URL it installed from and keeps the data of a test, see yugabyte.auto.
+DOCKER_POOL_INSTALLED_URL_FILE = "/home/yugabyte/installed-url"
+DOCKER_POOL_DATA_DIR = "/home/yugabyte/data"
+DOCKER_POOL_PUBLIC_KEY_PATH = os.path.expanduser("~/.ssh/id_rsa.pub")
+DOCKER_POOL_CMD_TIMEOUT_SEC = 300
+DOCKER_POOL_BOOT_TIMEOUT_SEC = 120
+# How many `lein run analyze` processes --pipeline runs at a time.
+DEFAULT_ANALYSIS_WORKERS = 2
+# How long a timed out process group has between SIGTERM and SIGKILL.
+KILL_GRACE_PERIOD_SEC = 10
+# Number of most recent lines of a child's output kept in memory.
+LOG_TAIL_MAX_LINES = 50
+# How long to wait for a child's output to be drained after it exits.
+LOG_TAIL_JOIN_TIMEOUT_SEC = 10
 DEFAULT_TARBALL_URL = "https://downloads.yugabyte.com/yugabyte-1.3.1.0-linux.tar.gz"
 
 TEST_PER_VERSION = [
@@ -136,22 +225,30 @@ NEMESES = [
     # "clock-skew",
 ]
 TESTS = list(chain(*[test["tests"] for test in TEST_PER_VERSION]))
+# Minimum version of every workload.
+WORKLOAD_START_VERSIONS = {test: el["start_version"]
+                           for el in TEST_PER_VERSION for test in el["tests"]}
 
 SCRIPT_DIR = os.path.abspath(os.path.dirname(sys.argv[0]))
 STORE_DIR = os.path.join(SCRIPT_DIR, "store")
 LOGS_DIR = os.path.join(SCRIPT_DIR, "logs")
-SORT_RESULTS_SH = os.path.join(SCRIPT_DIR, "sort-results.sh")
-REGEX_MAJOR_VERSION = r"^(\d+)\.(\d+)"
-
-child_processes = []
+WORKERS_DIR = os.path.join(SCRIPT_DIR, "workers")
+SORTED_DIR = os.path.join(SCRIPT_DIR, "results-sorted")
+RESULTS_DB_PATH = os.path.join(SCRIPT_DIR, "results.db")
+REPORTPORTAL_SPOOL_DIR = os.path.join(SCRIPT_DIR, "reportportal-spool")
+JOURNAL_DIR = os.path.join(SCRIPT_DIR, "journals")
+# The smallest failing history of every test confirmed by --confirm-failures is kept here.
+CONFIRMATIONS_DIR = os.path.join(SCRIPT_DIR, "confirmations")
+TARBALL_CACHE_DIR = os.path.join(SCRIPT_DIR, "tarball-cache")
+# Files and directories a per-cluster working directory links to, so that `lein` can be run from it.
+WORKER_DIR_LINKS = ["project.clj", "src"]
 
 
 def get_workload_version(workload):
-    for el in TEST_PER_VERSION:
-        for tests in el["tests"]:
-            if workload in tests:
-                return el["start_version"]
-    raise EnvironmentError(f"Unanable to find workload in tests: {TESTS}")
+    try:
+        return WORKLOAD_START_VERSIONS[workload]
+    except KeyError:
+        raise EnvironmentError(f"Unanable to find workload in tests: {TESTS}")
 
 
 def is_version_at_least(v_least, v_actual):
@@ -162,17 +259,171 @@ def is_version_at_least(v_least, v_actual):
                                          fillvalue=0) if i != j), True)
 
 
-def cleanup():
-    deadline = time.time() + 5
-    for p in child_processes:
-        while p.poll() is None and time.time() < deadline:
-            time.sleep(1)
+class SupervisedProcess:
+    """
+    A child process started by ProcessSupervisor. The child is the leader of its own process group,
+    so that signals reach everything it started (e.g. the JVM started by `lein` under `sh -c`).
+    """
+
+    def __init__(self, popen, timeout, on_exit):
+        self.popen = popen
+        self.pid = popen.pid
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.on_exit = on_exit
+        self.timed_out = False
+        self.terminating = False
+        self.returncode = None
+        self.exited = threading.Event()
+        self.pidfd = None
+
+    def signal_group(self, sig):
         try:
-            p.kill()
+            os.killpg(self.pid, sig)
         except OSError as e:
             if e.errno != errno.ESRCH:
                 raise e
 
+    def wait(self, timeout=None):
+        """Waits for the child to exit and returns its exit code, or None on timeout."""
+        self.exited.wait(timeout)
+        return self.returncode
+
+
+class ProcessSupervisor:
+    """
+    Waits for any number of child processes from a single background thread. Children are watched
+    through pidfds (or a waiter thread per child where pidfds are not available) registered in a
+    selector, so exits are noticed as soon as they happen and deadlines are enforced exactly,
+    without polling. A child past its deadline gets SIGTERM sent to its whole process group, and
+    SIGKILL if it is still around after the grace period.
+    """
+
+    def __init__(self, kill_grace_period_sec=KILL_GRACE_PERIOD_SEC):
+        self.kill_grace_period_sec = kill_grace_period_sec
+        self.lock = threading.Lock()
+        self.children = []
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_read_fd, self.wakeup_write_fd = os.pipe()
+        os.set_blocking(self.wakeup_read_fd, False)
+        self.selector.register(self.wakeup_read_fd, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self._run, name="process-supervisor", daemon=True)
+        self.thread.start()
+
+    def spawn(self, cmd, timeout=None, on_exit=None, **popen_kwargs):
+        """
+        Starts a child process. on_exit, if given, is called with the SupervisedProcess from the
+        supervisor thread right after the child exits.
+        """
+        p = subprocess.Popen(cmd, start_new_session=True, **popen_kwargs)
+        child = SupervisedProcess(p, timeout, on_exit)
+        with self.lock:
+            self.children.append(child)
+            if hasattr(os, 'pidfd_open'):
+                try:
+                    child.pidfd = os.pidfd_open(child.pid)
+                except OSError:
+                    child.pidfd = None
+            if child.pidfd is not None:
+                self.selector.register(child.pidfd, selectors.EVENT_READ, child)
+        if child.pidfd is None:
+            threading.Thread(target=self._wait_in_thread, args=(child,), daemon=True).start()
+        self._wake_up()
+        return child
+
+    def terminate(self, child):
+        """Asks the child's process group to exit, killing it after the grace period."""
+        with self.lock:
+            self._terminate(child, time.monotonic())
+        self._wake_up()
+
+    def terminate_all(self):
+        with self.lock:
+            children = list(self.children)
+            now = time.monotonic()
+            for child in children:
+                self._terminate(child, now)
+        self._wake_up()
+        for child in children:
+            child.wait()
+
+    def _terminate(self, child, now):
+        if not child.terminating and not child.exited.is_set():
+            child.terminating = True
+            child.deadline = now + self.kill_grace_period_sec
+            child.signal_group(signal.SIGTERM)
+
+    def _wake_up(self):
+        try:
+            os.write(self.wakeup_write_fd, b'\0')
+        except BlockingIOError:
+            pass
+
+    def _wait_in_thread(self, child):
+        child.popen.wait()
+        self._wake_up()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                deadlines = [child.deadline for child in self.children
+                             if child.deadline is not None]
+            select_timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+            for key, _ in self.selector.select(select_timeout):
+                if key.fd == self.wakeup_read_fd:
+                    try:
+                        while os.read(self.wakeup_read_fd, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+
+            exited_children = []
+            with self.lock:
+                now = time.monotonic()
+                for child in list(self.children):
+                    returncode = child.popen.poll()
+                    if returncode is not None:
+                        child.returncode = returncode
+                        self.children.remove(child)
+                        if child.pidfd is not None:
+                            self.selector.unregister(child.pidfd)
+                            os.close(child.pidfd)
+                        exited_children.append(child)
+                    elif child.deadline is not None and now >= child.deadline:
+                        if child.terminating:
+                            logging.warning("Process group %d did not exit within %d seconds "
+                                            "after SIGTERM, killing it",
+                                            child.pid, self.kill_grace_period_sec)
+                            child.deadline = None
+                            child.signal_group(signal.SIGKILL)
+                        else:
+                            logging.warning("Process %d timed out, terminating its process group",
+                                            child.pid)
+                            child.timed_out = True
+                            self._terminate(child, now)
+
+            for child in exited_children:
+                if child.on_exit is not None:
+                    try:
+                        child.on_exit(child)
+                    except Exception:
+                        logging.exception("Exit callback for process %d failed", child.pid)
+                child.exited.set()
+
+
+supervisor = None
+
+
+def get_supervisor():
+    global supervisor
+    if supervisor is None:
+        supervisor = ProcessSupervisor()
+    return supervisor
+
+
+def cleanup():
+    if supervisor is not None:
+        supervisor.terminate_all()
+
 
 def truncate_line(line, max_chars=500):
     if len(line) <= max_chars:
@@ -182,172 +433,1744 @@ def truncate_line(line, max_chars=500):
     return line if len(line) <= len(res_candidate) else res_candidate
 
 
-def get_last_lines(file_path, n_lines):
-    total_num_lines = int(subprocess.check_output(['wc', '-l', file_path]).strip().split()[0])
-    return (
-        subprocess.check_output(['tail', '-n', str(n_lines), file_path]).decode().split("\n"),
-        total_num_lines
-    )
+class LogTail:
+    """
+    Consumes an output stream of a child process line by line in a background thread. Every line
+    is copied to the log file as is, while only the last max_lines lines (truncated) are kept in
+    memory together with the total line count. The test verdict is detected as soon as the
+    corresponding line appears, and listeners registered with add_listener() see every line.
+    """
+
+    def __init__(self, path, max_lines=LOG_TAIL_MAX_LINES):
+        self.path = path
+        self.lines = deque(maxlen=max_lines)
+        self.num_lines = 0
+        self.everything_looks_good = False
+        self.valid = None
+        self.verdict_time = None
+        self.listeners = []
+        self.thread = None
+        self.log_file = None
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def start(self, stream):
+        self.thread = threading.Thread(target=self._consume, args=(stream,), name="log-tail",
+                                       daemon=True)
+        self.thread.start()
+
+    def join(self, timeout=LOG_TAIL_JOIN_TIMEOUT_SEC):
+        """
+        Waits until the stream is fully consumed. A grandchild that outlived the child could keep
+        the pipe open forever, hence the timeout.
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logging.warning("Output of %s is still open, not waiting for it any more", self.path)
+
+    def last_lines(self, n_lines):
+        return list(self.lines)[-n_lines:]
+
+    def feed(self, raw_line):
+        """Processes one line of output, for callers reading the stream themselves."""
+        if self.log_file is None:
+            self.log_file = open(self.path, 'wb')
+        self.log_file.write(raw_line)
+        line = raw_line.decode(errors='replace').rstrip('\n')
+        self.num_lines += 1
+        self.lines.append(truncate_line(line))
+        self._detect_verdict(line)
+        for listener in self.listeners:
+            try:
+                listener(line)
+            except Exception:
+                logging.exception("Listener of %s failed", self.path)
+
+    def close(self):
+        if self.log_file is None:
+            # Create the log even if there was no output at all.
+            self.log_file = open(self.path, 'wb')
+        self.log_file.close()
+
+    def _consume(self, stream):
+        try:
+            for raw_line in iter(stream.readline, b''):
+                self.feed(raw_line)
+        finally:
+            self.close()
+            stream.close()
+
+    def _detect_verdict(self, line):
+        if line.startswith('Everything looks good!'):
+            self.everything_looks_good = True
+            self.valid = True
+        elif ':valid? false' in line:
+            self.valid = False
+        else:
+            return
+        if self.verdict_time is None:
+            self.verdict_time = time.time()
+            logging.info("Detected verdict in %s: valid=%s", self.path, self.valid)
 
 
-def show_last_lines(file_path, n_lines):
+def show_last_lines(tail, n_lines):
     if n_lines is None:
         return
-    if not os.path.exists(file_path):
-        logging.warning("File does not exist: %s, cannot show last %d lines",
-                        file_path, n_lines)
-        return
-    lines, total_num_lines = get_last_lines(file_path, n_lines)
     logging.info(
         "%s of file %s:\n%s",
-        "Last %d lines" % n_lines if total_num_lines > n_lines else 'Contents',
-        file_path,
-        "\n".join([truncate_line(line) for line in lines])
-    )
-
-
-def send_report_to_reportportal(
-        xml_report_name,
-        xml_report_content,
-        reportportal_base_url,
-        reportportal_project_name,
-        reportportal_api_token,
-        version,
-        jenkins_url,
-):
-    full_version = version.split("-b")[0]
-    major_version = ".".join(re.findall(REGEX_MAJOR_VERSION, version)[0])
-    build_version = version.split("-b")[1]
-
-    url = f"{reportportal_base_url}/api/v1/{reportportal_project_name}/launch/import"
-
-    response = requests.post(
-        url,
-        files={
-            'file': (f"{major_version}-{xml_report_name}", xml_report_content),
-            'type': 'text/xml'},
-        headers={"accept": "*/*",
-                 "Authorization": f"bearer {reportportal_api_token}"}
+        "Last %d lines" % n_lines if tail.num_lines > n_lines else 'Contents',
+        tail.path,
+        "\n".join(tail.last_lines(n_lines))
     )
 
-    if response.status_code == 200:
-        launch_uuid = re.search('(?<=id = )[^ ]+', json.loads(response.text)["message"])[0]
-        logging.info(f"Successfully posted launch {launch_uuid}")
-    else:
-        logging.error(
-            f"Can't send data to the ReportPortal {reportportal_base_url} due to {response.text} "
-            f"(code {response.status_code})")
-        return False
-
-    # Need to translate UUID to launch-specific ID
-    url = f"{reportportal_base_url}/api/v1/{reportportal_project_name}/launch/uuid/{launch_uuid}"
-
-    response = requests.get(url, headers={"accept": "*/*",
-                                          "Authorization": f"bearer {reportportal_api_token}"})
 
-    if response.status_code == 200:
-        launch_id = json.loads(response.text)["id"]
-        logging.info(f"Successfully found launch ID {launch_id}")
-    else:
-        logging.error(f"Can't find launch ID for uuid {launch_uuid}")
-        logging.error(f"Code: {response.status_code} Text: {response.text}")
-        return False
+def parse_sort_results_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} sort-results",
+        description="Classifies the finished runs in the store and moves them into the sorted "
+                    "results, as a sweep does after every test.")
+    parser.add_argument(
+        'summary_name',
+        nargs='?',
+        default="jepsen",
+        help='Append to results-sorted/summary_<summary_name>.jsonl. Default: jepsen')
+    parser.add_argument(
+        '--store-dir',
+        default=STORE_DIR,
+        help='Jepsen store to sort the runs of. Default: ' + STORE_DIR)
+    parser.add_argument(
+        '--sorted-dir',
+        default=SORTED_DIR,
+        help='Directory to sort the runs into. Default: ' + SORTED_DIR)
+    return parser.parse_args(argv)
 
-    url = f"{reportportal_base_url}/api/v1/{reportportal_project_name}/launch/{launch_id}/update"
 
-    response = requests.put(url, json={"attributes": [{"key": "version", "value": full_version},
-                                                      {"key": "build", "value": build_version},
-                                                      {"key": "jenkins", "value": jenkins_url}]},
-                            headers={"accept": "*/*", "Content-Type": "application/json",
-                                     "Authorization": f"bearer {reportportal_api_token}"})
+def sort_results_main(argv):
+    args = parse_sort_results_args(argv)
+    ensure_dir(args.store_dir)
+    sort_results(args.store_dir, args.sorted_dir, args.summary_name)
+    return 0
 
-    if response.status_code != 200:
-        logging.error(f"Could not update attributes for launch {launch_id}")
-        logging.error(f"Code: {response.status_code} Text: {response.text}")
-        return False
 
-    logging.info(f"Successfully updated attributes for launch {launch_id}")
-    return True
+def parse_query_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} query",
+        description="Shows flake rates and duration percentiles of past test runs.")
+    parser.add_argument(
+        '--results-db',
+        default=RESULTS_DB_PATH,
+        help='Results database to query. Default: ' + RESULTS_DB_PATH)
+    parser.add_argument('--workload', help='Only show runs of this workload')
+    parser.add_argument('--nemesis', help='Only show runs with exactly this nemesis string')
+    parser.add_argument('--category', help='Only count runs in this result category')
+    parser.add_argument('--version', help='Only show runs of this version')
+    parser.add_argument(
+        '--last-builds',
+        type=int,
+        help='Only show runs of the given number of most recently tested versions')
+    parser.add_argument(
+        '--since-days',
+        type=float,
+        help='Only show runs started within this many days')
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print results as JSON lines')
+    parser.add_argument(
+        '--phases',
+        action='store_true',
+        help='Show the mean time per test phase of every workload instead')
+    return parser.parse_args(argv)
+
+
+def query_main(argv):
+    args = parse_query_args(argv)
+    if not os.path.exists(args.results_db):
+        logging.error("Results database %s does not exist", args.results_db)
+        return 1
+    results_db = ResultsDb(args.results_db)
+    versions = None
+    if args.version:
+        versions = [args.version]
+    elif args.last_builds:
+        versions = results_db.recent_versions(args.last_builds)
+    since = time.time() - args.since_days * 24 * 3600 if args.since_days else None
+    if args.phases:
+        phases_by_workload = results_db.phases_by_workload(
+            workload=args.workload, nemesis=args.nemesis, category=args.category,
+            versions=versions, since=since)
+        results_db.close()
+        if args.json:
+            for workload, runs in sorted(phases_by_workload.items()):
+                print(json.dumps({"workload": workload, "runs": runs}))
+        else:
+            print(get_phase_report(phases_by_workload))
+        return 0
+    stats = results_db.test_stats(workload=args.workload, nemesis=args.nemesis,
+                                  category=args.category, versions=versions, since=since)
+    results_db.close()
+
+    if args.json:
+        for row in stats:
+            print(json.dumps(row))
+        return 0
+    print("%-28s %-40s %6s %6s %7s %10s %10s %10s" % (
+        "workload", "nemesis", "runs", "failed", "flake%", "p50_ms", "p90_ms", "p99_ms"))
+    for row in stats:
+        print("%-28s %-40s %6d %6d %6.1f%% %10d %10d %10d" % (
+            row["workload"], row["nemesis"], row["runs"], row["failed"],
+            row["flake_rate"] * 100, row["p50_ms"], row["p90_ms"], row["p99_ms"]))
+    return 0
+
+
+def find_perf_regressions(stats, baseline):
+    """
+    Compares the compute_history_stats() of a run with a ResultsDb.perf_baseline(). Returns a
+    description of every metric of successful ops that is significantly worse than the baseline.
+    """
+    regressions = []
+    for (f, op_type), row in sorted(stats.items()):
+        baseline_rows = baseline.get((f, op_type), [])
+        if op_type != "ok" or len(baseline_rows) < PERF_BASELINE_MIN_RUNS:
+            continue
+        for metric, higher_is_worse in PERF_METRICS:
+            values = [baseline_row[metric] for baseline_row in baseline_rows
+                      if baseline_row[metric] is not None]
+            value = row[metric]
+            if value is None or len(values) < PERF_BASELINE_MIN_RUNS:
+                continue
+            mean = sum(values) / len(values)
+            if mean <= 0:
+                continue
+            stdev = max(math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1)),
+                        PERF_MIN_RELATIVE_STDEV * mean)
+            z_score = (value - mean) / stdev if higher_is_worse else (mean - value) / stdev
+            ratio = value / mean if higher_is_worse else mean / max(value, 1e-9)
+            if z_score >= PERF_REGRESSION_MIN_Z_SCORE and ratio >= PERF_REGRESSION_MIN_RATIO:
+                regressions.append(f":{f} {metric} is {value:.1f}, {ratio:.2f}x worse than the "
+                                   f"baseline {mean:.1f} of {len(values)} runs (z={z_score:.1f})")
+    return regressions
+
+
+class PerfRegressionDetector:
+    """
+    Extracts latency percentiles and throughput per op type from the history of every finished
+    test in a background thread, stores them in the results database under the tested version, and
+    reports a perf.<workload> JUnit test case per test which fails when a run regressed against
+    the ok runs of recent versions.
+    """
+
+    def __init__(self, results_db, version, report, build_url):
+        self.results_db = results_db
+        self.version = version
+        self.report = report
+        self.build_url = build_url
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="perf")
+
+    def submit(self, outcome):
+        """Analyzes the outcome in the background. Can be registered as a SweepReport listener."""
+        if outcome.run_dir is not None:
+            self.executor.submit(self._analyze, outcome)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _analyze(self, outcome):
+        try:
+            history_path = find_maybe_compressed(os.path.join(outcome.run_dir, "history.edn"))
+            if history_path is None:
+                return
+            stats = compute_history_stats(history_path)
+            if not stats:
+                return
+            regressions = []
+            if outcome.category == "ok":
+                baseline = self.results_db.perf_baseline(outcome.workload, outcome.nemesis,
+                                                         self.version)
+                regressions = find_perf_regressions(stats, baseline)
+            self.results_db.record_perf_stats(outcome, self.version, stats)
+            if outcome.category != "ok":
+                return
+            tc = TestCase(name=outcome.test_name,
+                          classname="perf." + outcome.workload.split('/')[0],
+                          url=self.build_url,
+                          stdout="\n".join(
+                              f":{f} {op_type}: {row['throughput_per_sec']:.1f} ops/s, "
+                              f"p50 {row['p50_ms']} ms, p99 {row['p99_ms']} ms"
+                              for (f, op_type), row in sorted(stats.items())))
+            if regressions:
+                logging.warning("Performance regressions in %s:\n    %s", outcome.description,
+                                "\n    ".join(regressions))
+                tc.add_failure_info("Performance regression", "\n".join(regressions),
+                                    failure_type="performance")
+            self.report.add_extra_test_case("perf:" + outcome.test_name, tc)
+        except Exception:
+            logging.exception("Performance analysis of %s failed", outcome.description)
+
+
+def parse_history_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} history",
+        description="Inspects a Jepsen history.edn using an on-disk index, without loading the "
+                    "whole history into memory.")
+    parser.add_argument(
+        'path',
+        help='history.edn, or a test run directory containing it')
+    parser.add_argument(
+        '--window',
+        nargs=2,
+        type=float,
+        metavar=('FROM_SEC', 'TO_SEC'),
+        help='Only look at ops within this time range, in seconds since the test start')
+    parser.add_argument(
+        '--around',
+        type=float,
+        metavar='SEC',
+        help='Only look at ops within --width seconds of this time')
+    parser.add_argument(
+        '--width',
+        type=float,
+        default=5,
+        help='Half-width of the --around window in seconds. Default: 5')
+    parser.add_argument('--process', help='Only show ops of this process, e.g. 12 or nemesis')
+    parser.add_argument('--type', dest='op_type', help='Only show ops of this type, e.g. fail')
+    parser.add_argument('--f', help='Only show ops with this :f, e.g. read')
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help='Show latency percentiles and throughput per :f and completion type instead of ops')
+    parser.add_argument(
+        '--reindex',
+        action='store_true',
+        help='Rebuild the index even if an up-to-date one exists')
+    return parser.parse_args(argv)
+
+
+def history_main(argv):
+    args = parse_history_args(argv)
+    history_path = args.path
+    if os.path.isdir(history_path):
+        history_path = os.path.join(history_path, "history.edn")
+    if find_maybe_compressed(history_path) is None:
+        logging.error("History %s does not exist", history_path)
+        return 1
+    history_path = find_maybe_compressed(history_path)
+
+    start_sec = end_sec = None
+    if args.window:
+        start_sec, end_sec = args.window
+    elif args.around is not None:
+        start_sec, end_sec = args.around - args.width, args.around + args.width
+
+    if args.stats:
+        stats = compute_history_stats(history_path, start_sec, end_sec)
+        print("%-16s %-8s %9s %10s %10s %10s %10s %10s" % (
+            "f", "type", "count", "ops/s", "p50_ms", "p95_ms", "p99_ms", "max_ms"))
+        for (f, op_type), row in sorted(stats.items()):
+            print("%-16s %-8s %9d %10.1f %10s %10s %10s %10s" % (
+                f, op_type, row["count"], row["throughput_per_sec"],
+                *["-" if row[k] is None else "%.1f" % row[k]
+                  for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]))
+        return 0
+
+    index = HistoryIndex.load_or_build(history_path, rebuild=args.reindex)
+    if (start_sec is None and args.process is None and args.op_type is None and
+            args.f is None):
+        print(f"{len(index.offsets)} ops over {index.max_time_ns / 1e9:.1f} sec")
+        for title, groups in (("process", index.by_process), ("type", index.by_type),
+                              (":f", index.by_f)):
+            print(f"By {title}: " + ", ".join(
+                f"{key}={len(ordinals)}" for key, ordinals in sorted(groups.items())))
+        return 0
+
+    ordinals = index.select(start_sec, end_sec, args.process, args.op_type, args.f)
+    for _, text in index.read_ops(ordinals, start_sec, end_sec):
+        print(text)
+    return 0
+
+
+def parse_reportportal_replay_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} reportportal-replay",
+        description="Sends the reports that earlier runs could not send to ReportPortal.")
+    parser.add_argument('--reportportal_base_url', required=True, help='ReportPortal base URL')
+    parser.add_argument('--reportportal_project_name', required=True,
+                        help='ReportPortal project name')
+    parser.add_argument('--reportportal_api_token', required=True, help='ReportPortal API token')
+    parser.add_argument(
+        '--spool-dir',
+        default=REPORTPORTAL_SPOOL_DIR,
+        help='Directory with the unsent reports. Default: ' + REPORTPORTAL_SPOOL_DIR)
+    return parser.parse_args(argv)
+
+
+def reportportal_replay_main(argv):
+    args = parse_reportportal_replay_args(argv)
+    if not os.path.isdir(args.spool_dir):
+        logging.info("No unsent reports in %s", args.spool_dir)
+        return 0
+    client = ReportPortalClient(args.reportportal_base_url, args.reportportal_project_name,
+                                args.reportportal_api_token)
+    num_failed = 0
+    for spool_file in sorted(os.listdir(args.spool_dir)):
+        if spool_file.endswith(".json"):
+            if not send_spooled_report(client, os.path.join(args.spool_dir, spool_file)):
+                num_failed += 1
+    client.close()
+    return 1 if num_failed else 0
+
+
+def get_address_towards(nodes):
+    """Returns the address of this machine on the route to the nodes, as they would see it."""
+    for node in nodes:
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                # Connecting a UDP socket only picks a route, nothing is sent.
+                s.connect((node, 9))
+                return s.getsockname()[0]
+        except OSError:
+            continue
+    return socket.getfqdn()
+
+
+class SshPool:
+    """
+    One multiplexed SSH connection (ControlMaster) per node of a cluster, shared by everything the
+    harness runs on the nodes itself, so that only the first command pays for the SSH handshake.
+    Connections are opened on first use and reopened when they die.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.control_dir = None
+        self.masters = {}
+        self.lock = threading.Lock()
+        self.node_locks = {node: threading.Lock() for node in nodes}
+
+    def ssh_cmd(self, node, *extra_args):
+        with self.lock:
+            if self.control_dir is None:
+                # ControlPath has to fit into a unix socket path, so keep it short.
+                self.control_dir = tempfile.mkdtemp(prefix="yb-ssh-")
+        return ["ssh", *SSH_OPTIONS,
+                "-o", "ControlPath=" + os.path.join(self.control_dir, "%C"),
+                *extra_args, node]
+
+    def ensure_master(self, node, timeout):
+        with self.node_locks[node]:
+            master = self.masters.get(node)
+            if master is not None and master.returncode == 0:
+                # ssh -f exited after authenticating, check that the backgrounded master is up.
+                if subprocess.call(self.ssh_cmd(node, "-O", "check"), stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL) == 0:
+                    return True
+            master = get_supervisor().spawn(
+                self.ssh_cmd(node, "-o", "ControlMaster=yes",
+                             "-o", f"ControlPersist={SSH_CONTROL_PERSIST_SEC}", "-f", "-N"),
+                timeout=timeout,
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            master.wait()
+            self.masters[node] = master
+            if master.returncode != 0:
+                logging.warning("Could not connect to %s (exit code %s)", node, master.returncode)
+                return False
+            return True
+
+    def run(self, node, script, timeout):
+        """
+        Runs a shell script on the node. Returns its exit code and output, or None if the node
+        could not be connected to.
+        """
+        if not self.ensure_master(node, timeout):
+            return None
+        child = get_supervisor().spawn(
+            self.ssh_cmd(node, "-o", "ControlMaster=no") + [script],
+            timeout=timeout,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        output = child.popen.stdout.read().decode(errors='replace')
+        child.popen.stdout.close()
+        child.wait()
+        return child.returncode, output
+
+    def close(self):
+        for node in self.masters:
+            subprocess.call(self.ssh_cmd(node, "-O", "exit"),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.masters = {}
+        if self.control_dir is not None:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+            self.control_dir = None
+
+
+class NodeSampler:
+    """
+    Periodically runs TELEMETRY_PROBES on all nodes of a cluster while a test runs, one thread per
+    node, so a slow or unreachable node does not delay the samples of the others. All samples of
+    all tests on the cluster go through the cluster's SshPool. Samples are appended to a gzipped
+    JSON lines file, one line per node and sample, with the wall clock time they were taken at so
+    they can be lined up with jepsen.log.
+    """
+
+    def __init__(self, ssh_pool, interval_sec):
+        self.ssh_pool = ssh_pool
+        self.nodes = ssh_pool.nodes
+        self.interval_sec = interval_sec
+        self.lock = threading.Lock()
+        self.output = None
+        self.output_path = None
+        self.num_samples = 0
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self, output_path):
+        self.output_path = output_path
+        self.output = gzip.open(output_path, 'wt')
+        self.num_samples = 0
+        self.stopped.clear()
+        start_time = time.monotonic()
+        self.threads = [threading.Thread(target=self._sample_node, args=(node, start_time),
+                                         name=f"sampler-{node}", daemon=True)
+                        for node in self.nodes]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Stops sampling and returns the path of the samples file."""
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.output.close()
+        logging.info("Collected %d telemetry samples in %s", self.num_samples, self.output_path)
+        return self.output_path
+
+    def _sample_node(self, node, start_time):
+        remote_script = "; ".join(f"echo '@@{name}'; {cmd}" for name, cmd in TELEMETRY_PROBES)
+        next_sample_time = start_time
+        while not self.stopped.is_set():
+            sample_time = time.time()
+            result = self.ssh_pool.run(node, remote_script, TELEMETRY_SAMPLE_TIMEOUT_SEC)
+            if result is not None:
+                self._write_sample(node, sample_time, time.time() - sample_time, result[1])
+            # Skip ticks that a slow sample ran over instead of sampling back to back.
+            next_sample_time += self.interval_sec * max(
+                1, math.ceil((time.monotonic() - next_sample_time) / self.interval_sec))
+            self.stopped.wait(max(0, next_sample_time - time.monotonic()))
+
+    def _write_sample(self, node, sample_time, duration_sec, output):
+        probe_names = {name for name, _ in TELEMETRY_PROBES}
+        probe_lines = {}
+        name = None
+        for line in output.splitlines(keepends=True):
+            if line.startswith('@@') and line[2:].rstrip('\n') in probe_names:
+                name = line[2:].rstrip('\n')
+                probe_lines[name] = []
+            elif name is not None:
+                probe_lines[name].append(line)
+        record = {"time": round(sample_time, 3),
+                  "node": node,
+                  "duration_ms": int(duration_sec * 1000),
+                  "probes": {name: "".join(lines) for name, lines in probe_lines.items()}}
+        with self.lock:
+            self.output.write(json.dumps(record) + "\n")
+            self.num_samples += 1
+
+
+class ClusterPreflight:
+    """
+    Checks all nodes of a cluster concurrently through its SshPool before a test is started on it:
+    that they can be reached, have enough free disk and memory, and that their clocks are close to
+    ours. Remembers since when the cluster has been failing, so that callers can give up on it.
+    """
+
+    SCRIPT = "; ".join([
+        "echo \"time $(date +%s.%N)\"",
+        f"echo \"disk_kb $(df -Pk {PREFLIGHT_DISK_PATH} | awk 'NR == 2 {{print $4}}')\"",
+        "echo \"memory_kb $(awk '/^MemAvailable:/ {print $2}' /proc/meminfo)\"",
+        "echo \"yb_processes $(pgrep -x 'yb-master|yb-tserver' | wc -l)\"",
+    ])
+
+    def __init__(self, cluster, ssh_pool):
+        self.cluster = cluster
+        self.ssh_pool = ssh_pool
+        self.executor = ThreadPoolExecutor(max_workers=len(ssh_pool.nodes),
+                                           thread_name_prefix=f"preflight-{cluster.name}")
+        self.failing_since = None
+        self.problems = []
+
+    def check(self):
+        """Checks all nodes and returns the problems found, an empty list if there are none."""
+        start_time = time.monotonic()
+        problems = []
+        for node_problems in self.executor.map(self.check_node, self.ssh_pool.nodes):
+            problems.extend(node_problems)
+        logging.info("Preflight of cluster %s took %.1f sec%s", self.cluster.name,
+                     time.monotonic() - start_time,
+                     ": " + "; ".join(problems) if problems else ", all nodes are healthy")
+        self.problems = problems
+        if not problems:
+            self.failing_since = None
+        elif self.failing_since is None:
+            self.failing_since = time.monotonic()
+        return problems
+
+    def get_failing_time_sec(self):
+        return 0 if self.failing_since is None else time.monotonic() - self.failing_since
+
+    def check_node(self, node):
+        request_time = time.time()
+        result = self.ssh_pool.run(node, self.SCRIPT, PREFLIGHT_TIMEOUT_SEC)
+        response_time = time.time()
+        if result is None:
+            return [f"{node} is unreachable over SSH"]
+        returncode, output = result
+        values = dict(line.split(" ", 1) for line in output.splitlines() if " " in line)
+        if returncode != 0 or "time" not in values:
+            return [f"{node} failed the preflight checks (exit code {returncode})"]
+
+        problems = []
+        try:
+            # The node's clock was read somewhere within the round trip.
+            offset_sec = float(values["time"]) - (request_time + response_time) / 2
+            if abs(offset_sec) - (response_time - request_time) / 2 > PREFLIGHT_MAX_CLOCK_OFFSET_SEC:
+                problems.append(f"{node} clock is {offset_sec:+.2f} sec off")
+            free_disk_gb = int(values["disk_kb"]) / (1 << 20)
+            if free_disk_gb < PREFLIGHT_MIN_FREE_DISK_GB:
+                problems.append(f"{node} has only {free_disk_gb:.1f} GB free on "
+                                f"{PREFLIGHT_DISK_PATH}")
+            available_memory_mb = int(values["memory_kb"]) / 1024
+            if available_memory_mb < PREFLIGHT_MIN_AVAILABLE_MEMORY_MB:
+                problems.append(f"{node} has only {available_memory_mb:.0f} MB of memory available")
+            num_yb_processes = int(values["yb_processes"])
+            if num_yb_processes > 0:
+                logging.warning("%s still runs %d yb-master/yb-tserver processes from an earlier "
+                                "test", node, num_yb_processes)
+        except (KeyError, ValueError) as e:
+            problems.append(f"{node} returned unexpected preflight output ({e}): {output!r}")
+        return problems
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def get_output_log_paths(logs_dir, log_name_prefix):
+    stdout_path = os.path.join(logs_dir, f'{log_name_prefix}_stdout.log')
+    stderr_path = os.path.join(logs_dir, f'{log_name_prefix}_stderr.log')
+    logging.info("stdout log: %s", stdout_path)
+    logging.info("stderr log: %s", stderr_path)
+    return stdout_path, stderr_path
+
+
+def get_cmd_result(stdout_tail, returncode, timed_out):
+    everything_looks_good = False
+    last_lines_of_output = []
+    if stdout_tail is not None:
+        last_lines_of_output = stdout_tail.last_lines(LOG_TAIL_MAX_LINES)
+        everything_looks_good = stdout_tail.everything_looks_good
+    return CmdResult(
+        output=None if everything_looks_good else "\n".join(last_lines_of_output),
+        returncode=returncode,
+        timed_out=timed_out,
+        everything_looks_good=everything_looks_good)
+
+
+def finish_output_logs(tails, num_lines_to_show, keep_output_log_file):
+    for tail in tails:
+        if tail is None:
+            continue
+        show_last_lines(tail, num_lines_to_show)
+        if not keep_output_log_file:
+            try:
+                os.remove(tail.path)
+            except IOError as ex:
+                logging.error("Error deleting output log %s, ignoring: %s", tail.path, ex)
 
 
 def run_cmd(cmd,
             timeout=None,
             exit_on_error=True,
             log_name_prefix=None,
-            num_lines_to_show=None):
+            num_lines_to_show=None,
+            cwd=None,
+            logs_dir=LOGS_DIR,
+            watchdog=None,
+            keep_output_logs=False,
+            listeners=()):
     logging.info("Running command: %s", cmd)
-    stdout_path = None
-    stderr_path = None
     keep_output_log_file = True
-    if log_name_prefix is not None:
-        stdout_path = os.path.join(LOGS_DIR, f'{log_name_prefix}_stdout.log')
-        stderr_path = os.path.join(LOGS_DIR, f'{log_name_prefix}_stderr.log')
-        logging.info("stdout log: %s", stdout_path)
-        logging.info("stderr log: %s", stderr_path)
+    stdout_tail = None
+    stderr_tail = None
 
-    stdout_file = None
-    stderr_file = None
-
-    popen_kwargs = dict(shell=True)
+    popen_kwargs = dict(shell=True, cwd=cwd)
     try:
         if log_name_prefix is None:
-            p = subprocess.Popen(cmd, **popen_kwargs)
-        else:
-            stdout_file = open(stdout_path, 'wb')
-            stderr_file = open(stderr_path, 'wb')
-            p = subprocess.Popen(cmd, stdout=stdout_file, stderr=stderr_file, **popen_kwargs)
-
-        child_processes.append(p)
-
-        deadline = time.time() + timeout if timeout else float('inf')
-        while p.poll() is None and (timeout is None or time.time() < deadline):
-            time.sleep(1)
-
-        if p.poll() is None:
-            timed_out = True
-            p.kill()
-            returncode = p.wait()
+            child = get_supervisor().spawn(cmd, timeout=timeout, **popen_kwargs)
         else:
-            timed_out = False
-            returncode = p.returncode
+            stdout_path, stderr_path = get_output_log_paths(logs_dir, log_name_prefix)
+            child = get_supervisor().spawn(cmd, timeout=timeout, stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE, **popen_kwargs)
+            stdout_tail = LogTail(stdout_path)
+            stderr_tail = LogTail(stderr_path)
+            for listener in listeners:
+                stdout_tail.add_listener(listener)
+                stderr_tail.add_listener(listener)
+            if watchdog is not None:
+                watchdog.watch((stdout_tail, stderr_tail),
+                               kill=lambda: get_supervisor().terminate(child))
+            stdout_tail.start(child.popen.stdout)
+            stderr_tail.start(child.popen.stderr)
+
+        returncode = child.wait()
+        if watchdog is not None:
+            watchdog.stop()
+        timed_out = child.timed_out
+        for tail in (stdout_tail, stderr_tail):
+            if tail is not None:
+                tail.join()
 
-        child_processes.remove(p)
         if returncode != 0:
             logging.error("Failed running command (exit code: %d): %s", returncode, cmd)
             if exit_on_error:
                 sys.exit(returncode)
-        everything_looks_good = False
-        last_lines_of_output = []
-        if stdout_path is not None and os.path.exists(stdout_path):
-            last_lines_of_output, _ = get_last_lines(stdout_path, 50)
-            everything_looks_good = any(
-                line.startswith('Everything looks good!') for line in last_lines_of_output)
-        if everything_looks_good:
-            keep_output_log_file = False
-        return CmdResult(
-            output=None if everything_looks_good else "\n".join(
-                [truncate_line(line) for line in last_lines_of_output]),
-            returncode=returncode,
-            timed_out=timed_out,
-            everything_looks_good=everything_looks_good)
+        result = get_cmd_result(stdout_tail, returncode, timed_out)
+        keep_output_log_file = keep_output_logs or not result.everything_looks_good
+        return result
 
     finally:
-        if stdout_file is not None:
-            stdout_file.close()
-            show_last_lines(stdout_path, num_lines_to_show)
-            if not keep_output_log_file:
-                try:
-                    os.remove(stdout_path)
-                except IOError as ex:
-                    logging.error("Error deleting output log %s, ignoring: %s", stdout_path, ex)
-        if stderr_file is not None:
-            stderr_file.close()
-            show_last_lines(stderr_path, num_lines_to_show)
-            if not keep_output_log_file:
-                try:
-                    os.remove(stderr_path)
-                except IOError as ex:
-                    logging.error("Error deleting stderr log %s, ignoring: %s", stderr_path, ex)
+        finish_output_logs((stdout_tail, stderr_tail), num_lines_to_show, keep_output_log_file)
+
+
+class WarmRunner:
+    """
+    A long-lived `lein run worker` process (see yugabyte.runner/worker-cmd) running tests for one
+    cluster. Tests are sent to it as JSON lines over stdin, so only the first test pays for
+    Leiningen, Clojure compilation and JVM start-up. The output of each test goes to that test's
+    log files just like with run_cmd, and the worker reports each verdict on a result line. A
+    worker which times out or dies is killed and restarted for the next test.
+    """
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.child = None
+        self.lock = threading.Lock()
+        self.tails = None
+        self.result = None
+        self.result_ready = threading.Event()
+        self.idle_log_path = os.path.join(cluster.logs_dir, "warm-runner.log")
+        self.idle_log = None
+
+    def ensure_started(self):
+        if self.child is not None and not self.child.exited.is_set():
+            return
+        logging.info("Starting warm runner for cluster %s, idle output goes to %s",
+                     self.cluster.name, self.idle_log_path)
+        if self.idle_log is None:
+            self.idle_log = open(self.idle_log_path, 'ab')
+        self.child = get_supervisor().spawn(WARM_RUNNER_CMD,
+                                            on_exit=lambda child: self.result_ready.set(),
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE,
+                                            shell=True,
+                                            cwd=self.cluster.work_dir)
+        for stream_index, stream in enumerate((self.child.popen.stdout, self.child.popen.stderr)):
+            threading.Thread(target=self._pump, args=(stream, stream_index), name="warm-runner",
+                             daemon=True).start()
+
+    def _pump(self, stream, stream_index):
+        for raw_line in iter(stream.readline, b''):
+            if stream_index == 0 and raw_line.startswith(WARM_RUNNER_RESULT_PREFIX):
+                self.result = json.loads(raw_line[len(WARM_RUNNER_RESULT_PREFIX):])
+                self.result_ready.set()
+                continue
+            with self.lock:
+                if self.tails is not None:
+                    self.tails[stream_index].feed(raw_line)
+                else:
+                    self.idle_log.write(raw_line)
+                    self.idle_log.flush()
+        stream.close()
+
+    def run_test(self, cmd, timeout, log_name_prefix, num_lines_to_show, watchdog=None,
+                 keep_output_logs=False, listeners=()):
+        """Runs a `lein run test ...` command in the worker. Returns a CmdResult like run_cmd."""
+        logging.info("Running in the warm runner: %s", cmd)
+        test_args = [os.path.expanduser(arg) for arg in shlex.split(cmd)[3:]]
+        stdout_path, stderr_path = get_output_log_paths(self.cluster.logs_dir, log_name_prefix)
+        tails = (LogTail(stdout_path), LogTail(stderr_path))
+        for tail in tails:
+            for listener in listeners:
+                tail.add_listener(listener)
+        keep_output_log_file = True
+        try:
+            self.ensure_started()
+            if watchdog is not None:
+                child = self.child
+                watchdog.watch(tails, kill=lambda: get_supervisor().terminate(child))
+            with self.lock:
+                self.tails = tails
+                self.result = None
+                self.result_ready.clear()
+            try:
+                self.child.popen.stdin.write((json.dumps(test_args) + "\n").encode())
+                self.child.popen.stdin.flush()
+            except BrokenPipeError:
+                self.result_ready.set()
+
+            timed_out = not self.result_ready.wait(timeout)
+            if watchdog is not None:
+                watchdog.stop()
+            result = self.result
+            if result is None:
+                if timed_out:
+                    logging.error("Test timed out in the warm runner, restarting it")
+                    self.child.timed_out = True
+                else:
+                    logging.error("Warm runner exited with code %s during the test",
+                                  self.child.returncode)
+                get_supervisor().terminate(self.child)
+                self.child.wait()
+                returncode = self.child.returncode
+                if returncode is None or returncode == 0:
+                    returncode = 255
+            else:
+                returncode = WARM_RUNNER_RETURN_CODES.get(str(result.get("valid")).lower(), 255)
+                if returncode != 0:
+                    logging.error("Test failed in the warm runner: %s", result)
+
+            with self.lock:
+                self.tails = None
+            cmd_result = get_cmd_result(tails[0], returncode, timed_out)
+            keep_output_log_file = keep_output_logs or not cmd_result.everything_looks_good
+            return cmd_result
+        finally:
+            with self.lock:
+                self.tails = None
+                for tail in tails:
+                    tail.close()
+            finish_output_logs(tails, num_lines_to_show, keep_output_log_file)
+
+    def close(self):
+        if self.child is not None and not self.child.exited.is_set():
+            self.child.popen.stdin.close()
+            if self.child.wait(WARM_RUNNER_EXIT_TIMEOUT_SEC) is None:
+                get_supervisor().terminate(self.child)
+        if self.idle_log is not None:
+            self.idle_log.close()
+
+
+def ensure_dir(path):
+    if os.path.isdir(path):
+        logging.info(f"Directory {path} already exists", )
+    else:
+        logging.info(f"Creating directory {path}")
+        os.makedirs(path)
+
+
+def default_cluster():
+    """
+    The cluster used when no cluster config is given: Jepsen's default nodes, with the store and
+    logs directories right next to this script.
+    """
+    return Cluster(name="default",
+                   nodes=[],
+                   work_dir=SCRIPT_DIR,
+                   store_dir=STORE_DIR,
+                   logs_dir=LOGS_DIR,
+                   sorted_dir=SORTED_DIR)
+
+
+def load_cluster_config(path):
+    """
+    Loads a JSON cluster config of the following form:
+
+        {"clusters": [{"name": "c1", "nodes": ["n1", "n2", "n3", "n4", "n5"]},
+                      {"name": "c2", "nodes": ["n6", "n7", "n8", "n9", "n10"]}]}
+
+    A plain list of clusters is accepted too. Node sets of different clusters must be disjoint.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    if isinstance(config, dict):
+        config = config.get("clusters", [])
+    if not config:
+        raise ValueError(f"No clusters defined in {path}")
+
+    clusters = []
+    seen_nodes = {}
+    for i, cluster_config in enumerate(config):
+        name = cluster_config.get("name", f"cluster{i + 1}")
+        nodes = cluster_config.get("nodes", [])
+        if not nodes:
+            raise ValueError(f"Cluster {name} in {path} has no nodes")
+        for node in nodes:
+            if node in seen_nodes:
+                raise ValueError(f"Node {node} is used by both cluster {seen_nodes[node]} and "
+                                 f"cluster {name}, clusters must be disjoint")
+            seen_nodes[node] = name
+        work_dir = os.path.join(WORKERS_DIR, name)
+        clusters.append(Cluster(name=name,
+                                nodes=nodes,
+                                work_dir=work_dir,
+                                store_dir=os.path.join(work_dir, "store"),
+                                logs_dir=os.path.join(work_dir, "logs"),
+                                sorted_dir=os.path.join(work_dir, "results-sorted")))
+    return clusters
+
+
+class DockerClusterPool:
+    """
+    Clusters of node containers on the docker environment of docker/, created by the harness and
+    reset after every test by replacing their containers with fresh ones from a snapshot image.
+    The snapshot is committed from a node after the first test that installed the tarball on it
+    and is kept across sweeps, so Jepsen finds the database installed (see yugabyte.auto/install!)
+    and only has to start it. Fresh containers also leave behind whatever the nemeses did to the
+    nodes: firewall rules, stopped or paused processes, skewed clocks, leftover data.
+    """
+
+    def __init__(self, num_clusters, base_image, network, tarball_url,
+                 nodes_per_cluster=DOCKER_POOL_NODES_PER_CLUSTER):
+        self.base_image = base_image
+        self.network = network
+        self.snapshot_image = DOCKER_POOL_SNAPSHOT_REPOSITORY + ":" + \
+            hashlib.sha256(tarball_url.encode()).hexdigest()[:16]
+        self.install_url = None
+        self.lock = threading.Lock()
+        self.has_snapshot = False
+        self.clusters = []
+        for i in range(num_clusters):
+            name = f"pool{i + 1}"
+            work_dir = os.path.join(WORKERS_DIR, name)
+            self.clusters.append(Cluster(
+                name=name,
+                nodes=[f"jepsen-{name}-n{n + 1}" for n in range(nodes_per_cluster)],
+                work_dir=work_dir,
+                store_dir=os.path.join(work_dir, "store"),
+                logs_dir=os.path.join(work_dir, "logs"),
+                sorted_dir=os.path.join(work_dir, "results-sorted")))
+        self.cluster_names = {cluster.name for cluster in self.clusters}
+
+    def start(self, install_url):
+        """
+        Creates the containers of all clusters from the snapshot for the tarball if there is one
+        already, and waits until they accept SSH connections. install_url is what Jepsen installs
+        the tarball from.
+        """
+        self.install_url = install_url
+        self.has_snapshot = self.docker("image", "inspect", self.snapshot_image,
+                                        check=False) is not None
+        logging.info("Starting %d docker cluster(s) from %s", len(self.clusters),
+                     self.snapshot_image if self.has_snapshot else self.base_image)
+        with ThreadPoolExecutor(max_workers=len(self.clusters)) as executor:
+            list(executor.map(self.replace_containers, self.clusters))
+
+    def reset(self, test_run):
+        """
+        Replaces the containers of the cluster of a test that stopped, snapshotting one of them
+        first if there is no snapshot yet. Can be registered as a SweepReport stop listener.
+        """
+        cluster = test_run.cluster
+        if cluster.name not in self.cluster_names:
+            return
+        start_time_sec = time.time()
+        with self.lock:
+            if not self.has_snapshot:
+                self.has_snapshot = self.take_snapshot(cluster.nodes[0])
+        self.replace_containers(cluster)
+        logging.info("Reset docker cluster %s in %.1f sec", cluster.name,
+                     time.time() - start_time_sec)
+
+    def take_snapshot(self, container):
+        """Commits the container as the snapshot if the tarball is installed on it."""
+        installed_url = self.docker("exec", container, "cat", DOCKER_POOL_INSTALLED_URL_FILE,
+                                    check=False)
+        if installed_url is None or installed_url.strip() != self.install_url:
+            logging.warning("The tarball is not installed on %s, not taking a snapshot of it",
+                            container)
+            return False
+        self.docker("exec", container, "rm", "-rf", DOCKER_POOL_DATA_DIR)
+        self.docker("commit", container, self.snapshot_image)
+        logging.info("Committed %s as %s", container, self.snapshot_image)
+        return True
+
+    def replace_containers(self, cluster):
+        image = self.snapshot_image if self.has_snapshot else self.base_image
+        with open(DOCKER_POOL_PUBLIC_KEY_PATH) as public_key_file:
+            public_key = public_key_file.read()
+
+        def replace(node):
+            self.docker("rm", "-f", node, check=False)
+            self.docker("run", "-d", "-t", "--name", node, "--hostname", node,
+                        "--network", self.network, "--privileged", "--cap-add", "ALL",
+                        "--tmpfs", "/run:size=100M", "--tmpfs", "/run/lock:size=100M", image)
+            self.docker("exec", "-i", node, "sh", "-c",
+                        "mkdir -p -m 700 /root/.ssh && cat > /root/.ssh/authorized_keys && "
+                        "chmod 600 /root/.ssh/authorized_keys", input=public_key)
+            # The new container has a new host key.
+            subprocess.run(["ssh-keygen", "-R", node], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+            wait_for_port(node, 22, DOCKER_POOL_BOOT_TIMEOUT_SEC)
+
+        with ThreadPoolExecutor(max_workers=len(cluster.nodes)) as executor:
+            list(executor.map(replace, cluster.nodes))
+
+    def docker(self, *args, check=True, input=None):
+        """
+        Runs a docker command and returns its output. Raises a RuntimeError if it fails, or returns
+        None if check is False.
+        """
+        try:
+            result = subprocess.run(["docker", *args], input=input, capture_output=True, text=True,
+                                    timeout=DOCKER_POOL_CMD_TIMEOUT_SEC)
+        except subprocess.TimeoutExpired:
+            result = None
+        if result is None or result.returncode != 0:
+            if check:
+                raise RuntimeError("docker %s failed: %s" % (
+                    " ".join(args), "timed out" if result is None else result.stderr.strip()))
+            return None
+        return result.stdout
+
+    def close(self):
+        nodes = [node for cluster in self.clusters for node in cluster.nodes]
+        self.docker("rm", "-f", *nodes, check=False)
+
+
+def wait_for_port(host, port, timeout_sec):
+    deadline = time.time() + timeout_sec
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.5)
+
+
+def prepare_cluster_dirs(cluster):
+    if cluster.work_dir != SCRIPT_DIR:
+        ensure_dir(cluster.work_dir)
+        for name in WORKER_DIR_LINKS:
+            link_path = os.path.join(cluster.work_dir, name)
+            if not os.path.lexists(link_path):
+                os.symlink(os.path.join(SCRIPT_DIR, name), link_path)
+    ensure_dir(cluster.logs_dir)
+
+
+class SweepReport:
+    """
+    Results of all tests run so far. Tests running on different clusters report here concurrently,
+    so all updates go through a lock.
+    """
+
+    def __init__(self, start_time, num_tests_started=0):
+        self.start_time = start_time
+        self.lock = threading.Lock()
+        self.test_cases = {}
+        # Phase durations of the runs in test_cases, and of all runs per workload.
+        self.test_phases = {}
+        self.phases_by_workload = {}
+        self.not_good_tests = []
+        # Tests are numbered from num_tests_started + 1, see test_started.
+        self.num_tests_started = num_tests_started
+        self.num_tests_run = 0
+        self.num_timed_out_tests = 0
+        self.total_test_time_sec = 0
+        self.num_everything_looks_good = 0
+        self.num_not_everything_looks_good = 0
+        self.num_zero_exit_code = 0
+        self.num_non_zero_exit_code = 0
+        self.listeners = []
+        self.start_listeners = []
+        self.stop_listeners = []
+
+    def add_listener(self, listener):
+        """Registers a function to be called with every recorded TestOutcome."""
+        self.listeners.append(listener)
+
+    def add_start_listener(self, listener):
+        """Registers a function to be called with the TestSpec, Cluster and index of every test as
+        it starts."""
+        self.start_listeners.append(listener)
+
+    def add_stop_listener(self, listener):
+        """Registers a function to be called with the TestRun of every test once Jepsen exits,
+        before its analysis was possibly deferred."""
+        self.stop_listeners.append(listener)
+
+    def test_started(self, spec, cluster):
+        """Assigns the next index to a test that is starting, and returns it."""
+        with self.lock:
+            self.num_tests_started += 1
+            test_index = self.num_tests_started
+        self._notify(self.start_listeners, f"test run #{test_index}", spec, cluster, test_index)
+        return test_index
+
+    def test_stopped(self, test_run):
+        self._notify(self.stop_listeners, test_run.description, test_run)
+
+    def _notify(self, listeners, description, *args):
+        for listener in listeners:
+            try:
+                listener(*args)
+            except Exception:
+                logging.exception("Listener failed for %s", description)
+
+    def record(self, outcome):
+        with self.lock:
+            self._add(outcome)
+            self.log_progress()
+        for listener in self.listeners:
+            try:
+                listener(outcome)
+            except Exception:
+                logging.exception("Failed to process the outcome of %s", outcome.description)
+
+    def restore(self, outcome):
+        """Adds an outcome of an earlier run of the sweep, without passing it to the listeners."""
+        with self.lock:
+            self._add(outcome)
+
+    def _add(self, outcome):
+        """Updates the report with an outcome. The caller holds the lock."""
+        result = outcome.result
+        if result.timed_out:
+            self.num_timed_out_tests += 1
+
+        if result.everything_looks_good:
+            self.num_everything_looks_good += 1
+
+            if outcome.test_name not in self.test_cases:
+                self.test_cases[outcome.test_name] = outcome.test_case
+                self.test_phases[outcome.test_name] = outcome.phases
+        else:
+            self.num_not_everything_looks_good += 1
+            self.not_good_tests.append(outcome.description)
+            # always add latest failed run for the results
+            self.test_cases[outcome.test_name] = outcome.test_case
+            self.test_phases[outcome.test_name] = outcome.phases
+        self.phases_by_workload.setdefault(outcome.workload, []).append(outcome.phases)
+
+        if result.returncode == 0:
+            self.num_zero_exit_code += 1
+        else:
+            self.num_non_zero_exit_code += 1
+
+        self.num_tests_run += 1
+        self.total_test_time_sec += outcome.elapsed_time_sec
+
+    def add_extra_test_case(self, key, tc):
+        """
+        Adds a test case that is not a test run to the report, e.g. a performance check. Failed
+        ones are not replaced by later passing ones, like with test runs.
+        """
+        with self.lock:
+            existing = self.test_cases.get(key)
+            if existing is None or not (existing.is_failure() or existing.is_error()):
+                self.test_cases[key] = tc
+
+    def junit_properties(self):
+        """Phase durations of the reported runs, as properties of the JUnit test suite."""
+        with self.lock:
+            return {f"{test_name}.phase.{phase}_sec": sec
+                    for test_name, phases in sorted(self.test_phases.items())
+                    for phase, sec in phases.items()}
+
+    def log_phase_report(self):
+        with self.lock:
+            if self.phases_by_workload:
+                logging.info("Mean time per test phase (sec):\n%s",
+                             get_phase_report(self.phases_by_workload))
+
+    def log_progress(self):
+        total_elapsed_time_sec = time.time() - self.start_time
+        logging.info("Finished running %d tests.", self.num_tests_run)
+        logging.info("    %d okay, %d problems (%d timed-out)",
+                     self.num_everything_looks_good, self.num_not_everything_looks_good,
+                     self.num_timed_out_tests)
+        logging.info("    %d tests (out of %d total) returned non-zero exit code",
+                     self.num_non_zero_exit_code, self.num_tests_run)
+        logging.info("Elapsed time: %.1f sec, test time: %.1f sec, avg test time: %.1f sec",
+                     total_elapsed_time_sec, self.total_test_time_sec,
+                     self.total_test_time_sec / self.num_tests_run)
+        if self.not_good_tests:
+            logging.info("Tests where something does not look good:\n    %s",
+                         "\n    ".join(self.not_good_tests))
+
+
+class FailureConfirmer:
+    """
+    Reruns every (workload, nemesis) that failed in the sweep a number of times with a shorter
+    time limit, to tell failures that reproduce from flakes in the same run. The reruns are
+    reported to a SweepReport of their own, so they neither hide nor add to the failures of the
+    sweep. Each confirmed test gets a confirm.<api> JUnit test case with its reproduction rate,
+    which fails if the failure reproduced, and the failing history with the fewest ops out of the
+    original run and the reruns is copied to keep_dir.
+    """
+
+    def __init__(self, num_reruns, time_limit_sec, keep_dir):
+        self.num_reruns = num_reruns
+        self.time_limit_sec = time_limit_sec
+        self.keep_dir = keep_dir
+        self.lock = threading.Lock()
+        # Failed outcomes of the sweep and outcomes of the reruns, by (workload, nemesis).
+        self.failures = {}
+        self.reruns = {}
+
+    @staticmethod
+    def is_failure(outcome):
+        return outcome.category not in ("ok", "preflight-failed")
+
+    @staticmethod
+    def get_rerun_test_id(workload, nemesis, rerun):
+        return get_test_id(workload, nemesis, f"confirm-{rerun}")
+
+    def is_rerun(self, outcome):
+        """Returns whether a journaled outcome is one of a confirmation rerun."""
+        return any(outcome.test_id == self.get_rerun_test_id(outcome.workload, outcome.nemesis,
+                                                            rerun)
+                   for rerun in range(self.num_reruns))
+
+    def collect(self, outcome):
+        """Notes a failed outcome of the sweep. Can be registered as a SweepReport listener."""
+        if self.is_failure(outcome):
+            with self.lock:
+                self.failures.setdefault((outcome.workload, outcome.nemesis), []).append(outcome)
+
+    def add_rerun(self, outcome):
+        """Notes the outcome of a rerun. Can be registered as a SweepReport listener."""
+        with self.lock:
+            self.reruns.setdefault((outcome.workload, outcome.nemesis), []).append(outcome)
+
+    def get_tracked_run_dirs(self):
+        """Returns the run directories of the failures and reruns whose history may be kept."""
+        with self.lock:
+            return {outcome.run_dir for outcomes in chain(self.failures.values(),
+                                                          self.reruns.values())
+                    for outcome in outcomes if outcome.run_dir is not None}
+
+    def get_rerun_specs(self):
+        """
+        Returns the reruns of all failed tests, round-robin, so that reruns of the same test run on
+        different clusters at the same time. Reruns done before the sweep was resumed are left out.
+        """
+        specs = []
+        with self.lock:
+            done_test_ids = {outcome.test_id for outcomes in self.reruns.values()
+                             for outcome in outcomes if outcome.category != "preflight-failed"}
+            for rerun in range(self.num_reruns):
+                for (workload, nemesis), outcomes in self.failures.items():
+                    test_id = self.get_rerun_test_id(workload, nemesis, rerun)
+                    if test_id in done_test_ids:
+                        continue
+                    time_limit_sec = self.time_limit_sec or max(
+                        CONFIRM_MIN_TIME_LIMIT_SEC,
+                        int(outcomes[-1].time_limit_sec * CONFIRM_TIME_LIMIT_FRACTION))
+                    specs.append(TestSpec(
+                        test_id=test_id,
+                        workload=workload,
+                        nemesis=nemesis,
+                        iteration=rerun,
+                        time_limit_sec=time_limit_sec))
+        return specs
+
+    def report_to(self, report, build_url):
+        """Adds the reproduction rate of every failed test to the report of the sweep."""
+        summary = []
+        with self.lock:
+            failures = dict(self.failures)
+            reruns = dict(self.reruns)
+        for (workload, nemesis), outcomes in sorted(failures.items()):
+            test_reruns = [outcome for outcome in reruns.get((workload, nemesis), [])
+                           if outcome.category != "preflight-failed"]
+            reproduced = [outcome for outcome in test_reruns if self.is_failure(outcome)]
+            description = "reproduced in %d of %d reruns" % (len(reproduced), len(test_reruns))
+            if test_reruns:
+                description += " (%d%%)" % round(100 * len(reproduced) / len(test_reruns))
+            categories = sorted({outcome.category for outcome in reproduced})
+            if categories:
+                description += ": " + ", ".join(categories)
+            kept_history = self.keep_smallest_history(outcomes[-1].test_name,
+                                                      outcomes + reproduced)
+            if kept_history is not None:
+                description += "\nSmallest failing history: " + kept_history
+            summary.append(f"workload {workload}, nemesis {nemesis}: " +
+                           description.replace("\n", "\n        "))
+            tc = TestCase(name=outcomes[-1].test_name,
+                          classname="confirm." + workload.split('/')[0],
+                          url=build_url,
+                          stdout=description)
+            if reproduced:
+                tc.add_failure_info("Failure reproduced", description,
+                                    failure_type=categories[0])
+            report.add_extra_test_case("confirm:" + outcomes[-1].test_name, tc)
+        if summary:
+            logging.info("Confirmation reruns of failed tests:\n    %s", "\n    ".join(summary))
+
+    def keep_smallest_history(self, test_name, outcomes):
+        """
+        Copies the history with the fewest ops out of those of the outcomes to keep_dir and
+        returns its new path, or None if there is none.
+        """
+        smallest = None
+        for outcome in outcomes:
+            if outcome.run_dir is None:
+                continue
+            history_path = find_maybe_compressed(os.path.join(outcome.run_dir, "history.edn"))
+            if history_path is None:
+                continue
+            num_ops = sum(1 for _ in iter_history_ops(history_path, keys=()))
+            if smallest is None or num_ops < smallest[0]:
+                smallest = (num_ops, history_path)
+        if smallest is None:
+            return None
+        os.makedirs(self.keep_dir, exist_ok=True)
+        suffix = os.path.basename(smallest[1])[len("history.edn"):]
+        kept_path = os.path.join(self.keep_dir,
+                                 f"{test_name.replace('/', '-')}.history.edn{suffix}")
+        shutil.copyfile(smallest[1], kept_path)
+        return kept_path
+
+
+def get_lein_cmd(args, url, cluster):
+    lein_cmd = " ".join(["lein run test",
+                         "--os debian",
+                         f"--url {url}",
+                         f"--ssh-private-key ~/.ssh/id_rsa",  # tmp workaround for jepsen 0.2.7+ versions
+                         f"--concurrency {args.concurrency}"])
+    if cluster.nodes:
+        lein_cmd += " --nodes " + ",".join(cluster.nodes)
+    if args.iterations:
+        lein_cmd += " --test-count 1"
+    return lein_cmd
+
+
+def start_test(spec, lein_cmd, cluster, report, warm_runner=None, sampler=None, watchdog=None,
+               skip_analysis=False):
+    """Runs a test on the cluster and returns the TestRun to pass to finish_test."""
+    test = spec.workload
+    nemeses = spec.nemesis
+    test_index = report.test_started(spec, cluster)
+    test_description_str = f"workload {test}, nemesis {nemeses}"
+    if cluster.nodes:
+        test_description_str += f", cluster {cluster.name}"
+    logging.info(
+        "\n%s\nStarting test run #%d - %s\n%s",
+        "=" * 80,
+        test_index,
+        test_description_str,
+        "=" * 80)
+    test_start_time_sec = time.time()
+    # If the test dies before Jepsen creates its run directory, `current` still points to the
+    # previous run, which may even be under deferred analysis.
+    previous_run_dir = get_current_run_dir(cluster.store_dir)
+    full_cmd = lein_cmd + \
+               " --nemesis " + nemeses + \
+               " --time-limit " + str(spec.time_limit_sec) + \
+               " --workload " + test
+    if skip_analysis:
+        full_cmd += " --skip-analysis"
+    log_name_prefix = f"{test.replace('/', '-')}_nemesis_{nemeses}_{test_index}"
+    if sampler is not None:
+        sampler.start(os.path.join(cluster.logs_dir, f"{log_name_prefix}_{TELEMETRY_FILE_NAME}"))
+    phase_timer = PhaseTimer()
+    if warm_runner is not None:
+        result = warm_runner.run_test(
+            full_cmd,
+            timeout=TEST_AND_ANALYSIS_TIMEOUT_SEC,
+            log_name_prefix=log_name_prefix,
+            num_lines_to_show=30,
+            watchdog=watchdog,
+            keep_output_logs=skip_analysis,
+            listeners=[phase_timer.on_line])
+    else:
+        result = run_cmd(
+            full_cmd,
+            timeout=TEST_AND_ANALYSIS_TIMEOUT_SEC,
+            exit_on_error=False,
+            log_name_prefix=log_name_prefix,
+            num_lines_to_show=30,
+            cwd=cluster.work_dir,
+            logs_dir=cluster.logs_dir,
+            watchdog=watchdog,
+            keep_output_logs=skip_analysis,
+            listeners=[phase_timer.on_line])
+
+    phase_timer.stop()
+    test_elapsed_time_sec = time.time() - test_start_time_sec
+    run_dir = get_current_run_dir(cluster.store_dir)
+    if run_dir is not None and run_dir == previous_run_dir:
+        logging.error("Test run #%d did not create a run directory, %s is from an earlier run",
+                      test_index, run_dir)
+        run_dir = None
+    if sampler is not None:
+        telemetry_path = sampler.stop()
+        if run_dir is not None:
+            shutil.move(telemetry_path, os.path.join(run_dir, TELEMETRY_FILE_NAME))
+    if result.timed_out:
+        if run_dir is not None:
+            jepsen_log_file = os.path.join(run_dir, 'jepsen.log')
+            logging.info("Test timed out. Updating the log at %s", jepsen_log_file)
+            msg = "Test run timed out!"
+            logging.info(msg)
+            with open(jepsen_log_file, "a") as f:
+                f.write(msg)
+        else:
+            logging.error("Test timed out, but it has no run directory to record that in")
+    if watchdog is not None and watchdog.category is not None:
+        if run_dir is not None:
+            with open(os.path.join(run_dir, "jepsen.log"), "a") as f:
+                f.write(f"\n{WATCHDOG_MARKER}{watchdog.category} ({watchdog.reason})\n")
+        else:
+            logging.error("No Jepsen run directory to record the watchdog abort in")
+    test_run = TestRun(spec=spec,
+                       cluster=cluster,
+                       test_index=test_index,
+                       description=test_description_str,
+                       cmd=full_cmd,
+                       log_name_prefix=log_name_prefix,
+                       result=result,
+                       elapsed_time_sec=test_elapsed_time_sec,
+                       run_dir=run_dir,
+                       watchdog=watchdog,
+                       phases=phase_timer.durations())
+    report.test_stopped(test_run)
+    return test_run
+
+
+def finish_test(test_run, build_url, analysis_result=None, analysis_time_sec=0):
+    """
+    Reports a test and sorts its run directory. For a test whose analysis was deferred, the
+    analysis result decides the verdict.
+    """
+    spec, cluster, test_index = test_run.spec, test_run.cluster, test_run.test_index
+    test = spec.workload
+    nemeses = spec.nemesis
+    test_description_str = test_run.description
+    result = test_run.result if analysis_result is None else analysis_result
+    test_elapsed_time_sec = test_run.elapsed_time_sec + analysis_time_sec
+    run_dir = test_run.run_dir
+    watchdog = test_run.watchdog
+    phases = dict(test_run.phases)
+    if analysis_result is not None:
+        phases["deferred-analysis"] = round(analysis_time_sec, 1)
+    aborted = watchdog is not None and watchdog.category is not None
+
+    test_name = f"{test}_{nemeses}"
+    tc = TestCase(name=test_name,
+                  classname=test.split('/')[0],
+                  elapsed_sec=test_elapsed_time_sec,
+                  url=build_url,
+                  stderr=result.output)
+    logging.info(
+        "Test run #%d: elapsed_time=%.1f, returncode=%d, everything_looks_good=%s",
+        test_index, test_elapsed_time_sec, result.returncode,
+        result.everything_looks_good)
+    logging.info("Test run #%d phases (sec): %s", test_index,
+                 ", ".join(f"{phase}={sec}" for phase, sec in phases.items()))
+
+    if not result.everything_looks_good:
+        tc.add_error_info(test_description_str)
+
+        if result.timed_out:
+            message = "Timed out"
+
+            tc.add_error_info(message)
+        elif aborted:
+            message = f"Aborted by the watchdog ({watchdog.category}): {watchdog.reason}"
+
+            tc.add_error_info(message)
+        elif not result.everything_looks_good:
+            message = "Failure on result validation"
+
+            tc.add_error_info(message)
+        else:
+            message = f"Process exited with error code {result.returncode}"
+
+            tc.add_failure_info(message, failure_type="exit code")
+
+    category = None
+    if run_dir is not None:
+        category, run_dir = sort_run_dir(run_dir, cluster.store_dir, cluster.sorted_dir, nemeses,
+                                         {"workload": test,
+                                          "nemesis": nemeses,
+                                          "cluster": cluster.name,
+                                          "returncode": result.returncode,
+                                          "time_limit_sec": spec.time_limit_sec,
+                                          "elapsed_time_sec": round(test_elapsed_time_sec, 1),
+                                          "phases": phases})
+    else:
+        logging.error("No Jepsen run directory found for test run #%d in %s",
+                      test_index, cluster.store_dir)
+
+    logging.info(
+        "\n%s\nFinished test run #%d (%s)\n%s",
+        "=" * 80, test_index, test_description_str, "=" * 80)
+
+    return TestOutcome(test_id=spec.test_id,
+                       iteration=spec.iteration,
+                       workload=test,
+                       nemesis=nemeses,
+                       cluster=cluster.name,
+                       test_name=test_name,
+                       description=test_description_str,
+                       test_case=tc,
+                       result=result,
+                       elapsed_time_sec=test_elapsed_time_sec,
+                       time_limit_sec=spec.time_limit_sec,
+                       category=category,
+                       run_dir=run_dir,
+                       phases=phases)
+
+
+def get_skipped_test_outcome(spec, cluster, reason, category, build_url):
+    """Returns the TestOutcome of a test that was not run at all, to report it as an error."""
+    test_name = f"{spec.workload}_{spec.nemesis}"
+    description = f"workload {spec.workload}, nemesis {spec.nemesis}, cluster {cluster.name}"
+    tc = TestCase(name=test_name,
+                  classname=spec.workload.split('/')[0],
+                  elapsed_sec=0,
+                  url=build_url,
+                  stderr=reason)
+    tc.add_error_info(description)
+    tc.add_error_info(f"Not run: {reason}")
+    logging.error("Not running %s: %s", description, reason)
+    return TestOutcome(test_id=spec.test_id,
+                       iteration=spec.iteration,
+                       workload=spec.workload,
+                       nemesis=spec.nemesis,
+                       cluster=cluster.name,
+                       test_name=test_name,
+                       description=description,
+                       test_case=tc,
+                       result=CmdResult(output=reason,
+                                        returncode=None,
+                                        timed_out=False,
+                                        everything_looks_good=False),
+                       elapsed_time_sec=0,
+                       time_limit_sec=spec.time_limit_sec,
+                       category=category,
+                       run_dir=None,
+                       phases={})
+
+
+class DeferredAnalyzer:
+    """
+    Checks the histories of tests run with --skip-analysis in a pool of local `lein run analyze`
+    processes, so that the cluster can run the next test meanwhile. Each test is reported once its
+    analysis is done, with the verdict of the analysis and the time of both steps.
+    """
+
+    def __init__(self, num_workers, report, build_url):
+        self.report = report
+        self.build_url = build_url
+        self.executor = ThreadPoolExecutor(max_workers=num_workers,
+                                           thread_name_prefix="analysis")
+
+    def submit(self, test_run):
+        """Analyzes the test in the background if its run step got far enough, or reports it."""
+        if (test_run.result.returncode != 0 or test_run.run_dir is None or
+                not os.path.exists(os.path.join(test_run.run_dir, "history.edn"))):
+            self.report.record(finish_test(test_run, self.build_url))
+            return
+        self.executor.submit(self._analyze, test_run)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _analyze(self, test_run):
+        try:
+            start_time_sec = time.time()
+            # The analysis takes all options of the test, to build the same checker.
+            cmd = ("lein run analyze" + test_run.cmd[len("lein run test"):] +
+                   " --store-path " + shlex.quote(test_run.run_dir))
+            result = run_cmd(
+                cmd,
+                timeout=TEST_AND_ANALYSIS_TIMEOUT_SEC,
+                exit_on_error=False,
+                log_name_prefix=test_run.log_name_prefix + "_analysis",
+                num_lines_to_show=30,
+                cwd=test_run.cluster.work_dir,
+                logs_dir=test_run.cluster.logs_dir)
+            analysis_time_sec = time.time() - start_time_sec
+            if result.timed_out:
+                verdict = "failed (timed out)"
+            elif result.everything_looks_good:
+                verdict = ":valid? true"
+            else:
+                verdict = {1: ":valid? false", 2: ":valid? :unknown"}.get(
+                    result.returncode, f"failed (exit code {result.returncode})")
+            logging.info("Analysis of test run #%d took %.1f sec: %s", test_run.test_index,
+                         analysis_time_sec, verdict)
+            with open(os.path.join(test_run.run_dir, "jepsen.log"), "a") as f:
+                f.write(f"\n{DEFERRED_ANALYSIS_MARKER}{verdict}\n")
+            if result.everything_looks_good:
+                # The run step kept its logs until the verdict was known.
+                for path in get_output_log_paths(test_run.cluster.logs_dir,
+                                                 test_run.log_name_prefix):
+                    if os.path.exists(path):
+                        os.remove(path)
+            self.report.record(finish_test(test_run, self.build_url, result, analysis_time_sec))
+        except Exception:
+            logging.exception("Analysis of test run #%d failed", test_run.test_index)
+
+
+def build_test_matrix(workloads, nemesis_sets, iterations, version):
+    """
+    Expands workloads x nemesis sets x iterations into TestSpecs, leaving out workloads that need a
+    newer version than the one tested. nemesis_sets is either a list of the nemesis sets to run
+    every workload with or a dict of them by workload, see plan_nemesis_coverage. Returns the specs
+    and the skipped workloads.
+    """
+    specs = []
+    skipped_workloads = []
+    for workload in workloads:
+        if not is_version_at_least(get_workload_version(workload), version):
+            skipped_workloads.append(workload)
+            continue
+        workload_nemesis_sets = nemesis_sets
+        if isinstance(nemesis_sets, dict):
+            workload_nemesis_sets = nemesis_sets[workload]
+        for nemesis in workload_nemesis_sets:
+            for iteration in range(iterations):
+                specs.append(TestSpec(test_id=get_test_id(workload, nemesis, iteration),
+                                      workload=workload,
+                                      nemesis=nemesis,
+                                      iteration=iteration,
+                                      time_limit_sec=get_default_time_limit(workload)))
+    return specs, skipped_workloads
+
+
+def run_tests_on_clusters(scheduler, clusters, args, url, report):
+    """
+    Runs tests from the scheduler on a pool of clusters, one test per cluster at a time. Each worker
+    thread leases a free cluster, runs the next pending test on it and returns the cluster to the
+    pool, so the number of concurrently running tests is bounded by the number of clusters.
+    With --warm-runner, each cluster keeps its own WarmRunner for the whole sweep.
+    """
+    free_clusters = queue.Queue()
+    for cluster in clusters:
+        free_clusters.put(cluster)
+    warm_runners = {}
+    if args.warm_runner:
+        warm_runners = {cluster.name: WarmRunner(cluster) for cluster in clusters}
+    analyzer = None
+    if args.pipeline:
+        analyzer = DeferredAnalyzer(args.analysis_workers, report, args.build_url)
+    ssh_pools = {}
+    if args.telemetry_interval_sec or args.preflight:
+        ssh_pools = {cluster.name: SshPool(cluster.nodes or JEPSEN_DEFAULT_NODES)
+                     for cluster in clusters}
+    samplers = {}
+    if args.telemetry_interval_sec:
+        samplers = {cluster.name: NodeSampler(ssh_pools[cluster.name], args.telemetry_interval_sec)
+                    for cluster in clusters}
+    preflights = {}
+    if args.preflight:
+        preflights = {cluster.name: ClusterPreflight(cluster, ssh_pools[cluster.name])
+                      for cluster in clusters}
+    clusters_in_service = len(clusters)
+    # Workers still pulling tests from the scheduler. A worker only gives a test back to the
+    # scheduler while another one is going to pull it, see worker().
+    active_workers = len(clusters)
+    service_lock = threading.Lock()
+
+    def wait_until_healthy(cluster):
+        """
+        Returns whether the cluster passes its preflight, waiting for it to recover for up to
+        --preflight-max-wait-sec since it started failing.
+        """
+        preflight = preflights[cluster.name]
+        while preflight.check():
+            if preflight.get_failing_time_sec() >= args.preflight_max_wait_sec:
+                return False
+            logging.warning("Postponing the test on cluster %s, checking it again in %d sec",
+                            cluster.name, PREFLIGHT_RETRY_INTERVAL_SEC)
+            time.sleep(PREFLIGHT_RETRY_INTERVAL_SEC)
+        return True
+
+    def worker():
+        nonlocal clusters_in_service, active_workers
+        while True:
+            spec = scheduler.next_test()
+            if spec is None:
+                with service_lock:
+                    # A worker retiring its cluster may have given a test back in the meantime.
+                    spec = scheduler.next_test()
+                    if spec is None:
+                        active_workers -= 1
+                        return
+            cluster = free_clusters.get()
+            try:
+                if preflights and not wait_until_healthy(cluster):
+                    with service_lock:
+                        retire = clusters_in_service > 1 and active_workers > 1
+                        if retire:
+                            clusters_in_service -= 1
+                            active_workers -= 1
+                            scheduler.requeue(spec)
+                    if retire:
+                        # Leave the test to the healthy clusters and stop using this one.
+                        logging.error("Taking cluster %s out of service: %s", cluster.name,
+                                      "; ".join(preflights[cluster.name].problems))
+                        cluster = None
+                        return
+                    report.record(get_skipped_test_outcome(
+                        spec, cluster, "cluster preflight failed: " +
+                        "; ".join(preflights[cluster.name].problems),
+                        "preflight-failed", args.build_url))
+                    continue
+                lein_cmd = get_lein_cmd(args, url, cluster)
+                for attempt in range(args.watchdog_retries + 1):
+                    watchdog = None
+                    if args.watchdog:
+                        watchdog = Watchdog(args.watchdog_no_progress_sec)
+                    test_run = start_test(spec, lein_cmd, cluster, report,
+                                          warm_runners.get(cluster.name),
+                                          samplers.get(cluster.name), watchdog,
+                                          skip_analysis=analyzer is not None)
+                    if (watchdog is not None and watchdog.category is not None and
+                            attempt < args.watchdog_retries):
+                        # Only the last attempt is reported, so that a retry which passes is not
+                        # outweighed by the aborted run before it. The aborted run is still sorted.
+                        aborted_outcome = finish_test(test_run, args.build_url)
+                        logging.warning("Retrying %s (%s) after the watchdog aborted it (%s: %s, "
+                                        "run directory %s), retry %d of %d", spec.workload,
+                                        spec.nemesis, watchdog.category, watchdog.reason,
+                                        aborted_outcome.run_dir, attempt + 1,
+                                        args.watchdog_retries)
+                        continue
+                    if analyzer is not None:
+                        analyzer.submit(test_run)
+                    else:
+                        report.record(finish_test(test_run, args.build_url))
+                    break
+            finally:
+                if cluster is not None:
+                    free_clusters.put(cluster)
+
+    with ThreadPoolExecutor(max_workers=len(clusters)) as executor:
+        futures = [executor.submit(worker) for _ in clusters]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # Don't let the executor wait for the running tests when interrupted.
+            scheduler.stop()
+            cleanup()
+            raise
+        finally:
+            for preflight in preflights.values():
+                preflight.close()
+            for ssh_pool in ssh_pools.values():
+                ssh_pool.close()
+    if analyzer is not None:
+        analyzer.close()
+    for warm_runner in warm_runners.values():
+        warm_runner.close()
 
 
 def parse_args():
@@ -392,45 +2215,289 @@ def parse_args():
     parser.add_argument(
         '--nemeses',
         default=','.join(NEMESES),
-        help='Comma-seperated list of nemeses. Default: ' + ','.join(NEMESES))
+        help='Comma-seperated list of nemeses. Several nemesis sets, each of which is tested with '
+             'every workload, can be separated by semicolons, e.g. "partition,kill;clock-skew". '
+             'Default: ' + ','.join(NEMESES))
+    parser.add_argument(
+        '--confirm-failures',
+        type=int,
+        help='After the sweep, rerun every failed workload and nemesis this many times, on all '
+             'clusters in parallel and within --max-time-sec, and report how often the failure '
+             'reproduced. The failing history with the fewest ops is kept in ' + CONFIRMATIONS_DIR +
+             '.')
+    parser.add_argument(
+        '--confirm-time-limit-sec',
+        type=int,
+        help='Time limit of confirmation reruns. Default: %d%%%% of the failed run\'s time limit, at '
+             'least %d sec.' % (CONFIRM_TIME_LIMIT_FRACTION * 100, CONFIRM_MIN_TIME_LIMIT_SEC))
+    parser.add_argument(
+        '--nemesis-coverage',
+        type=int,
+        help='Instead of running every workload with every nemesis set of --nemeses, plan nemesis '
+             'sets of the faults listed there such that every combination of this many faults '
+             '(at most --max-nemeses-per-test) is injected together in at least one test of every '
+             'workload. Sets are chosen by the recent failure rates of their faults from the '
+             'results database, except with --shard or --resume, where the plan must not depend '
+             'on local state. "none" runs alone.')
+    parser.add_argument(
+        '--max-nemeses-per-test',
+        type=int,
+        default=3,
+        help='Maximum number of faults --nemesis-coverage combines in one test. Default: 3')
     parser.add_argument(
         '--iterations',
         type=int,
         help='Run each workload repeatedly for this many iterations.')
-    return parser.parse_args()
+    parser.add_argument(
+        '--results-db',
+        default=RESULTS_DB_PATH,
+        help='SQLite database every test run is recorded in, see the "query" subcommand. Pass an '
+             'empty string to disable. Default: ' + RESULTS_DB_PATH)
+    parser.add_argument(
+        '--adaptive-schedule',
+        action='store_true',
+        help='Order workloads by how long ago they last ran and how often they failed recently, '
+             'and fit them into --max-time-sec using their durations from the results database. '
+             'Time limits of individual tests are derived from the history as well.')
+    parser.add_argument(
+        '--cluster-config',
+        help='JSON file with disjoint node sets to run tests on, e.g. '
+             '{"clusters": [{"name": "c1", "nodes": ["n1", "n2", "n3"]}, ...]}. Each cluster gets '
+             'its own store and logs directories under ' + WORKERS_DIR + '.')
+    parser.add_argument(
+        '--parallel',
+        type=int,
+        help='Number of tests to run concurrently, each on its own cluster from --cluster-config. '
+             'Default: the number of configured clusters.')
+    parser.add_argument(
+        '--docker-pool',
+        type=int,
+        help='Run tests on this many clusters of %d node containers which the harness creates on '
+             'the docker environment of docker/ (see docker/docker-compose.pool.yml), and resets '
+             'after every test by recreating them from a snapshot taken once the tarball is '
+             'installed.' % DOCKER_POOL_NODES_PER_CLUSTER)
+    parser.add_argument(
+        '--docker-pool-image',
+        default=DOCKER_POOL_BASE_IMAGE,
+        help='Image of the --docker-pool node containers before the tarball is installed. '
+             'Default: ' + DOCKER_POOL_BASE_IMAGE)
+    parser.add_argument(
+        '--docker-pool-network',
+        default=DOCKER_POOL_NETWORK,
+        help='Docker network of the --docker-pool containers. Default: ' + DOCKER_POOL_NETWORK)
+    parser.add_argument(
+        '--warm-runner',
+        action='store_true',
+        help='Run all tests of a cluster in one long-lived "lein run worker" JVM instead of '
+             'starting Leiningen for every test.')
+    parser.add_argument(
+        '--telemetry-interval-sec',
+        type=int,
+        help='Sample memory, connections, RPCs, metrics, threads and lock contention from all '
+             'nodes every this many seconds while each test runs, into ' + TELEMETRY_FILE_NAME +
+             ' in the test\'s store directory. Disabled by default.')
+    parser.add_argument(
+        '--shard',
+        help='Only run the i-th of N shards of the test matrix, given as i/N with i starting at 1. '
+             'Agents running the other shards with the same arguments run the remaining tests.')
+    parser.add_argument(
+        '--shard-durations',
+        help='Expected test durations to balance shards by, as written by "query --json". All '
+             'agents of a sweep have to use the same file.')
+    parser.add_argument(
+        '--watchdog',
+        action='store_true',
+        help='Abort tests as soon as their output shows a known fatal error, their setup takes '
+             'longer than %d seconds or they stop logging ops, instead of waiting for the %d second '
+             'timeout.' % (WATCHDOG_SETUP_TIMEOUT_SEC, TEST_AND_ANALYSIS_TIMEOUT_SEC))
+    parser.add_argument(
+        '--watchdog-no-progress-sec',
+        type=int,
+        default=WATCHDOG_NO_PROGRESS_SEC,
+        help='How long a running test may go without logging ops before the watchdog aborts it. '
+             'Default: %d' % WATCHDOG_NO_PROGRESS_SEC)
+    parser.add_argument(
+        '--watchdog-signatures',
+        help='JSON file with more fatal output signatures for the watchdog, as an object mapping '
+             'the result category to report to a substring of the output.')
+    parser.add_argument(
+        '--watchdog-retries',
+        type=int,
+        default=0,
+        help='How many times to rerun a test the watchdog aborted. Default: 0')
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Split every test into running it on the cluster with --skip-analysis and checking '
+             'its history with "lein run analyze" locally, so that the cluster runs the next test '
+             'while the previous one is analyzed.')
+    parser.add_argument(
+        '--analysis-workers',
+        type=int,
+        default=DEFAULT_ANALYSIS_WORKERS,
+        help='How many tests to analyze concurrently with --pipeline. Default: %d'
+             % DEFAULT_ANALYSIS_WORKERS)
+    parser.add_argument(
+        '--tarball-cache',
+        action='store_true',
+        help='Download the tarball once into ' + TARBALL_CACHE_DIR + ', verify its checksum, and '
+             'let the nodes install it from a local HTTP server instead of from --url.')
+    parser.add_argument(
+        '--tarball-cache-max-gb',
+        type=float,
+        default=TARBALL_CACHE_MAX_GB,
+        help='Size of the tarball cache above which the least recently used tarballs are '
+             'evicted. Default: %d' % TARBALL_CACHE_MAX_GB)
+    parser.add_argument(
+        '--tarball-cache-host',
+        help='Host name or address the nodes reach this machine at, for --tarball-cache. '
+             'Default: the local address on the route to the nodes.')
+    parser.add_argument(
+        '--tarball-cache-port',
+        type=int,
+        default=TARBALL_CACHE_PORT,
+        help='Port to serve the tarball cache on, for --tarball-cache. 0 picks a free port, which '
+             'makes the nodes reinstall the tarball in every sweep. Default: %d'
+             % TARBALL_CACHE_PORT)
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue an interrupted sweep with the same arguments: keep the results of the '
+             'tests it finished, as journaled in ' + JOURNAL_DIR + ', and only run the others.')
+    parser.add_argument(
+        '--retention-budget-gb',
+        type=float,
+        help='Disk space the sorted results and output logs of all clusters may take. The oldest '
+             'runs and logs are deleted to stay within it, except runs the retention policy '
+             'keeps all of. Default policy with a budget: ' + DEFAULT_RETENTION_KEEP)
+    parser.add_argument(
+        '--retention-keep',
+        type=parse_retention_keep,
+        help='Number of most recent runs to keep per result category, e.g. "ok=20,invalid=all". '
+             'Runs of categories that are not listed are only deleted to stay within the budget.')
+    parser.add_argument(
+        '--retention-compression',
+        choices=["none"] + sorted(COMPRESSION_SUFFIXES),
+        default="gzip",
+        help='How the retention policy compresses histories and logs. zstd needs the zstandard '
+             'package. Default: gzip')
+    parser.add_argument(
+        '--preflight',
+        action='store_true',
+        help='Before every test, check over SSH that all nodes of its cluster are reachable, have '
+             'enough disk and memory, and that their clocks are in sync, and postpone the test '
+             'while they are not.')
+    parser.add_argument(
+        '--preflight-max-wait-sec',
+        type=int,
+        default=PREFLIGHT_MAX_WAIT_SEC,
+        help='How long a cluster may keep failing the preflight before it is taken out of service, '
+             'or, if it is the last one, before its tests are reported as not run. '
+             'Default: %d' % PREFLIGHT_MAX_WAIT_SEC)
+    parser.add_argument(
+        '--perf-regressions',
+        action='store_true',
+        help='Store latency percentiles and throughput per op type of every run in the results '
+             'database, and report a perf JUnit test case per test that fails when they are '
+             'significantly worse than with the last %d other versions.' % PERF_BASELINE_VERSIONS)
+    parser.add_argument(
+        '--metrics-listen',
+        help='Serve live metrics of the sweep in the OpenMetrics format at /metrics on this '
+             'host:port, e.g. :9464 for all interfaces or localhost:9464.')
+    parser.add_argument(
+        '--metrics-textfile',
+        help='Rewrite this file with the same metrics every %d seconds, for the textfile '
+             'collector of the Prometheus node exporter. The file name should end in .prom.'
+             % METRICS_TEXTFILE_INTERVAL_SEC)
+    args = parser.parse_args()
+    if args.retention_keep is None and args.retention_budget_gb is not None:
+        args.retention_keep = parse_retention_keep(DEFAULT_RETENTION_KEEP)
+    if args.retention_compression == "zstd" and zstandard is None:
+        parser.error("--retention-compression zstd needs the zstandard package")
+    if args.watchdog_signatures:
+        with open(args.watchdog_signatures) as signatures_file:
+            for category, pattern in json.load(signatures_file).items():
+                add_watchdog_signature(category, pattern)
+    if args.shard is not None:
+        match = re.fullmatch(r"(\d+)/(\d+)", args.shard)
+        if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+            parser.error("--shard must be i/N with 1 <= i <= N")
+        args.shard = (int(match.group(1)), int(match.group(2)))
+    if args.parallel is not None and args.parallel < 1:
+        parser.error("--parallel must be positive")
+    if args.parallel is not None and args.parallel > 1 and not args.cluster_config:
+        parser.error("--parallel requires --cluster-config with at least that many clusters")
+    if args.max_nemeses_per_test < 1:
+        parser.error("--max-nemeses-per-test must be positive")
+    if args.nemesis_coverage is not None and \
+            not 1 <= args.nemesis_coverage <= args.max_nemeses_per_test:
+        parser.error("--nemesis-coverage must be between 1 and --max-nemeses-per-test (%d)"
+                     % args.max_nemeses_per_test)
+    if args.docker_pool is not None:
+        if args.cluster_config:
+            parser.error("--docker-pool and --cluster-config are mutually exclusive")
+        if args.docker_pool < 1:
+            parser.error("--docker-pool must be positive")
+    return args
+
+
+SUBCOMMANDS = {
+    "sort-results": sort_results_main,
+    "query": query_main,
+    "history": history_main,
+    "reportportal-replay": reportportal_replay_main,
+}
 
 
 def main():
     logging.basicConfig(
         level=logging.INFO,
-        format="%(asctime)s [%(filename)s:%(lineno)d %(levelname)s] %(message)s")
+        format="%(asctime)s [%(filename)s:%(lineno)d %(threadName)s %(levelname)s] %(message)s")
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        exit(SUBCOMMANDS[sys.argv[1]](sys.argv[2:]))
     args = parse_args()
 
     atexit.register(cleanup)
+    # Children run in their own process groups, so make sure they are cleaned up when we're killed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    docker_pool = None
+    if args.cluster_config:
+        clusters = load_cluster_config(args.cluster_config)
+        if args.parallel is not None:
+            if args.parallel > len(clusters):
+                logging.error("Requested %d parallel tests, but only %d clusters are configured in "
+                              "%s", args.parallel, len(clusters), args.cluster_config)
+                exit(1)
+            clusters = clusters[:args.parallel]
+    elif args.docker_pool:
+        docker_pool = DockerClusterPool(args.docker_pool, args.docker_pool_image,
+                                        args.docker_pool_network, args.url)
+        clusters = docker_pool.clusters
+    else:
+        clusters = [default_cluster()]
 
-    # Sort old results in the beginning if it did not happen at the end of the last run.
-    run_cmd(SORT_RESULTS_SH)
+    for cluster in clusters:
+        prepare_cluster_dirs(cluster)
+        # Sort old results in the beginning if it did not happen at the end of the last run.
+        sort_results(cluster.store_dir, cluster.sorted_dir)
 
     start_time = time.time()
-    nemeses = args.nemeses
-    if args.enable_clock_skew:
-        nemeses += ',clock-skew'
-
-    num_tests_run = 0
-    num_timed_out_tests = 0
-    total_test_time_sec = 0
-
-    if os.path.isdir(LOGS_DIR):
-        logging.info(f"Directory {LOGS_DIR} already exists", )
+    nemesis_sets = args.nemeses.split(';')
+    faults = []
+    if args.nemesis_coverage:
+        faults = list(dict.fromkeys(fault for nemesis_set in nemesis_sets
+                                    for fault in nemesis_set.split(',')))
+        if args.enable_clock_skew and "clock-skew" not in faults:
+            faults.append("clock-skew")
+        nemeses_label = "coverage-%d-%s" % (args.nemesis_coverage, '-'.join(faults))
     else:
-        logging.info(f"Creating directory {LOGS_DIR}")
-        os.mkdir(LOGS_DIR)
-
-    test_index = 0
-    num_everything_looks_good = 0
-    num_not_everything_looks_good = 0
-    num_zero_exit_code = 0
-    num_non_zero_exit_code = 0
+        if args.enable_clock_skew:
+            nemesis_sets = [nemesis_set + ',clock-skew' for nemesis_set in nemesis_sets]
+        nemeses_label = '_'.join(nemesis_set.replace(',', '-') for nemesis_set in nemesis_sets)
+    if args.shard is not None:
+        nemeses_label += "-shard-%d-of-%d" % args.shard
+
     url = args.url
 
     version = None
@@ -440,25 +2507,40 @@ def main():
     if version is None:
         raise AttributeError(f"Failed to parse version from URL {url}")
 
-    not_good_tests = []
-    lein_cmd = " ".join(["lein run test",
-                         "--os debian",
-                         f"--url {url}",
-                         f"--nemesis {nemeses}",
-                         f"--ssh-private-key ~/.ssh/id_rsa",  # tmp workaround for jepsen 0.2.7+ versions
-                         f"--concurrency {args.concurrency}"])
-
     if args.iterations:
-        lein_cmd += " --test-count 1"
         iteration_cnt = args.iterations
     else:
         iteration_cnt = 1
 
+    results_db = None
+    if args.results_db:
+        results_db = ResultsDb(args.results_db)
+
     all_workloads = args.workloads.split(',')
+    if args.nemesis_coverage:
+        failure_rates = {}
+        if args.shard is not None or args.resume:
+            # The plan must not depend on local state that differs between agents or changes
+            # between runs, or the shards or the resumed sweep would run a different matrix.
+            logging.info("Planning nemesis sets without failure rates because of --shard/--resume")
+        elif results_db is not None:
+            failure_rates = results_db.fault_failure_rates(version)
+        plan = plan_nemesis_coverage(all_workloads, faults, args.nemesis_coverage,
+                                     args.max_nemeses_per_test, failure_rates)
+        num_subsets = sum(math.comb(len(faults) - ("none" in faults), size)
+                          for size in range(1, args.max_nemeses_per_test + 1)) + ("none" in faults)
+        logging.info("Nemesis plan covering all combinations of %d of the faults %s, up to %d "
+                     "nemesis sets per workload instead of all %d sets of up to %d faults:\n    %s",
+                     args.nemesis_coverage, ", ".join(faults),
+                     max(map(len, plan.values())), num_subsets, args.max_nemeses_per_test,
+                     "\n    ".join(f"{workload}: {' '.join(sets)}"
+                                   for workload, sets in plan.items()))
+        nemesis_sets = sorted(set(chain(*plan.values())))
+    else:
+        plan = nemesis_sets
+    specs, workloads_to_skip = build_test_matrix(all_workloads, plan, iteration_cnt, version)
     workloads_to_evaluate = [workload for workload in all_workloads
-                             if is_version_at_least(get_workload_version(workload),
-                                                    version)]
-    workloads_to_skip = set(all_workloads) - set(workloads_to_evaluate)
+                             if workload not in workloads_to_skip]
 
     if not workloads_to_evaluate:
         logging.error(
@@ -466,143 +2548,160 @@ def main():
             f"Should be skipped: {workloads_to_skip}\n"
             f"Workloads to evaluate: {workloads_to_evaluate}")
         exit(1)
-
-    test_cases = {}
-    for test in workloads_to_evaluate:
-        for iteration in range(iteration_cnt):
-            total_elapsed_time_sec = time.time() - start_time
-            if args.max_time_sec is not None and total_elapsed_time_sec > args.max_time_sec:
-                logging.info(
-                    "Elapsed time is %.1f seconds, it has exceeded the max allowed time %.1f, "
-                    "stopping", total_elapsed_time_sec, args.max_time_sec)
-                break
-
-            test_index += 1
-            test_description_str = f"workload {test}, nemesis {nemeses}"
-            logging.info(
-                "\n%s\nStarting test run #%d - %s\n%s",
-                "=" * 80,
-                test_index,
-                test_description_str,
-                "=" * 80)
-            test_start_time_sec = time.time()
-            if '/set' in test:
-                test_run_time_limit_no_analysis_sec = SINGLE_TEST_RUN_TIME_FOR_SET_TEST
-            else:
-                test_run_time_limit_no_analysis_sec = SINGLE_TEST_RUN_TIME
-            full_cmd = lein_cmd + \
-                       " --time-limit " + str(test_run_time_limit_no_analysis_sec) + \
-                       " --workload " + test
-            result = run_cmd(
-                full_cmd,
-                timeout=TEST_AND_ANALYSIS_TIMEOUT_SEC,
-                exit_on_error=False,
-                log_name_prefix=f"{test.replace('/', '-')}_nemesis_{nemeses}_{test_index}",
-                num_lines_to_show=30)
-
-            test_elapsed_time_sec = time.time() - test_start_time_sec
-            if result.timed_out:
-                jepsen_log_file = os.path.join(STORE_DIR, 'current', 'jepsen.log')
-                num_timed_out_tests += 1
-                logging.info("Test timed out. Updating the log at %s", jepsen_log_file)
-                if os.path.exists(jepsen_log_file):
-                    msg = "Test run timed out!"
-                    logging.info(msg)
-                    with open(jepsen_log_file, "a") as f:
-                        f.write(msg)
-                else:
-                    logging.error("File %s does not exist!", jepsen_log_file)
-
-            test_name = f"{test}_{nemeses}"
-            tc = TestCase(name=test_name,
-                          classname=test.split('/')[0],
-                          elapsed_sec=test_elapsed_time_sec,
-                          url=args.build_url,
-                          stderr=result.output)
-            logging.info(
-                "Test run #%d: elapsed_time=%.1f, returncode=%d, everything_looks_good=%s",
-                test_index, test_elapsed_time_sec, result.returncode,
-                result.everything_looks_good)
-
-            if result.everything_looks_good:
-                num_everything_looks_good += 1
-
-                if test_name not in test_cases:
-                    test_cases[test_name] = tc
-            else:
-                tc.add_error_info(test_description_str)
-                num_not_everything_looks_good += 1
-                not_good_tests.append(test_description_str)
-
-                if result.timed_out:
-                    message = "Timed out"
-
-                    tc.add_error_info(message)
-                elif not result.everything_looks_good:
-                    message = "Failure on result validation"
-
-                    tc.add_error_info(message)
-                else:
-                    message = f"Process exited with error code {result.returncode}"
-
-                    tc.add_failure_info(message, failure_type="exit code")
-
-                # always add latest failed run for the results
-                test_cases[test_name] = tc
-
-            if result.returncode == 0:
-                num_zero_exit_code += 1
-            else:
-                num_non_zero_exit_code += 1
-
-            run_cmd(f"{SORT_RESULTS_SH} {nemeses}")
-
-            logging.info(
-                "\n%s\nFinished test run #%d (%s)\n%s",
-                "=" * 80, test_index, test_description_str, "=" * 80)
-
-            num_tests_run += 1
-            total_test_time_sec += test_elapsed_time_sec
-
-            total_elapsed_time_sec = time.time() - start_time
-            logging.info("Finished running %d tests.", num_tests_run)
-            logging.info("    %d okay, %d problems (%d timed-out)",
-                         num_everything_looks_good, num_not_everything_looks_good,
-                         num_timed_out_tests)
-            logging.info("    %d tests (out of %d total) returned non-zero exit code",
-                         num_non_zero_exit_code, num_tests_run)
-            logging.info("Elapsed time: %.1f sec, test time: %.1f sec, avg test time: %.1f sec",
-                         total_elapsed_time_sec, total_test_time_sec,
-                         total_test_time_sec / num_tests_run)
-            if not_good_tests:
-                logging.info("Tests where something does not look good:\n    %s",
-                             "\n    ".join(not_good_tests))
-        else:
-            # Next workload
-            continue
-        # Inner loop broken, skip remaining workloads
-        break
-
-    logging.warning(f"Skipped workloads because of version incompatibility {workloads_to_skip}")
-
-    logging.info("Sending JUnit XML report")
-    ts = TestSuite(f"Jepsen {nemeses.replace(',', '-')} {version}", test_cases.values())
+    if args.shard is not None:
+        expected_durations = None
+        if args.shard_durations:
+            expected_durations = load_expected_durations(args.shard_durations)
+        specs = get_shard(specs, *args.shard, expected_durations)
+
+    journal = SweepJournal(os.path.join(JOURNAL_DIR, f"{nemeses_label}-{version}.jsonl"))
+    journaled_outcomes = journal.load() if args.resume else []
+    # Number new tests after the journaled ones, so that their logs don't overwrite earlier logs.
+    report = SweepReport(start_time, len(journaled_outcomes))
+    confirmer = None
+    if args.confirm_failures:
+        confirmer = FailureConfirmer(args.confirm_failures, args.confirm_time_limit_sec,
+                                     os.path.join(CONFIRMATIONS_DIR, f"{nemeses_label}-{version}"))
+    if args.resume:
+        completed_test_ids = set()
+        for outcome in journaled_outcomes:
+            if confirmer is not None and confirmer.is_rerun(outcome):
+                confirmer.add_rerun(outcome)
+                continue
+            if outcome.category == "preflight-failed":
+                # The test was not run, so run it now.
+                continue
+            report.restore(outcome)
+            completed_test_ids.add(outcome.test_id)
+            if confirmer is not None:
+                confirmer.collect(outcome)
+        logging.info("Resuming the sweep from %s: %d of %d tests are done", journal.path,
+                     sum(1 for spec in specs if spec.test_id in completed_test_ids), len(specs))
+        specs = [spec for spec in specs if spec.test_id not in completed_test_ids]
+    journal.open(append=args.resume)
+    report.add_listener(journal.append)
+    if results_db is not None:
+        report.add_listener(lambda outcome: results_db.record_run(outcome, version, args.build_url))
+    metrics = None
+    if args.metrics_listen or args.metrics_textfile:
+        metrics = MetricsExporter(start_time, len(specs))
+        metrics.register(report)
+        if args.metrics_listen:
+            metrics.serve(args.metrics_listen)
+        if args.metrics_textfile:
+            metrics.write_textfile(args.metrics_textfile)
+    if confirmer is not None:
+        report.add_listener(confirmer.collect)
+    perf_detector = None
+    if args.perf_regressions:
+        if results_db is None:
+            logging.error("--perf-regressions needs the results database, see --results-db")
+            exit(1)
+        perf_detector = PerfRegressionDetector(results_db, version, report, args.build_url)
+        report.add_listener(perf_detector.submit)
+
+    xml_report_name = f"jepsen-junit-{nemeses_label}.xml"
+
+    def make_xml_report():
+        with report.lock:
+            test_cases = list(report.test_cases.values())
+        ts = TestSuite(f"Jepsen {nemeses_label} {version}", test_cases,
+                       properties=report.junit_properties())
+        return xml_report_name, to_xml_report_string([ts])
+
+    uploader = None
     if args.reportportal_base_url and args.reportportal_project_name and args.reportportal_api_token:
-        send_report_to_reportportal(f"jepsen-junit-{nemeses.replace(',', '-')}.xml",
-                                    to_xml_report_string([ts]),
-                                    args.reportportal_base_url,
-                                    args.reportportal_project_name,
-                                    args.reportportal_api_token,
-                                    version,
-                                    args.build_url)
+        uploader = ReportPortalUploader(
+            ReportPortalClient(args.reportportal_base_url, args.reportportal_project_name,
+                               args.reportportal_api_token),
+            REPORTPORTAL_SPOOL_DIR,
+            time.strftime("%Y%m%dT%H%M%S", time.localtime(start_time)) + "-" + xml_report_name,
+            make_xml_report, version, args.build_url)
+        uploader.start()
+        report.add_listener(uploader.notify)
     else:
         logging.warning("Skipped ReportPortal reporting due to missing args")
 
+    if args.adaptive_schedule:
+        if results_db is None:
+            logging.error("--adaptive-schedule needs the results database, see --results-db")
+            exit(1)
+        scheduler = AdaptiveScheduler(specs, args.max_time_sec, start_time,
+                                      results_db.workload_history(nemesis_sets), len(clusters))
+    else:
+        scheduler = FifoScheduler(specs, args.max_time_sec, start_time)
+    retention = None
+    if args.retention_keep is not None:
+        retention = RetentionEngine(
+            clusters,
+            None if args.retention_budget_gb is None else int(args.retention_budget_gb * (1 << 30)),
+            args.retention_keep,
+            None if args.retention_compression == "none" else args.retention_compression,
+            None if confirmer is None else confirmer.get_tracked_run_dirs)
+        retention.start()
+        report.add_listener(retention.request)
+    tarball_cache = None
+    if args.tarball_cache:
+        tarball_cache = TarballCache(TARBALL_CACHE_DIR, int(args.tarball_cache_max_gb * (1 << 30)))
+        nodes = [node for cluster in clusters for node in cluster.nodes or JEPSEN_DEFAULT_NODES]
+        tarball_cache.serve(args.tarball_cache_host or get_address_towards(nodes),
+                            args.tarball_cache_port)
+        url = tarball_cache.get_local_url(url)
+    logging.info("Running %d tests on %d cluster(s): %s", len(specs), len(clusters),
+                 ", ".join(cluster.name for cluster in clusters))
+    if docker_pool is not None:
+        docker_pool.start(url)
+        report.add_stop_listener(docker_pool.reset)
+    run_tests_on_clusters(scheduler, clusters, args, url, report)
+    if confirmer is not None and confirmer.failures:
+        rerun_specs = confirmer.get_rerun_specs()
+        logging.info("Confirming %d failed test(s) with %d rerun(s)", len(confirmer.failures),
+                     len(rerun_specs))
+        # The reruns are journaled so that a resumed sweep doesn't repeat them, but they are not
+        # checked for performance regressions.
+        rerun_report = SweepReport(time.time(), report.num_tests_started)
+        rerun_report.add_listener(journal.append)
+        rerun_report.add_listener(confirmer.add_rerun)
+        if results_db is not None:
+            rerun_report.add_listener(
+                lambda outcome: results_db.record_run(outcome, version, args.build_url))
+        if retention is not None:
+            rerun_report.add_listener(retention.request)
+        if docker_pool is not None:
+            rerun_report.add_stop_listener(docker_pool.reset)
+        if metrics is not None:
+            metrics.register(rerun_report)
+        run_tests_on_clusters(FifoScheduler(rerun_specs, args.max_time_sec, start_time), clusters,
+                              args, url, rerun_report)
+        confirmer.report_to(report, args.build_url)
+    if docker_pool is not None:
+        docker_pool.close()
+    if tarball_cache is not None:
+        tarball_cache.close()
+    if perf_detector is not None:
+        perf_detector.close()
+    report.log_phase_report()
+    if metrics is not None:
+        metrics.close()
+    journal.close()
+    if retention is not None:
+        retention.close()
+
+    logging.warning(
+        f"Skipped workloads because of version incompatibility {set(workloads_to_skip)}")
+    if results_db is not None:
+        results_db.close()
+
     logging.info("Storing JUnit XML reports locally")
-    with open(f"jepsen-junit-{nemeses.replace(',', '-')}.xml", "w") as xml_report:
-        xml_report.write(to_xml_report_string([ts]))
+    xml_report_name, xml_report_content = make_xml_report()
+    with open(xml_report_name, "w") as xml_report:
+        xml_report.write(xml_report_content)
+
+    if uploader is not None:
+        logging.info("Sending JUnit XML report")
+        uploader.finish()
 
-    if not_good_tests:
+    if report.not_good_tests:
         exit(1)
     else:
         exit(0)
@@ -289,13 +289,19 @@
                             :start      #{:start-partition}
                             :stop       #{:stop-partition}
                             :fill-color "#888888"}}})
-        checker (if (is-stub-workload (:workload opts))
-                  (:checker workload)
-                  (checker/compose {:perf                 perf
-                                    :stats                (checker/stats)
-                                    :unhandled-exceptions (checker/unhandled-exceptions)
-                                    :clock                (checker/clock-plot)
-                                    :workload             (:checker workload)}))]
+        checker (cond (:skip-analysis opts)
+                      ; The history is checked later by yugabyte.runner/analyze-cmd
+                      (checker/unbridled-optimism)
+
+                      (is-stub-workload (:workload opts))
+                      (:checker workload)
+
+                      :else
+                      (checker/compose {:perf                 perf
+                                        :stats                (checker/stats)
+                                        :unhandled-exceptions (checker/unhandled-exceptions)
+                                        :clock                (checker/clock-plot)
+                                        :workload             (:checker workload)}))]
     (merge tests/noop-test
            opts
            (dissoc workload
@@ -1,10 +1,14 @@
 (ns yugabyte.runner
   "Runs YugaByteDB tests."
   (:gen-class)
-  (:require [clojure.pprint :refer [pprint]]
+  (:require [clojure.data.json :as json]
+            [clojure.java.io :as io]
+            [clojure.pprint :refer [pprint]]
             [clojure.string :as str]
+            [clojure.tools.cli :as tools.cli]
             [clojure.tools.logging :refer :all]
             [jepsen.core :as jepsen]
+            [jepsen.checker :as checker]
             [jepsen.cli :as cli]
             [jepsen.store :as store]
             [yugabyte.core :as core]))
@@ -113,6 +117,9 @@
     :default nil]
 
    [nil "--trace-cql" "If provided, logs CQL queries"
+    :default false]
+
+   [nil "--skip-analysis" "Don't check the history at the end of the test, leave it to the `analyze` command"
     :default false]])
 
 (def test-all-opts
@@ -198,11 +205,87 @@
                   (println (count (results :crashed)) "crashed")
                   (println (count (results false)) "failures")))}})
 
+(def worker-result-prefix
+  "Prefix of the line the worker prints with the JSON result of every test."
+  "@@yugabyte.runner/result ")
+
+(defn run-worker-test!
+  "Parses the arguments of a `test` command, runs that test and returns a map
+  describing its outcome."
+  [args]
+  (let [opt-spec (cli/merge-opt-specs cli/test-opt-spec
+                                      (concat cli-opts single-test-opts))
+        {:keys [options errors]} (-> args
+                                     (tools.cli/parse-opts opt-spec)
+                                     (update :options assoc :argv args)
+                                     cli/test-opt-fn)]
+    (if (seq errors)
+      {:valid "error"
+       :errors errors}
+      (let [test   (jepsen/run! (core/yb-test options))
+            valid? (:valid? (:results test))]
+        {:valid (if (keyword? valid?) (name valid?) valid?)
+         :store (.getPath (store/path test))}))))
+
+(defn worker-cmd
+  "A command which runs tests one after another in the same JVM, so that only
+  the first one pays for dependency resolution, compilation and JVM warm-up.
+  Reads one JSON array of `test` command arguments per line from stdin, and
+  prints a line starting with worker-result-prefix with a JSON result after
+  each test. Exits when stdin is closed."
+  []
+  {"worker"
+   {:opt-spec [cli/help-opt]
+    :usage    "Runs tests read from stdin, one JSON array of `test` arguments per line"
+    :run      (fn [_]
+                (doseq [line  (line-seq (io/reader *in*))
+                        :when (not (str/blank? line))]
+                  (let [result (try
+                                 (run-worker-test! (json/read-str line))
+                                 (catch Throwable t
+                                   (warn t "Test crashed")
+                                   {:valid "crashed"
+                                    :error (str t)}))]
+                    (println (str worker-result-prefix (json/write-str result)))
+                    (flush))))}})
+
+(defn analyze-cmd
+  "A command which checks the history of a test that was run with
+  --skip-analysis. Takes the options of that test, so that it builds the same
+  checker, and the test's store directory. Writes results.edn and logs the
+  results like `test` does, but leaves the store symlinks alone, since another
+  test may be running in the same store meanwhile. Exits with 0 if the history
+  is valid, 1 if it is invalid and 2 if its validity is unknown."
+  []
+  {"analyze"
+   {:opt-spec (cli/merge-opt-specs
+                cli/test-opt-spec
+                (concat cli-opts
+                        single-test-opts
+                        [[nil "--store-path DIR" "Store directory of the test to analyze"
+                          :missing "--store-path is required"]]))
+    :opt-fn   cli/test-opt-fn
+    :usage    "Analyzes the history of a test run with --skip-analysis"
+    :run      (fn [{:keys [options]}]
+                (let [stored  (store/test (:store-path options))
+                      test    (merge (core/yb-test (dissoc options :skip-analysis))
+                                     stored)
+                      results (checker/check-safe (:checker test) test (:history test))
+                      test    (assoc test :results results)]
+                  (store/write-results! test)
+                  (jepsen/log-results test)
+                  (System/exit (case (:valid? results)
+                                 true  0
+                                 false 1
+                                 2))))}})
+
 (defn -main
   "Handles CLI arguments"
   [& args]
   (cli/run! (merge (cli/serve-cmd)
                    (test-all-cmd)
+                   (worker-cmd)
+                   (analyze-cmd)
                    (cli/single-test-cmd {:test-fn  core/yb-test
                                          :opt-spec (concat cli-opts
                                                            single-test-opts)}))